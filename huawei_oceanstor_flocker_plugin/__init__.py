@@ -2,15 +2,40 @@
 # See LICENSE file for details.
 
 from flocker.node import BackendDescription, DeployerType
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.log import LOG
+from huawei_oceanstor_flocker_plugin.metrics import METRICS
 from huawei_oceanstor_flocker_plugin.huawei_oceanstor_blockdevice import (
     HuaweiBlockDeviceAPI
 )
 
 
 def api_factory(cluster_id, **kwargs):
-    return HuaweiBlockDeviceAPI(cluster_id=cluster_id,
-                                api_id=kwargs[u"api_id"],
-                                api_key=kwargs[u"api_key"])
+    if kwargs.get(u"log_level"):
+        LOG.set_level(kwargs[u"log_level"])
+    api = HuaweiBlockDeviceAPI(cluster_id=cluster_id,
+                               api_id=kwargs[u"api_id"],
+                               api_key=kwargs[u"api_key"],
+                               list_workers=kwargs.get(
+                                   u"list_workers",
+                                   constants.LIST_VOLUMES_WORKERS),
+                               instance_id_file=kwargs.get(
+                                   u"instance_id_file",
+                                   constants.INSTANCE_ID_CACHE_FILE),
+                               volume_cache_ttl=kwargs.get(
+                                   u"volume_cache_ttl",
+                                   constants.VOLUME_CACHE_TTL),
+                               volume_cache_size=kwargs.get(
+                                   u"volume_cache_size",
+                                   constants.VOLUME_CACHE_SIZE),
+                               max_parallel=kwargs.get(
+                                   u"max_parallel",
+                                   constants.LNDYNAMIC_MAX_PARALLEL))
+    if kwargs.get(u"metrics_file"):
+        METRICS.export_to_file(kwargs[u"metrics_file"])
+    if kwargs.get(u"metrics_port"):
+        METRICS.serve(kwargs[u"metrics_port"])
+    return api
 
 FLOCKER_BACKEND = BackendDescription(
     name=u"huawei_oceanstor_flocker_plugin",
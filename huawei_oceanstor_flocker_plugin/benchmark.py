@@ -0,0 +1,170 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Offline benchmark of ``HuaweiBlockDeviceAPI`` against ``FakeLunaNode``.
+
+For each inventory size, every ``IBlockDeviceAPI`` method is timed over a
+number of iterations and the API calls it made, its wall time and its p50
+and p99 latency are reported::
+
+    python -m huawei_oceanstor_flocker_plugin.benchmark --latency 0.02
+"""
+
+from uuid import uuid4
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from huawei_oceanstor_flocker_plugin.device_events import DeviceMonitor
+from huawei_oceanstor_flocker_plugin.device_resolver import DeviceResolver
+from huawei_oceanstor_flocker_plugin.fake_lunanode import FakeLunaNode
+from huawei_oceanstor_flocker_plugin.huawei_oceanstor_blockdevice import (
+    HuaweiBlockDeviceAPI
+)
+from huawei_oceanstor_flocker_plugin.rate_limit import AdaptiveRateLimiter
+
+API_ID = 'a' * 16
+API_KEY = 'b' * 128
+GiB = 1024 * 1024 * 1024
+
+METHODS = ['compute_instance_id', 'list_volumes', 'create_volume',
+           'attach_volume', 'get_device_path', 'detach_volume',
+           'destroy_volume']
+
+
+def percentile(samples, fraction):
+    """
+    :returns: The nearest-rank ``fraction`` percentile of ``samples``.
+    """
+    ordered = sorted(samples)
+    index = max(0, int(round(fraction * len(ordered) + 0.5)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class _Recorder(object):
+    def __init__(self, fake):
+        self.fake = fake
+        self.samples = dict((method, []) for method in METHODS)
+        self.calls = dict((method, 0) for method in METHODS)
+
+    def run(self, method, function, *args):
+        calls = self.fake.total_calls()
+        start = time.time()
+        result = function(*args)
+        self.samples[method].append(time.time() - start)
+        self.calls[method] += self.fake.total_calls() - calls
+        return result
+
+
+def run(volumes, iterations, latency=0, list_includes_status=False,
+        rate=None):
+    """
+    Benchmark one inventory size.
+
+    Volumes are attached to a peer VM, so ``attach_volume`` does not wait
+    for a local device to appear.
+
+    :param int volumes: Number of volumes in the fake account.
+    :param int iterations: Times each method is called.
+    :param float latency: Seconds added to every fake API request.
+    :param bool list_includes_status: Whether ``volume/list`` carries
+        attachment data.
+    :param float rate: Client-side API rate limit in requests per second,
+        ``None`` for no limit.
+    :returns: A ``dict`` mapping method name to a result ``dict``.
+    """
+    fake = FakeLunaNode(API_ID, API_KEY, volumes=volumes, latency=latency,
+                        list_includes_status=list_includes_status)
+    fake.start()
+    root = tempfile.mkdtemp()
+    api = HuaweiBlockDeviceAPI(
+        cluster_id=unicode(uuid4()), api_id=API_ID, api_key=API_KEY,
+        instance_id_file=None, api_url=fake.api_url,
+        hostname_url=fake.hostname_url,
+        device_resolver=DeviceResolver(sys_root=root, dev_root=root),
+        device_monitor=DeviceMonitor(sys_root=root, use_netlink=False))
+    if rate is None:
+        api.api.limiter = AdaptiveRateLimiter(rate=1e9, burst=1e9,
+                                              max_rate=1e9)
+    else:
+        api.api.limiter = AdaptiveRateLimiter(rate=rate, max_rate=rate)
+    peer = fake.vm_id(fake.hostname + '-peer')
+    recorder = _Recorder(fake)
+    try:
+        for _ in range(iterations):
+            # Drop the memoized instance ID so every call is measured
+            # the way the first one of a process is.
+            api._instance_id = None
+            recorder.run('compute_instance_id', api.compute_instance_id)
+            recorder.run('list_volumes', api.list_volumes)
+            volume = recorder.run('create_volume', api.create_volume,
+                                  uuid4(), GiB)
+            recorder.run('attach_volume', api.attach_volume,
+                         volume.blockdevice_id, peer)
+            # Expose the volume as if the peer were this node, for
+            # get_device_path to find.
+            device = os.path.join(root, 'block', 'vdc')
+            os.makedirs(device)
+            with open(os.path.join(device, 'serial'), 'w') as f:
+                f.write(volume.blockdevice_id)
+            recorder.run('get_device_path', api.get_device_path,
+                         volume.blockdevice_id)
+            shutil.rmtree(device)
+            recorder.run('detach_volume', api.detach_volume,
+                         volume.blockdevice_id)
+            recorder.run('destroy_volume', api.destroy_volume,
+                         volume.blockdevice_id)
+    finally:
+        # Close the kept-alive connections before the server goes away.
+        api.api.pool.close()
+        fake.stop()
+        shutil.rmtree(root)
+
+    results = {}
+    for method in METHODS:
+        samples = recorder.samples[method]
+        results[method] = {
+            'api_calls': float(recorder.calls[method]) / len(samples),
+            'wall': sum(samples),
+            'p50': percentile(samples, 0.50),
+            'p99': percentile(samples, 0.99),
+        }
+    return results
+
+
+def report(volumes, results):
+    lines = ['%d volumes' % volumes,
+             '%-20s %10s %10s %10s %10s' % ('method', 'calls/op', 'wall s',
+                                            'p50 ms', 'p99 ms')]
+    for method in METHODS:
+        result = results[method]
+        lines.append('%-20s %10.1f %10.3f %10.2f %10.2f' % (
+            method, result['api_calls'], result['wall'],
+            result['p50'] * 1000, result['p99'] * 1000))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every API request')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='client-side API rate limit, default none')
+    parser.add_argument('--list-includes-status', action='store_true',
+                        help='serve attachment data in volume/list')
+    options = parser.parse_args(argv)
+    for volumes in options.sizes:
+        results = run(volumes, options.iterations, options.latency,
+                      options.list_includes_status, options.rate)
+        print report(volumes, results)
+        print
+
+
+if __name__ == '__main__':
+    main()
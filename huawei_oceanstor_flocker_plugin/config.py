@@ -0,0 +1,205 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+The Huawei XML configuration file, parsed once and reloaded when it
+changes.
+"""
+
+from collections import namedtuple
+import os
+import threading
+
+import six
+from xml.etree import ElementTree as ET
+
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+
+class InvalidConfig(Exception):
+    """
+    A configuration file is not well-formed XML.
+    """
+
+
+class HuaweiConfig(namedtuple('HuaweiConfig', [
+        'login_info', 'protocol', 'iscsi', 'pools', 'lun_params',
+        'instance_id'])):
+    """
+    The settings of a configuration file.
+
+    Fields the file doesn't set, or sets to an invalid value, are
+    ``None``; the reason is logged when the file is parsed. The fields
+    that hold containers are handed out as copies by ``huawei_utils``, so
+    the shared object is never changed.
+    """
+
+
+def _text(root, path):
+    text = root.findtext(path)
+    return text.strip() if text is not None else None
+
+
+def _login_info(root):
+    login_info = {'RestURL': _text(root, 'Storage/RestURL')}
+    for key in ['UserName', 'UserPassword']:
+        node = root.find('Storage/%s' % key)
+        login_info[key] = node.text if node is not None else None
+    login_info['RegistrationFile'] = _text(root, 'Storage/RegistrationFile')
+    return login_info
+
+
+def _protocol(root):
+    protocol = _text(root, 'Storage/Protocol')
+    if protocol in ('iSCSI', 'FC'):
+        return protocol
+    LOG.error("Wrong protocol. Protocol should be set to either "
+              "iSCSI or FC.")
+    return None
+
+
+def _iscsi(root):
+    target_ip = _text(root, 'iSCSI/DefaultTargetIP')
+    if target_ip is None:
+        return None
+    initiator_list = []
+    for dic in root.findall('iSCSI/Initiator'):
+        # Strip values of dict.
+        initiator_list.append(dict((k, v.strip()) for k, v in dic.items()))
+    return {'DefaultTargetIP': target_ip, 'Initiator': initiator_list}
+
+
+def _pools(root):
+    pool_names = root.findtext('LUN/StoragePool')
+    if not pool_names:
+        LOG.error('Invalid resource pool name. '
+                  'Please check the config file.')
+        return None
+    return pool_names
+
+
+def _lun_params(root):
+    # Default lun set information.
+    lunsetinfo = {
+        'LUNType': 0,
+        'StripUnitSize': '64',
+        'WriteType': '1',
+        'MirrorSwitch': '1',
+        'PrefetchType': '3',
+        'PrefetchValue': '0',
+        'PrefetchTimes': '0',
+        'policy': '0',
+        'readcachepolicy': '2',
+        'writecachepolicy': '5',
+    }
+    luntype = root.findtext('LUN/LUNType')
+    if luntype:
+        if luntype.strip() == 'Thick':
+            lunsetinfo['LUNType'] = 0
+        elif luntype.strip() == 'Thin':
+            lunsetinfo['LUNType'] = 1
+        else:
+            LOG.error("LUNType config is wrong. LUNType must be 'Thin'"
+                      " or 'Thick'. LUNType: %(luntype)s.",
+                      {'luntype': luntype})
+            return None
+
+    for key in ('StripUnitSize', 'WriteType', 'MirrorSwitch'):
+        value = root.findtext('LUN/%s' % key)
+        if value is not None:
+            lunsetinfo[key] = value.strip()
+
+    prefetch = root.find('LUN/Prefetch')
+    if prefetch is not None and prefetch.attrib['Type']:
+        fetchtype = prefetch.attrib['Type']
+        if fetchtype in ['0', '1', '2', '3']:
+            lunsetinfo['PrefetchType'] = fetchtype.strip()
+            typevalue = prefetch.attrib['Value'].strip()
+            if lunsetinfo['PrefetchType'] == '1':
+                double_value = int(typevalue) * 2
+                lunsetinfo['PrefetchValue'] = six.text_type(double_value)
+            elif lunsetinfo['PrefetchType'] == '2':
+                lunsetinfo['PrefetchValue'] = typevalue
+        else:
+            LOG.error('PrefetchType config is wrong. PrefetchType'
+                      ' must be in 0,1,2,3. PrefetchType is: %(fetchtype)s.',
+                      {'fetchtype': fetchtype})
+            return None
+    else:
+        LOG.info('Use default PrefetchType. PrefetchType: Intelligent.')
+
+    return lunsetinfo
+
+
+def parse_config(xml_file_path):
+    """
+    Parse and validate a configuration file.
+
+    :returns: A ``HuaweiConfig``.
+    :raises InvalidConfig: If the file is not well-formed XML.
+    """
+    try:
+        root = ET.parse(xml_file_path).getroot()
+    except IOError as err:
+        LOG.error('parse_xml_file: %s.', err)
+        raise
+    except ET.ParseError as err:
+        msg = 'Config file %s is not valid XML: %s' % (xml_file_path, err)
+        LOG.error(msg)
+        raise InvalidConfig(msg)
+    return HuaweiConfig(login_info=_login_info(root),
+                        protocol=_protocol(root),
+                        iscsi=_iscsi(root),
+                        pools=_pools(root),
+                        lun_params=_lun_params(root),
+                        instance_id=_text(root, 'Instance/ID'))
+
+
+class ConfigLoader(object):
+    """
+    Cache of parsed configuration files, each reparsed only when its
+    modification time or size changes.
+    """
+
+    def __init__(self, stat=os.stat):
+        self._stat = stat
+        self._lock = threading.Lock()
+        self._configs = {}
+
+    def load(self, xml_file_path):
+        """
+        :returns: The ``HuaweiConfig`` of the file as it is now.
+        """
+        info = self._stat(xml_file_path)
+        version = (info.st_mtime, info.st_size)
+        with self._lock:
+            cached = self._configs.get(xml_file_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        config = parse_config(xml_file_path)
+        with self._lock:
+            self._configs[xml_file_path] = (version, config)
+        return config
+
+    def invalidate(self, xml_file_path=None):
+        """Forget one parsed file, or all of them."""
+        with self._lock:
+            if xml_file_path is None:
+                self._configs.clear()
+            else:
+                self._configs.pop(xml_file_path, None)
+
+
+_loader = ConfigLoader()
+
+
+def load_config(xml_file_path):
+    """
+    :returns: The ``HuaweiConfig`` of ``xml_file_path``, parsed at most
+        once per change of the file.
+    """
+    return _loader.load(xml_file_path)
+
+
+def invalidate_config(xml_file_path=None):
+    _loader.invalidate(xml_file_path)
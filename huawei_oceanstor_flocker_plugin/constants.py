@@ -16,3 +16,47 @@ MAPPING_VIEW_PREFIX = 'Flocker_Mapping_View_'
 
 ARRAY_VERSION = 'V300R003C00'
 HUAWEI_CONFIG_FILE = '/etc/flocker/flocker_huawei_conf.xml'
+ISCSI_INITIATOR_FILE = '/etc/iscsi/initiatorname.iscsi'
+
+LIST_VOLUMES_WORKERS = 8
+
+HTTP_POOL_MAX_SIZE = 4
+HTTP_POOL_IDLE_TIMEOUT = 60
+LNDYNAMIC_TIMEOUT = 30
+LNDYNAMIC_MAX_PARALLEL = 8
+
+RANCHER_HOSTNAME_URL = 'http://rancher-metadata/latest/self/host/hostname'
+INSTANCE_ID_CACHE_FILE = '/var/lib/flocker/lunanode_instance_id.json'
+HOST_REGISTRATION_FILE = '/var/lib/flocker/huawei_registration.json'
+
+VOLUME_CACHE_TTL = 5
+VOLUME_CACHE_SIZE = 1024
+
+DEVICE_WAIT_TIMEOUT = 60
+DEVICE_POLL_INTERVAL = 1
+DEVICE_MAP_FILE = '/var/lib/flocker/lunanode_devices.json'
+
+API_RATE = 20
+API_BURST = 50
+API_MIN_RATE = 0.5
+API_RATE_INCREASE = 0.5
+API_RATE_DECREASE = 0.5
+API_SLOW_THRESHOLD = 5
+API_RETRIES = 3
+API_RETRY_BASE = 0.5
+API_RETRY_CAP = 8
+
+METRICS_EXPORT_INTERVAL = 15
+
+REST_PAGE_SIZE = 100
+REGISTRATION_VERIFY_INTERVAL = 3600
+
+RESCAN_COALESCE_WINDOW = 0.2
+
+REST_LOG_PAYLOADS = False
+REST_LOG_MAX_BYTES = 2048
+REST_LOG_SAMPLE_EVERY = 1
+# The listing endpoints return the whole array inventory.
+REST_LOG_ENDPOINT_SAMPLE = {'host': 100, 'hostgroup': 100, 'lungroup': 100,
+                            'mappingview': 100, 'iscsi_initiator': 100,
+                            'fc_initiator': 100}
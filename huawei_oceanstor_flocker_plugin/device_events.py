@@ -0,0 +1,198 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Wait for block devices to appear, driven by kernel uevents.
+"""
+
+from collections import namedtuple
+import os
+import socket
+import threading
+import time
+
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 64 * 1024
+
+DeviceEvent = namedtuple('DeviceEvent', ['action', 'name'])
+
+
+def parse_uevent(data):
+    """
+    Parse a kernel uevent datagram.
+
+    :param bytes data: ``action@devpath`` followed by NUL separated
+        ``KEY=VALUE`` pairs.
+    :returns: A ``DeviceEvent`` for block disks, ``None`` for anything else.
+    """
+    fields = data.split('\0')
+    env = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition('=')
+        if sep:
+            env[key] = value
+    if env.get('SUBSYSTEM') != 'block' or env.get('DEVTYPE') != 'disk':
+        return None
+    action = env.get('ACTION')
+    name = env.get('DEVNAME') or os.path.basename(env.get('DEVPATH', ''))
+    if not action or not name:
+        return None
+    return DeviceEvent(action, os.path.basename(name))
+
+
+class DeviceMonitor(object):
+    """
+    Tracks which block devices are present.
+
+    Once started, a daemon thread listens for kernel uevents on a netlink
+    socket; where that socket cannot be opened, it polls ``/sys/block``
+    every ``poll_interval`` seconds instead. Events can also be fed in
+    with ``inject``, which is how tests drive the monitor.
+    """
+
+    def __init__(self, sys_root='/sys',
+                 poll_interval=constants.DEVICE_POLL_INTERVAL,
+                 use_netlink=True, clock=time.time):
+        """
+        :param str sys_root: Mount point of sysfs.
+        :param float poll_interval: Seconds between ``/sys/block`` scans
+            when uevents are unavailable.
+        :param bool use_netlink: Whether to try listening for uevents.
+        :param clock: Callable returning the current time in seconds.
+        """
+        self._sys_block = os.path.join(sys_root, 'block')
+        self._poll_interval = poll_interval
+        self._use_netlink = use_netlink
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._present = self._scan()
+        # Bumped on every change of ``_present``.
+        self._generation = 0
+        self._thread = None
+        self._stopped = False
+
+    def _scan(self):
+        try:
+            return set(os.listdir(self._sys_block))
+        except OSError as err:
+            LOG.error("Can't list %s: %s", self._sys_block, err)
+            return set()
+
+    def _open_netlink(self):
+        if not self._use_netlink or not hasattr(socket, 'AF_NETLINK'):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                 NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        except socket.error as err:
+            LOG.info("Can't listen for uevents, polling %s instead: %s",
+                     self._sys_block, err)
+            return None
+        sock.settimeout(self._poll_interval)
+        return sock
+
+    def start(self):
+        """Start listening for device events, if not already started."""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            sock = self._open_netlink()
+            if sock is not None:
+                target, args = self._listen, (sock,)
+            else:
+                target, args = self._poll, ()
+            self._thread = threading.Thread(target=target, args=args,
+                                            name='huawei-device-events')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the listener thread."""
+        with self._condition:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _listen(self, sock):
+        try:
+            while not self._stopped:
+                try:
+                    data = sock.recv(UEVENT_BUFFER_SIZE)
+                except socket.timeout:
+                    continue
+                event = parse_uevent(data)
+                if event is not None:
+                    self.inject(event)
+        finally:
+            sock.close()
+
+    def _poll(self):
+        while not self._stopped:
+            self.resync()
+            time.sleep(self._poll_interval)
+
+    def resync(self):
+        """Bring the device set in line with ``/sys/block``."""
+        present = self._scan()
+        with self._condition:
+            if present != self._present:
+                self._present = present
+                self._generation += 1
+                self._condition.notify_all()
+
+    def inject(self, event):
+        """
+        Apply a ``DeviceEvent`` and wake up waiters.
+
+        :param DeviceEvent event: The device event.
+        """
+        with self._condition:
+            if event.action == 'add':
+                self._present.add(event.name)
+            elif event.action == 'remove':
+                self._present.discard(event.name)
+            else:
+                return
+            self._generation += 1
+            self._condition.notify_all()
+
+    def present(self):
+        """
+        :returns: A ``frozenset`` of the device names currently present.
+        """
+        with self._condition:
+            return frozenset(self._present)
+
+    def wait_for(self, predicate, timeout):
+        """
+        Block until ``predicate`` holds for the present devices.
+
+        The predicate is called without the lock held, so it may be slow
+        without holding up the listener.
+
+        :param predicate: Callable taking a ``frozenset`` of device names
+            and returning a true value once the wait is over.
+        :param float timeout: Seconds to wait at most.
+        :returns: The last value ``predicate`` returned, false on timeout.
+        """
+        deadline = self._clock() + timeout
+        self.resync()
+        while True:
+            with self._condition:
+                generation = self._generation
+                present = frozenset(self._present)
+            result = predicate(present)
+            remaining = deadline - self._clock()
+            if result or remaining <= 0:
+                return result
+            with self._condition:
+                # Only sleep if nothing changed while the predicate ran.
+                if self._generation == generation:
+                    self._condition.wait(remaining)
@@ -0,0 +1,219 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Map LunaNode volumes to local virtio block devices.
+"""
+
+from threading import Lock
+import os
+
+from twisted.python.filepath import FilePath
+
+from huawei_oceanstor_flocker_plugin import huawei_utils
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+# virtio-blk truncates the disk serial to 20 bytes.
+VIRTIO_SERIAL_LENGTH = 20
+BY_ID_PREFIX = 'virtio-'
+
+
+class DeviceResolver(object):
+    """
+    Index of local virtio block devices by serial, read from sysfs and
+    ``/dev/disk/by-id``.
+
+    The index is only rebuilt when a device appears, disappears or is
+    replaced by another one under the same name, so resolving a device
+    path normally costs one directory listing and no API calls. A device
+    found in the index is checked to still carry the serial it was found
+    by before it is returned, and the index is rebuilt if it does not.
+
+    Devices learned when a volume was attached are remembered too, for
+    volumes whose serial does not carry their ID, and persisted to
+    ``state_file`` so they survive a restart of the agent.
+    """
+
+    def __init__(self, sys_root='/sys', dev_root='/dev', state_file=None):
+        """
+        :param str sys_root: Mount point of sysfs.
+        :param str dev_root: Mount point of devfs.
+        :param state_file: The path of the file remembered devices are
+            persisted to, or ``None`` to keep them in memory only.
+        """
+        self._sys_block = os.path.join(sys_root, 'block')
+        self._by_id = os.path.join(dev_root, 'disk', 'by-id')
+        self._dev_root = dev_root
+        self._state_file = state_file
+        self._lock = Lock()
+        self._devices = None
+        self._by_serial = {}
+        # blockdevice_id -> [name, identity of the device when learned]
+        self._by_volume = {}
+        if state_file is not None:
+            state = huawei_utils.load_json_state(state_file)
+            if isinstance(state, dict):
+                self._by_volume = state
+
+    def identity(self, name):
+        """
+        :returns: What tells device ``name`` apart from a later device
+            given the same name, or ``None`` if it is not present.
+        """
+        try:
+            info = os.lstat(os.path.join(self._sys_block, name))
+        except OSError:
+            return None
+        return [info.st_ino, info.st_ctime]
+
+    def devices(self):
+        """
+        :returns: A ``dict`` mapping the names of the virtio block devices
+            present to their ``identity``.
+        """
+        try:
+            names = os.listdir(self._sys_block)
+        except OSError as err:
+            LOG.error("Can't list %s: %s", self._sys_block, err)
+            return {}
+        devices = {}
+        for name in names:
+            if name.startswith('vd'):
+                identity = self.identity(name)
+                if identity is not None:
+                    devices[name] = identity
+        return devices
+
+    def _read_serial(self, name):
+        try:
+            with open(os.path.join(self._sys_block, name, 'serial')) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def _by_id_serials(self, devices):
+        """
+        :returns: A ``list`` of ``(serial, name)`` of the by-id links to
+            ``devices``.
+        """
+        try:
+            links = os.listdir(self._by_id)
+        except OSError:
+            return []
+        serials = []
+        for link in links:
+            if not link.startswith(BY_ID_PREFIX) or '-part' in link:
+                continue
+            target = os.path.basename(
+                os.path.realpath(os.path.join(self._by_id, link)))
+            if target in devices:
+                serials.append((link[len(BY_ID_PREFIX):], target))
+        return serials
+
+    def _build_index(self, devices):
+        by_serial = {}
+        for name in devices:
+            serial = self._read_serial(name)
+            if serial:
+                by_serial[serial] = name
+        for serial, name in self._by_id_serials(devices):
+            by_serial.setdefault(serial, name)
+        return by_serial
+
+    def _save(self):
+        # Called with the lock held.
+        if self._state_file is not None:
+            huawei_utils.save_json_state(self._state_file, self._by_volume)
+
+    def refresh(self, force=False):
+        """
+        Rebuild the index if a device appeared, disappeared or was
+        replaced.
+
+        :param bool force: Rebuild even if the devices are unchanged.
+        """
+        devices = self.devices()
+        with self._lock:
+            if not force and devices == self._devices:
+                return
+            self._devices = devices
+            self._by_serial = self._build_index(devices)
+            changed = False
+            for blockdevice_id, (name, identity) in self._by_volume.items():
+                if devices.get(name) != identity:
+                    del self._by_volume[blockdevice_id]
+                    changed = True
+            if changed:
+                self._save()
+        LOG.debug("Device index refreshed: %s", self._by_serial)
+
+    def remember(self, blockdevice_id, name):
+        """Record that ``blockdevice_id`` is the device called ``name``."""
+        identity = self.identity(name)
+        if identity is None:
+            return
+        with self._lock:
+            self._by_volume[unicode(blockdevice_id)] = [name, identity]
+            self._save()
+
+    def forget(self, blockdevice_id):
+        """Drop what was learned about ``blockdevice_id``."""
+        with self._lock:
+            if self._by_volume.pop(unicode(blockdevice_id), None):
+                self._save()
+
+    def _carries(self, name, serial):
+        """
+        Whether device ``name`` has ``serial`` right now.
+        """
+        current = self._read_serial(name)
+        if current:
+            return current[:VIRTIO_SERIAL_LENGTH] == serial
+        return (serial, name) in self._by_id_serials([name])
+
+    def _find(self, blockdevice_id, serials):
+        """
+        :returns: The name of the device of a volume in the index, checked
+            against sysfs, or ``None``.
+        """
+        with self._lock:
+            remembered = self._by_volume.get(blockdevice_id)
+        if remembered is not None:
+            name, identity = remembered
+            if self.identity(name) == identity:
+                return name
+        for serial in (blockdevice_id,) + tuple(serials):
+            serial = serial[:VIRTIO_SERIAL_LENGTH]
+            with self._lock:
+                name = self._by_serial.get(serial)
+            if name is None:
+                continue
+            if self._carries(name, serial):
+                return name
+            with self._lock:
+                # Make the next refresh rebuild the index.
+                self._devices = None
+        return None
+
+    def lookup(self, blockdevice_id, serials=()):
+        """
+        Find the local device of a volume.
+
+        A miss is answered from the index as it stands, unless the index
+        turned out to be stale on the way, in which case it is rebuilt
+        and searched once more.
+
+        :param unicode blockdevice_id: The volume ID.
+        :param serials: Further serials the volume may be exposed with.
+        :returns: A ``FilePath`` for the device, or ``None`` if it is not
+            present on this node.
+        """
+        blockdevice_id = unicode(blockdevice_id)
+        self.refresh()
+        name = self._find(blockdevice_id, serials)
+        if name is None and self._devices is None:
+            self.refresh()
+            name = self._find(blockdevice_id, serials)
+        if name is None:
+            return None
+        return FilePath(os.path.join(self._dev_root, name))
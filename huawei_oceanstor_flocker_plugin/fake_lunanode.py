@@ -0,0 +1,259 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+A local stand-in for the LunaNode dynamic API, for tests and benchmarks.
+
+Only the ``vm/list`` and ``volume/*`` endpoints used by
+``HuaweiBlockDeviceAPI`` are served, plus the rancher-metadata hostname.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from uuid import uuid4
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urlparse
+
+API_PATH = '/api/'
+HOSTNAME_PATH = '/latest/self/host/hostname'
+REGION = 'toronto'
+
+
+class InjectedFailure(Exception):
+    """
+    Raised to fail a request on purpose.
+    """
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == HOSTNAME_PATH:
+            self._reply(200, self.server.fake.hostname, 'text/plain')
+        else:
+            self._reply(404, '')
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        form = urlparse.parse_qs(self.rfile.read(length))
+        parts = self.path[len(API_PATH):].strip('/').split('/')
+        if not self.path.startswith(API_PATH) or len(parts) != 2:
+            self._reply(404, '')
+            return
+        try:
+            response = self.server.fake.handle(
+                parts[0], parts[1],
+                form.get('req', [''])[0],
+                form.get('signature', [''])[0],
+                form.get('nonce', [''])[0])
+        except InjectedFailure:
+            self._reply(503, 'Service Unavailable', 'text/plain')
+            return
+        self._reply(200, json.dumps(response))
+
+
+class FakeLunaNode(object):
+    """
+    An in-memory LunaNode account served over HTTP on localhost.
+
+    Requests are checked against ``api_id``/``api_key`` exactly like the
+    real API signs them, and a nonce may only be used once. ``latency``
+    (plus up to ``latency_jitter``) is added to every API request and a
+    fraction ``error_rate`` of them fails with HTTP 503. ``calls`` counts the API requests per
+    ``category/action``, and ``nonces`` lists the nonces of the accepted
+    requests in the order they came in.
+    """
+
+    def __init__(self, api_id, api_key, volumes=0, latency=0,
+                 latency_jitter=0, error_rate=0, hostname='flocker-node',
+                 list_includes_status=False, seed=None):
+        """
+        :param str api_id: The 16 character API ID accepted.
+        :param str api_key: The 128 character API key accepted.
+        :param int volumes: Number of volumes the account starts with.
+        :param float latency: Seconds added to every API request.
+        :param float latency_jitter: Random extra seconds per request.
+        :param float error_rate: Fraction of requests failing, 0 to 1.
+        :param str hostname: Hostname of the local VM, as served by the
+            metadata endpoint.
+        :param bool list_includes_status: Whether ``volume/list`` entries
+            carry ``status`` and ``attached``.
+        :param seed: Seed of the latency and error randomness.
+        """
+        self.api_id = api_id
+        self.api_key = api_key
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.hostname = hostname
+        self.list_includes_status = list_includes_status
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 1000
+        self._nonces = set()
+        self.nonces = []
+        self.vms = {
+            unicode(uuid4()): hostname,
+            unicode(uuid4()): hostname + '-peer',
+        }
+        self.volumes = {}
+        for _ in range(volumes):
+            self._create(unicode(uuid4()), 1)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving on an ephemeral localhost port."""
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    @property
+    def api_url(self):
+        """The URL template to pass to ``LNDynamic``."""
+        return self.base_url + API_PATH + '{CATEGORY}/{ACTION}/'
+
+    @property
+    def hostname_url(self):
+        """The URL serving the local VM hostname."""
+        return self.base_url + HOSTNAME_PATH
+
+    def vm_id(self, hostname):
+        """
+        :returns: The ID of the VM called ``hostname``.
+        """
+        for vm_id, name in self.vms.items():
+            if name == hostname:
+                return vm_id
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def _create(self, name, size):
+        self._next_id += 1
+        volume_id = unicode(self._next_id)
+        self.volumes[volume_id] = {
+            'id': volume_id, 'name': name, 'size': unicode(size),
+            'region': REGION, 'status': 'available', 'attached': None,
+        }
+        return volume_id
+
+    def handle(self, category, action, request_raw, signature, nonce):
+        """
+        Serve one signed API request.
+
+        :returns: The response object to encode as JSON.
+        """
+        handler = '%s/%s/' % (category, action)
+        with self._lock:
+            self.calls[handler] = self.calls.get(handler, 0) + 1
+
+        expected = hmac.new(self.api_key,
+                            '%s|%s|%s' % (handler, request_raw, nonce),
+                            hashlib.sha512).hexdigest()
+        try:
+            params = json.loads(request_raw)
+        except ValueError:
+            return {'success': 'no', 'error': 'invalid request'}
+        if (not hmac.compare_digest(expected, signature) or
+                params.get('api_id') != self.api_id or
+                params.get('api_partialkey') != self.api_key[:64]):
+            return {'success': 'no', 'error': 'authentication failed'}
+        with self._lock:
+            if nonce in self._nonces:
+                return {'success': 'no', 'error': 'nonce already used'}
+            self._nonces.add(nonce)
+            self.nonces.append(nonce)
+
+        delay = self.latency
+        if self.latency_jitter:
+            delay += self._random.uniform(0, self.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise InjectedFailure()
+
+        method = getattr(self, '_%s_%s' % (category, action), None)
+        if method is None:
+            return {'success': 'no', 'error': 'unknown action ' + handler}
+        with self._lock:
+            try:
+                result = method(params)
+            except KeyError as err:
+                return {'success': 'no', 'error': '%s not found' % err}
+        result.setdefault('success', 'yes')
+        return result
+
+    def _vm_list(self, params):
+        return {'vms': [{'vm_id': vm_id, 'hostname': hostname,
+                         'region': REGION}
+                        for vm_id, hostname in self.vms.items()]}
+
+    def _volume_list(self, params):
+        fields = ['id', 'name', 'size', 'region']
+        if self.list_includes_status:
+            fields += ['status', 'attached']
+        return {'volumes': [dict((key, volume[key]) for key in fields)
+                            for volume in self.volumes.values()]}
+
+    def _volume_info(self, params):
+        return {'volume': dict(self.volumes[unicode(params['volume_id'])])}
+
+    def _volume_create(self, params):
+        return {'volume_id': self._create(params['label'],
+                                          int(params['size']))}
+
+    def _volume_delete(self, params):
+        del self.volumes[unicode(params['volume_id'])]
+        return {}
+
+    def _volume_attach(self, params):
+        volume = self.volumes[unicode(params['volume_id'])]
+        if params['vm_id'] not in self.vms:
+            return {'success': 'no', 'error': 'VM not found'}
+        if volume['status'] == 'in-use':
+            return {'success': 'no', 'error': 'volume already attached'}
+        volume['status'] = 'in-use'
+        volume['attached'] = params['vm_id']
+        return {}
+
+    def _volume_detach(self, params):
+        volume = self.volumes[unicode(params['volume_id'])]
+        volume['status'] = 'available'
+        volume['attached'] = None
+        return {}
@@ -0,0 +1,85 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Discover the local Fibre Channel HBAs from sysfs.
+"""
+
+from threading import Lock
+import os
+
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+ONLINE = 'Online'
+
+# Attributes of each ``fc_host`` read besides ``port_state``.
+ATTRIBUTES = ('port_name', 'node_name', 'port_id', 'fabric_name', 'speed')
+
+
+class FcHostCache(object):
+    """
+    The local FC HBAs, read from ``/sys/class/fc_host/host*``.
+
+    Each call only reads the ``port_state`` of every HBA; the other
+    attributes are read again when an HBA appears, disappears or changes
+    link state.
+    """
+
+    def __init__(self, sys_root='/sys'):
+        """
+        :param str sys_root: Mount point of sysfs.
+        """
+        self._fc_host = os.path.join(sys_root, 'class', 'fc_host')
+        self._lock = Lock()
+        self._states = None
+        self._hbas = []
+
+    def _read(self, host, attribute):
+        try:
+            with open(os.path.join(self._fc_host, host, attribute)) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def _port_states(self):
+        try:
+            hosts = os.listdir(self._fc_host)
+        except OSError:
+            # No FC HBA driver loaded.
+            return ()
+        return tuple(sorted((host, self._read(host, 'port_state'))
+                            for host in hosts))
+
+    def invalidate(self):
+        """Read every HBA again on the next call."""
+        with self._lock:
+            self._states = None
+
+    def hbas(self):
+        """
+        :returns: A ``list`` of one ``dict`` per HBA, with its
+            ``ClassDevice`` name, ``port_state`` and ``ATTRIBUTES``, the
+            keys ``systool -c fc_host -v`` prints.
+        """
+        states = self._port_states()
+        with self._lock:
+            if states == self._states:
+                return [dict(cached) for cached in self._hbas]
+        hbas = []
+        for host, state in states:
+            hba = {'ClassDevice': host, 'port_state': state}
+            for attribute in ATTRIBUTES:
+                hba[attribute] = self._read(host, attribute)
+            hbas.append(hba)
+        LOG.info("FC HBAs: %s", hbas)
+        with self._lock:
+            self._states = states
+            self._hbas = hbas
+        return [dict(found) for found in hbas]
+
+    def wwpns(self):
+        """
+        :returns: The WWPNs of the online HBAs, without ``0x``.
+        """
+        return [port['port_name'].replace('0x', '') for port in self.hbas()
+                if port['port_state'] == ONLINE and port['port_name']]
@@ -0,0 +1,175 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Keep-alive HTTP(S) connection pool shared by the API clients.
+"""
+
+from collections import namedtuple
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+from huawei_oceanstor_flocker_plugin import constants
+
+
+HTTPResponse = namedtuple('HTTPResponse', ['status', 'reason',
+                                           'headers', 'body'])
+
+# Errors of a connection the server closed while it sat idle.
+_STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def _is_stale(err):
+    """
+    Whether ``err``, raised before any byte of the response arrived,
+    means the server had already closed the connection, so the request
+    was not processed.
+    """
+    if isinstance(err, httplib.BadStatusLine):
+        # Raised with an empty line, or a message saying so since Python
+        # 2.7.15, when the connection was closed.
+        return (err.line in ('', "''") or
+                err.line.startswith('No status line received'))
+    if isinstance(err, socket.timeout):
+        return False
+    return isinstance(err, socket.error) and err.errno in _STALE_ERRNOS
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP/1.1 connections, kept per host.
+
+    Connections are taken out of the pool for the duration of a single
+    request, so one pool can be shared between threads. At most
+    ``max_size`` idle connections are kept per host and a connection left
+    idle for longer than ``idle_timeout`` seconds is closed instead of
+    being reused.
+    """
+
+    def __init__(self, max_size=constants.HTTP_POOL_MAX_SIZE,
+                 idle_timeout=constants.HTTP_POOL_IDLE_TIMEOUT,
+                 timeout=constants.SOCKET_TIMEOUT,
+                 ssl_context=None, clock=time.time):
+        """
+        :param int max_size: Idle connections kept per host.
+        :param float idle_timeout: Seconds before an idle connection is
+            evicted.
+        :param float timeout: Default per-request socket timeout.
+        :param ssl_context: Optional ``ssl.SSLContext`` for HTTPS hosts.
+        :param clock: Callable returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._ssl_context = ssl_context
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _new_connection(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            kwargs = {}
+            if self._ssl_context is not None:
+                kwargs['context'] = self._ssl_context
+            return httplib.HTTPSConnection(host, port, timeout=timeout,
+                                           **kwargs)
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def _get(self, key):
+        """Take an idle connection for ``key``, evicting stale ones."""
+        now = self._clock()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    conn = candidate
+                    break
+        for candidate in stale:
+            candidate.close()
+        return conn
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((conn, self._clock()))
+                return
+        conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Send a request over a pooled connection.
+
+        A request that finds a reused connection already closed by the
+        server, before any byte of the response arrived, is sent again
+        once on a fresh connection. Any other failure, timeouts included,
+        is raised: the server may have acted on the request, and whether
+        to send it again is up to the caller.
+
+        :param str method: HTTP method.
+        :param str url: Absolute URL.
+        :param body: Request body or ``None``.
+        :param dict headers: Request headers.
+        :param float timeout: Socket timeout for this request, defaults to
+            the pool timeout.
+        :returns: An ``HTTPResponse``.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        parsed = urlparse.urlsplit(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        conn = self._get(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._new_connection(key, timeout)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error) as err:
+                conn.close()
+                if not (reused and _is_stale(err)):
+                    raise
+                conn = None
+                reused = False
+                continue
+            break
+
+        try:
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return HTTPResponse(response.status, response.reason,
+                            response.msg, data)
@@ -7,14 +7,20 @@ from flocker.node.agents.blockdevice import (
     IBlockDeviceAPI, BlockDeviceVolume
 )
 
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from uuid import uuid4, UUID
 from zope.interface import implementer
-from twisted.python.filepath import FilePath
 
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.device_events import DeviceMonitor
+from huawei_oceanstor_flocker_plugin.device_resolver import DeviceResolver
 from huawei_oceanstor_flocker_plugin import rest_client
 from huawei_oceanstor_flocker_plugin import lndynamic
+from huawei_oceanstor_flocker_plugin import metrics
 from huawei_oceanstor_flocker_plugin import huawei_utils
 from huawei_oceanstor_flocker_plugin.log import LOG
+from huawei_oceanstor_flocker_plugin.volume_cache import VolumeStateCache
 
 import json
 import math
@@ -22,6 +28,25 @@ import socket
 import urllib2
 
 
+class DeviceNotFound(VolumeException):
+    """
+    An attached volume has no local device on this node.
+    """
+
+
+def _is_unknown_vm_error(err):
+    """
+    Whether a LunaNode ``APIException`` says the target VM does not exist.
+    """
+    message = str(err).lower()
+    if 'vm' not in message:
+        return False
+    for reason in ('not found', 'invalid', 'does not exist', 'unknown'):
+        if reason in message:
+            return True
+    return False
+
+
 @implementer(IBlockDeviceAPI)
 class HuaweiBlockDeviceAPI(object):
     """
@@ -29,7 +54,17 @@ class HuaweiBlockDeviceAPI(object):
     """
     def __init__(self, cluster_id, api_id, api_key,
                  compute_instance_id=None,
-                 allocation_unit=None):
+                 allocation_unit=None,
+                 list_workers=constants.LIST_VOLUMES_WORKERS,
+                 instance_id_file=constants.INSTANCE_ID_CACHE_FILE,
+                 volume_cache_ttl=constants.VOLUME_CACHE_TTL,
+                 volume_cache_size=constants.VOLUME_CACHE_SIZE,
+                 device_resolver=None,
+                 device_monitor=None,
+                 device_wait_timeout=constants.DEVICE_WAIT_TIMEOUT,
+                 api_url=None,
+                 hostname_url=constants.RANCHER_HOSTNAME_URL,
+                 max_parallel=constants.LNDYNAMIC_MAX_PARALLEL):
         """
         :param cluster_id: An ID that include in the
             names of Huawei volumes to identify cluster.
@@ -37,12 +72,57 @@ class HuaweiBlockDeviceAPI(object):
         :param compute_instance_id: An ID that used to create
             host on the array to identify node.
         :param allocation_unit: Allocation unit on array.
+        :param int list_workers: Maximum number of ``volume/info`` lookups
+            ``list_volumes`` runs in parallel when the list payload lacks
+            attachment data.
+        :param instance_id_file: The path of the file the resolved
+            ``compute_instance_id`` is persisted to, or ``None`` to keep
+            it in memory only.
+        :param float volume_cache_ttl: Seconds a ``volume/info`` result is
+            reused for, ``0`` disables caching.
+        :param int volume_cache_size: Maximum number of cached volume
+            states.
+        :param device_resolver: The ``DeviceResolver`` mapping volumes to
+            local devices, defaults to one reading ``/sys`` and ``/dev`` and
+            persisting what it learns to ``constants.DEVICE_MAP_FILE``.
+        :param device_monitor: The ``DeviceMonitor`` ``attach_volume`` waits
+            on for the new device, defaults to one listening for uevents.
+        :param float device_wait_timeout: Seconds ``attach_volume`` waits
+            for the device to appear.
+        :param api_url: LunaNode API URL template, defaults to
+            ``LNDynamic.LNDYNAMIC_URL``.
+        :param hostname_url: The metadata URL returning this node's
+            hostname.
+        :param int max_parallel: Maximum number of LunaNode API requests
+            in flight at once.
         :returns: A ``BlockDeviceVolume``.
         """
         LOG.info("Huawei block device init")
-        self.api = lndynamic.LNDynamic(api_id, api_key)
+        self.api = lndynamic.LNDynamic(api_id, api_key, url=api_url,
+                                       max_parallel=max_parallel)
+        self._hostname_url = hostname_url
+        self._list_workers = max(1, min(int(list_workers), max_parallel))
+        # Created on first use and kept: tearing a pool down costs about
+        # 100ms, which dominated listing small inventories.
+        self._list_pool = None
+        self._list_pool_lock = Lock()
+        self._instance_id_file = instance_id_file
+        self._instance_id = None
+        self._instance_id_lock = Lock()
+        self.volume_cache = VolumeStateCache(ttl=volume_cache_ttl,
+                                             max_entries=volume_cache_size)
+        if device_resolver is None:
+            device_resolver = DeviceResolver(
+                state_file=constants.DEVICE_MAP_FILE)
+        self._device_resolver = device_resolver
+        if device_monitor is None:
+            device_monitor = DeviceMonitor()
+        self._device_monitor = device_monitor
+        self._device_wait_timeout = device_wait_timeout
+        self._local_attach_lock = Lock()
         LOG.info("Finish huawei block device init")
 
+    @metrics.timed_operation('allocation_unit')
     def allocation_unit(self):
         """
         The size, in bytes up to which ``IDeployer`` will round volume
@@ -53,6 +133,7 @@ class HuaweiBlockDeviceAPI(object):
         LOG.info("Call allocation_unit")
         return 1073741824
 
+    @metrics.timed_operation('compute_instance_id')
     def compute_instance_id(self):
         """
         Get an identifier for this node.
@@ -61,20 +142,57 @@ class HuaweiBlockDeviceAPI(object):
         to determine which volumes are locally attached and it will be used
         with ``attach_volume`` to locally attach volumes.
 
+        The resolved ID is kept for the life of the process and persisted
+        to ``instance_id_file``; after a restart the persisted value is
+        reused as long as the node hostname still matches.
+
         :returns: A ``unicode`` object giving a provider-specific node
             identifier which identifies the node where the method is run.
         """
 
         LOG.info("Call compute_instance_id")
+        with self._instance_id_lock:
+            if self._instance_id is not None:
+                return self._instance_id['vm_id']
+
+            hostname = urllib2.urlopen(self._hostname_url).read()
+            cached = None
+            if self._instance_id_file is not None:
+                cached = huawei_utils.load_json_state(self._instance_id_file)
+            if cached and cached.get('hostname') == hostname:
+                LOG.info("vm_id=%s (cached)", cached['vm_id'])
+                self._instance_id = {'hostname': hostname,
+                                     'vm_id': unicode(cached['vm_id'])}
+                return self._instance_id['vm_id']
+
+            vm_id = self._lookup_vm_id(hostname)
+            if vm_id is not None:
+                self._instance_id = {'hostname': hostname, 'vm_id': vm_id}
+                if self._instance_id_file is not None:
+                    huawei_utils.save_json_state(self._instance_id_file,
+                                                 self._instance_id)
+            return vm_id
+
+    def _lookup_vm_id(self, hostname):
         list_vms = self.api.request('vm', 'list', {'region': 'toronto'})
-        hostname = urllib2.urlopen("http://rancher-metadata/latest/self/host/hostname").read()
         for vm in list_vms['vms']:
-            LOG.info("hostname=%s, gethostname=%s"% (vm['hostname'], hostname))
+            LOG.info("hostname=%s, gethostname=%s", vm['hostname'], hostname)
             if vm['hostname'] == hostname:
-                LOG.info("vm_id=%s"% (unicode(vm['vm_id'])))
+                LOG.info("vm_id=%s", unicode(vm['vm_id']))
                 return unicode(vm['vm_id'])
         return None
 
+    def invalidate_instance_id(self):
+        """
+        Forget the cached ``compute_instance_id`` in memory and on disk.
+        """
+        LOG.info("Invalidate cached compute_instance_id")
+        with self._instance_id_lock:
+            self._instance_id = None
+            if self._instance_id_file is not None:
+                huawei_utils.remove_json_state(self._instance_id_file)
+
+    @metrics.timed_operation('create_volume')
     def create_volume(self, dataset_id, size):
         """
         Create a new volume.
@@ -87,8 +205,8 @@ class HuaweiBlockDeviceAPI(object):
         :param int size: The size of the new volume in bytes.
         :returns: A ``BlockDeviceVolume``.
         """
-        LOG.info("Call create_volume, dataset_id=%s, size=%d"
-                 % (dataset_id, size))
+        LOG.info("Call create_volume, dataset_id=%s, size=%d",
+                 dataset_id, size)
         result = self.api.request('volume', 'create', {'region': 'toronto', 'label':str(dataset_id), 'size': math.ceil(size/1073741824)})
         volume = BlockDeviceVolume(
             size=int(size),
@@ -98,6 +216,7 @@ class HuaweiBlockDeviceAPI(object):
         )
         return volume
 
+    @metrics.timed_operation('destroy_volume')
     def destroy_volume(self, blockdevice_id):
         """
         Destroy an existing volume.
@@ -111,12 +230,18 @@ class HuaweiBlockDeviceAPI(object):
         :return: ``None``
         """
 
-        LOG.info("Call destroy_volume blockdevice_id=%s" % blockdevice_id)
+        LOG.info("Call destroy_volume blockdevice_id=%s", blockdevice_id)
         try:
             self.api.request('volume', 'delete', {'region': 'toronto', 'volume_id': blockdevice_id})
+        except lndynamic.TransientAPIException:
+            raise
         except Exception:
             raise UnknownVolume(blockdevice_id)
+        finally:
+            self.volume_cache.invalidate(('info', unicode(blockdevice_id)))
+            self._device_resolver.forget(blockdevice_id)
 
+    @metrics.timed_operation('attach_volume')
     def attach_volume(self, blockdevice_id, attach_to):
         """
         Attach ``blockdevice_id`` to the node indicated by ``attach_to``.
@@ -131,31 +256,87 @@ class HuaweiBlockDeviceAPI(object):
             exist.
         :raises AlreadyAttachedVolume: If the supplied ``blockdevice_id`` is
             already attached.
+        :raises DeviceNotFound: If the volume was attached to this node but
+            its device did not appear within ``device_wait_timeout``
+            seconds.
 
         :returns: A ``BlockDeviceVolume`` with a ``attached_to`` attribute set
             to ``attach_to``.
         """
 
-        LOG.info("Call attach_volume blockdevice_id=%s, attach_to=%s"
-                 % (blockdevice_id, attach_to))
+        LOG.info("Call attach_volume blockdevice_id=%s, attach_to=%s",
+                 blockdevice_id, attach_to)
 
-        result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': blockdevice_id})
-        if result['success'] == 'no':
-            raise UnknownVolume(blockdevice_id)
-
-        if result['volume']['status'] == 'in-use':
+        info = self._volume_info(blockdevice_id)
+        if info['status'] == 'in-use':
             raise AlreadyAttachedVolume(blockdevice_id)
 
-        result = self.api.request('volume', 'attach', {'region': 'toronto', 'volume_id': blockdevice_id, 'vm_id': attach_to, 'target': 'auto'})
-        result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': blockdevice_id})
-        
+        self.volume_cache.invalidate(('info', unicode(blockdevice_id)))
+        if attach_to == self.compute_instance_id():
+            # Local attaches are serialised so that a device appearing
+            # during the wait can only belong to this volume.
+            with self._local_attach_lock:
+                self._device_monitor.start()
+                # Devices that changed while nothing was listening must
+                # not count as appearing during the attach.
+                self._device_monitor.resync()
+                devices_before = self._device_monitor.present()
+                self._request_attach(blockdevice_id, attach_to)
+                self._wait_for_device(blockdevice_id, devices_before)
+        else:
+            self._request_attach(blockdevice_id, attach_to)
+
+        # Size and name do not change on attach, so the state read above is
+        # written through instead of fetching volume/info once more.
+        info = dict(info, status='in-use', attached=attach_to)
+        self.volume_cache.put(('info', unicode(blockdevice_id)), info)
+
         attached_volume = BlockDeviceVolume(
-            size=int(result['volume']['size']),
+            size=int(info['size']),
             attached_to=unicode(attach_to),
-            dataset_id=UUID(result['volume']['name']),
+            dataset_id=UUID(info['name']),
             blockdevice_id=unicode(blockdevice_id))
         return attached_volume
 
+    def _request_attach(self, blockdevice_id, attach_to):
+        try:
+            self.api.request('volume', 'attach', {'region': 'toronto', 'volume_id': blockdevice_id, 'vm_id': attach_to, 'target': 'auto'})
+        except lndynamic.APIException as err:
+            cached = self._instance_id
+            if (cached is not None and cached['vm_id'] == attach_to and
+                    _is_unknown_vm_error(err)):
+                self.invalidate_instance_id()
+            raise
+
+    def _wait_for_device(self, blockdevice_id, devices_before):
+        """
+        Wait until the device of a freshly attached volume is present.
+
+        A device that cannot be matched by serial is remembered for the
+        volume when it is the only one that appeared during the attach.
+
+        :raises DeviceNotFound: If no device appeared in time.
+        """
+        def arrived(present):
+            if self._device_resolver.lookup(blockdevice_id) is not None:
+                return True
+            return any(name.startswith('vd')
+                       for name in present - devices_before)
+
+        if not self._device_monitor.wait_for(arrived,
+                                             self._device_wait_timeout):
+            LOG.error("Device of volume %s did not appear within %s seconds.",
+                      blockdevice_id, self._device_wait_timeout)
+            raise DeviceNotFound(blockdevice_id)
+        if self._device_resolver.lookup(blockdevice_id) is None:
+            new_devices = [name for name in
+                           self._device_monitor.present() - devices_before
+                           if name.startswith('vd')]
+            if len(new_devices) == 1:
+                self._device_resolver.remember(blockdevice_id,
+                                               new_devices[0])
+
+    @metrics.timed_operation('detach_volume')
     def detach_volume(self, blockdevice_id):
         """
         Detach ``blockdevice_id`` from whatever host it is attached to.
@@ -170,23 +351,81 @@ class HuaweiBlockDeviceAPI(object):
         :returns: ``None``
         """
 
-        LOG.info("Call detach_volume blockdevice_id=%s" % blockdevice_id)
-        result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': blockdevice_id})
-        if result['volume']['status'] == 'in-use':
+        LOG.info("Call detach_volume blockdevice_id=%s", blockdevice_id)
+        info = self._volume_info(blockdevice_id)
+        if info['status'] == 'in-use':
+            self.volume_cache.invalidate(('info', unicode(blockdevice_id)))
             self.api.request('volume', 'detach', {'region': 'toronto', 'volume_id': blockdevice_id})
+            self._device_resolver.forget(blockdevice_id)
         else:
-            LOG.error("Volume %s not attached." % blockdevice_id)
+            LOG.error("Volume %s not attached.", blockdevice_id)
             raise UnattachedVolume(blockdevice_id)
 
+    def _volume_info(self, blockdevice_id):
+        """
+        Read the ``volume/info`` state of a volume through the cache.
+
+        :raises UnknownVolume: If the volume does not exist.
+        :returns: The ``volume`` ``dict`` of the response.
+        """
+        key = ('info', unicode(blockdevice_id))
+        info = self.volume_cache.get(key)
+        if info is None:
+            try:
+                result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': blockdevice_id})
+            except lndynamic.TransientAPIException:
+                raise
+            except lndynamic.APIException:
+                raise UnknownVolume(blockdevice_id)
+            info = result['volume']
+            self.volume_cache.put(key, info)
+        return info
+
     def get_attached_to(self, item):
         """
         """
-        LOG.info("Call get_attached_to")
-        result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': item['id']})
-        if result['volume']['attached']:
-            return unicode(result['volume']['attached'])
+        LOG.debug("Call get_attached_to")
+        info = self._volume_info(item['id'])
+        if info['attached']:
+            return unicode(info['attached'])
         return None
 
+    def _attachments_from_list(self, items):
+        """
+        Work out which node each listed volume is attached to.
+
+        The ``volume/list`` payload is used directly wherever it already
+        says whether a volume is attached; only the remaining volumes are
+        looked up with ``volume/info``, in parallel and bounded by
+        ``list_workers``.
+
+        :param list items: The ``volumes`` entries of ``volume/list``.
+        :returns: A ``dict`` mapping volume id to ``attached_to``.
+        """
+        attached = {}
+        pending = []
+        for item in items:
+            volume_id = unicode(item['id'])
+            if 'attached' in item:
+                attached[volume_id] = (unicode(item['attached'])
+                                       if item['attached'] else None)
+            elif 'status' in item and item['status'] != 'in-use':
+                attached[volume_id] = None
+            else:
+                pending.append(item)
+
+        if pending:
+            with self._list_pool_lock:
+                if self._list_pool is None:
+                    self._list_pool = ThreadPool(self._list_workers)
+            results = self._list_pool.map(
+                metrics.METRICS.propagate(self.get_attached_to), pending)
+            for item, attached_to in zip(pending, results):
+                attached[unicode(item['id'])] = attached_to
+
+        return attached
+
+    @metrics.timed_operation('list_volumes')
     def list_volumes(self):
         """
         List all the block devices available via the back end API.
@@ -198,16 +437,18 @@ class HuaweiBlockDeviceAPI(object):
         result = self.api.request('volume', 'list', {'region': 'toronto'})
 
         if 'volumes' in result:
+            attached = self._attachments_from_list(result['volumes'])
             for item in result['volumes']:
                 volume = BlockDeviceVolume(
                     size=int(item['size']),
-                    attached_to=self.get_attached_to(item),
+                    attached_to=attached[unicode(item['id'])],
                     dataset_id=UUID(item['name']),
                     blockdevice_id=unicode(item['id'])
                 )
                 volumes.append(volume)
         return volumes
 
+    @metrics.timed_operation('get_device_path')
     def get_device_path(self, blockdevice_id):
         """
         Return the device path that has been allocated to the block device on
@@ -219,23 +460,27 @@ class HuaweiBlockDeviceAPI(object):
             exist.
         :raises UnattachedVolume: If the supplied ``blockdevice_id`` is
             not attached to a host.
+        :raises DeviceNotFound: If the volume is attached but no local
+            device can be matched to it.
         :returns: A ``FilePath`` for the device.
         """
 
         LOG.info("Call get_device_path")
 
-        result = self.api.request('volume', 'info', {'region': 'toronto', 'volume_id': blockdevice_id})
-        if result['success'] == 'no':
-            raise UnknownVolume(blockdevice_id)
+        device = self._device_resolver.lookup(blockdevice_id)
+        if device is not None:
+            LOG.info("device_path found: %s", device.path)
+            return device
 
-        if result['volume']['status'] != 'in-use':
+        info = self._volume_info(blockdevice_id)
+        if info['status'] != 'in-use':
             raise UnattachedVolume(blockdevice_id)
 
-        list_volumes = self.api.request('volume', 'list', {'region': 'toronto'})
-        volume_suffix_list = 'cdefghijklmnopqrstuv'
-        for item in list_volumes['volumes']:
-            if unicode(item['id']) == blockdevice_id:
-                LOG.info("device_path found: %s" % volume_suffix_list[list_volumes['volumes'].index(item)])
-                return FilePath("/dev/vd" + volume_suffix_list[list_volumes['volumes'].index(item)])
+        serials = tuple(unicode(info[key]) for key in ('identification', 'uuid', 'serial') if info.get(key))
+        device = self._device_resolver.lookup(blockdevice_id, serials)
+        if device is not None:
+            LOG.info("device_path found: %s", device.path)
+            return device
 
-        return None
+        LOG.error("No local device found for volume %s.", blockdevice_id)
+        raise DeviceNotFound(blockdevice_id)
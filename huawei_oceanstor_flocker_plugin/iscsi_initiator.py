@@ -0,0 +1,67 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+The iSCSI initiator name of this node, read once per change of
+``/etc/iscsi/initiatorname.iscsi``.
+"""
+
+import os
+import re
+import threading
+
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+_INITIATOR_NAME = re.compile(r'^\s*InitiatorName\s*=\s*(\S+)', re.MULTILINE)
+
+
+def parse_initiator_name(content):
+    """
+    :param str content: The content of an ``initiatorname.iscsi`` file.
+    :returns: The initiator name it sets, or ``None``.
+    """
+    match = _INITIATOR_NAME.search(content)
+    return match.group(1) if match else None
+
+
+class InitiatorNameFile(object):
+    """
+    Cache of the initiator name in an ``initiatorname.iscsi`` file, read
+    again only when the file's modification time or size changes.
+    """
+
+    def __init__(self, path=constants.ISCSI_INITIATOR_FILE, stat=os.stat):
+        self.path = path
+        self._stat = stat
+        self._lock = threading.Lock()
+        self._cached = None
+
+    def get(self):
+        """
+        :returns: The initiator name, or ``None`` if the file is missing
+            or doesn't set one.
+        """
+        try:
+            info = self._stat(self.path)
+        except OSError as err:
+            LOG.error("can't find iscsi initiator: %s", err)
+            return None
+        version = (info.st_mtime, info.st_size)
+        with self._lock:
+            cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(self.path) as f:
+                initiator = parse_initiator_name(f.read())
+        except IOError as err:
+            LOG.error("can't find iscsi initiator: %s", err)
+            return None
+        if initiator is None:
+            LOG.error("can't find iscsi initiator in %s", self.path)
+        else:
+            LOG.info("get iscsi initiator=%s", initiator)
+        with self._lock:
+            self._cached = (version, initiator)
+        return initiator
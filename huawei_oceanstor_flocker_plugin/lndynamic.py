@@ -18,10 +18,43 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
+import hmac
+import httplib
+import json
+import socket
+import threading
+import time
+import urllib
+
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.http_pool import ConnectionPool
+from huawei_oceanstor_flocker_plugin.metrics import timed_call
+from huawei_oceanstor_flocker_plugin.rate_limit import AdaptiveRateLimiter, retry_delay
+
+IDEMPOTENT_ACTIONS = ('info', 'list')
+
+# nonces are strictly increasing across every thread and client of the process,
+# so concurrent requests never sign with the same nonce; they count milliseconds,
+# so a burst only runs them ahead of the clock by a millisecond per request and
+# no request ever waits for the clock to catch up
+_nonce_lock = threading.Lock()
+_last_nonce = [0]
+
+def next_nonce(clock = time.time):
+	with _nonce_lock:
+		nonce = max(int(clock() * 1000), _last_nonce[0] + 1)
+		_last_nonce[0] = nonce
+	return str(nonce)
+
+# connections to the API and its request budget are shared by every client of the process
+_shared_pool = ConnectionPool(max_size = constants.LNDYNAMIC_MAX_PARALLEL, timeout = constants.LNDYNAMIC_TIMEOUT)
+_shared_limiter = AdaptiveRateLimiter()
+
 class LNDynamic:
 	LNDYNAMIC_URL = 'https://dynamic.lunanode.com/api/{CATEGORY}/{ACTION}/'
 
-	def __init__(self, api_id, api_key):
+	def __init__(self, api_id, api_key, timeout = constants.LNDYNAMIC_TIMEOUT, pool = None, url = None, max_parallel = constants.LNDYNAMIC_MAX_PARALLEL, limiter = None, retries = constants.API_RETRIES, clock = time.time):
 		if len(api_id) != 16:
 			raise InvalidArgumentException('Supplied api_id incorrect length, must be 16')
 		if len(api_key) != 128:
@@ -30,32 +63,66 @@ class LNDynamic:
 		self.api_id = api_id
 		self.api_key = api_key
 		self.partial_api_key = api_key[:64]
+		self.timeout = timeout
+		self.url = url if url is not None else self.LNDYNAMIC_URL
+		# connections are reused across requests, so only the first call to a host pays for the TLS handshake
+		self.pool = pool if pool is not None else _shared_pool
+		self.max_parallel = max_parallel
+		self._in_flight = threading.BoundedSemaphore(max_parallel)
+		self.limiter = limiter if limiter is not None else _shared_limiter
+		self.retries = retries
+		# the clock nonces are taken from
+		self.clock = clock
 
-	def request(self, category, action, params = {}):
-		import json
-		import time
-		import hmac
-		import hashlib
-		import urllib
-		import urllib2
+	def request(self, category, action, params = {}, timeout = None):
+		# only reads are retried, a retried write could be applied twice
+		attempts = 1 + (self.retries if action in IDEMPOTENT_ACTIONS else 0)
+		for attempt in range(attempts):
+			try:
+				return self._request_once(category, action, params, timeout)
+			except TransientAPIException:
+				if attempt + 1 >= attempts:
+					raise
+				time.sleep(retry_delay(attempt))
 
-		url = self.LNDYNAMIC_URL.replace('{CATEGORY}', category).replace('{ACTION}', action)
+	@timed_call(lambda self, category, action, *args: '%s/%s' % (category, action))
+	def _request_once(self, category, action, params, timeout):
+		url = self.url.replace('{CATEGORY}', category).replace('{ACTION}', action)
 		request_array = dict(params)
 		request_array['api_id'] = self.api_id
 		request_array['api_partialkey'] = self.partial_api_key
 		request_raw = json.dumps(request_array)
-		nonce = str(int(time.time()))
-		handler = "%s/%s/" % (category, action)
-		hasher = hmac.new(self.api_key, '%s|%s|%s' % (handler, request_raw, nonce), hashlib.sha512)
-		signature = hasher.hexdigest()
-
-		data = urllib.urlencode({'req': request_raw, 'signature': signature, 'nonce': nonce})
-		content = urllib2.urlopen(urllib2.Request(url, data)).read()
+		headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Connection': 'keep-alive'}
+		self.limiter.acquire()
+		with self._in_flight:
+			# sign only once the request may go out, so a request held back by the
+			# limiter or max_parallel doesn't go out behind nonces taken after it
+			nonce = next_nonce(self.clock)
+			handler = "%s/%s/" % (category, action)
+			hasher = hmac.new(self.api_key, '%s|%s|%s' % (handler, request_raw, nonce), hashlib.sha512)
+			signature = hasher.hexdigest()
+			data = urllib.urlencode({'req': request_raw, 'signature': signature, 'nonce': nonce})
+			start = time.time()
+			try:
+				http_response = self.pool.request('POST', url, data, headers, timeout = timeout if timeout is not None else self.timeout)
+			except (socket.error, httplib.HTTPException) as e:
+				self.limiter.record(False, time.time() - start)
+				raise TransientAPIException('Connection error: %s' % e)
+		latency = time.time() - start
+		if http_response.status >= 500 or http_response.status == 429:
+			self.limiter.record(False, latency)
+			raise TransientAPIException('Server gave HTTP error %d %s' % (http_response.status, http_response.reason))
+		elif http_response.status >= 400:
+			self.limiter.record(True, latency)
+			raise APIException('Server gave HTTP error %d %s' % (http_response.status, http_response.reason))
+		content = http_response.body
 
 		try:
 			response = json.loads(content)
 		except ValueError:
-			raise APIException('Server gave invalid response (could not decode).')
+			self.limiter.record(False, latency)
+			raise TransientAPIException('Server gave invalid response (could not decode).')
+		self.limiter.record(True, latency)
 
 		if 'success' not in response:
 			raise APIException('Server gave invalid repsonse (missing success key)')
@@ -71,4 +138,7 @@ class InvalidArgumentException(Exception):
 	pass
 
 class APIException(Exception):
-	pass
\ No newline at end of file
+	pass
+
+class TransientAPIException(APIException):
+	pass
@@ -1,17 +1,77 @@
 # Copyright (c) 2015 Huawei Technologies Co., Ltd.
 # See LICENSE file for details.
 
+"""
+Level-filtered eliot logging.
+
+Messages take ``%``-style arguments, which are only interpolated when the
+level is enabled, and keyword arguments, which are written as structured
+eliot fields rather than rendered into the text::
+
+    LOG.debug("Call %s", method, url=url, status=status)
+
+The level is read from ``HUAWEI_FLOCKER_LOG_LEVEL`` (default ``info``)
+and can be changed with ``LOG.set_level``.
+"""
+
+import os
+
 from eliot import Message, Logger
 
 _logger = Logger()
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+_FIELDS = {DEBUG: 'Debug', INFO: 'Info', WARNING: 'Warning', ERROR: 'Error'}
+
+LOG_LEVEL_ENV = 'HUAWEI_FLOCKER_LOG_LEVEL'
+
+
+class log(object):
+
+    def __init__(self, level=None):
+        if level is None:
+            level = LEVELS.get(
+                os.environ.get(LOG_LEVEL_ENV, 'info').lower(), INFO)
+        self.set_level(level)
+
+    def set_level(self, level):
+        """
+        :param level: A level number or one of the names in ``LEVELS``.
+        """
+        if not isinstance(level, int):
+            level = LEVELS[level.lower()]
+        self.level = level
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def _log(self, level, msg, args, fields):
+        if level < self.level:
+            return
+        if args:
+            # Like the logging module, a single mapping feeds
+            # ``%(name)s`` placeholders.
+            if len(args) == 1 and isinstance(args[0], dict):
+                args = args[0]
+            msg = msg % args
+        fields[_FIELDS[level]] = "Huawei " + msg
+        Message.new(**fields).write(_logger)
+
+    def debug(self, msg, *args, **fields):
+        self._log(DEBUG, msg, args, fields)
 
-class log():
+    def info(self, msg, *args, **fields):
+        self._log(INFO, msg, args, fields)
 
-    def error(self, msg):
-        Message.new(Error="Huawei "+msg).write(_logger)
+    def warning(self, msg, *args, **fields):
+        self._log(WARNING, msg, args, fields)
 
-    def info(self, msg):
-        Message.new(Info="Huawei "+msg).write(_logger)
+    def error(self, msg, *args, **fields):
+        self._log(ERROR, msg, args, fields)
 
 LOG = log()
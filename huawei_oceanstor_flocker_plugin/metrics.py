@@ -0,0 +1,294 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Latency and call-count instrumentation for the block device driver.
+
+Driver operations are timed with ``timed_operation`` and HTTP requests
+with ``timed_call``; each HTTP request is also counted against the driver
+operation running on the calling thread. The numbers are kept in
+``METRICS``, written as eliot fields at the end of every operation and
+can be exported in the Prometheus text format, to a file or over HTTP.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from functools import wraps
+import os
+import threading
+import time
+
+from eliot import Message, Logger
+
+from huawei_oceanstor_flocker_plugin import constants
+
+_logger = Logger()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+HTTP_CALLS_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 100, 1000)
+
+
+class Histogram(object):
+    """
+    A cumulative histogram with fixed bucket upper bounds.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class _Operation(object):
+    def __init__(self, name):
+        self.name = name
+        self.http_calls = 0
+        self._lock = threading.Lock()
+
+    def add_http_call(self):
+        with self._lock:
+            self.http_calls += 1
+
+
+class Metrics(object):
+    """
+    Registry of operation and HTTP call metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._latency = {}
+        self._calls = {}
+        self._errors = {}
+        self._http_calls = {}
+
+    def _record(self, kind, name, seconds, error):
+        key = (kind, name)
+        with self._lock:
+            if key not in self._latency:
+                self._latency[key] = Histogram(LATENCY_BUCKETS)
+                self._calls[key] = 0
+                self._errors[key] = 0
+            self._latency[key].observe(seconds)
+            self._calls[key] += 1
+            if error:
+                self._errors[key] += 1
+
+    def current(self):
+        """
+        :returns: The driver operation running on this thread, if any.
+        """
+        return getattr(self._local, 'operation', None)
+
+    def propagate(self, function):
+        """
+        Wrap ``function`` so that, wherever it runs, its HTTP calls count
+        against the driver operation running on the calling thread.
+        """
+        operation = self.current()
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            previous = self.current()
+            self._local.operation = operation
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.operation = previous
+        return wrapper
+
+    def run_operation(self, name, function, *args, **kwargs):
+        """
+        Run a driver operation, timing it and counting its HTTP calls.
+
+        A driver method called from within another operation is part of
+        that operation and is not recorded on its own.
+        """
+        previous = self.current()
+        if previous is not None:
+            return function(*args, **kwargs)
+        operation = _Operation(name)
+        self._local.operation = operation
+        start = time.time()
+        error = None
+        try:
+            return function(*args, **kwargs)
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            duration = time.time() - start
+            self._local.operation = previous
+            self._record('operation', name, duration, error is not None)
+            with self._lock:
+                histogram = self._http_calls.get(name)
+                if histogram is None:
+                    histogram = self._http_calls[name] = Histogram(
+                        HTTP_CALLS_BUCKETS)
+                histogram.observe(operation.http_calls)
+            Message.new(message_type=u"huawei:operation",
+                        operation=name,
+                        duration=duration,
+                        http_calls=operation.http_calls,
+                        error=(type(error).__name__ if error is not None
+                               else None)).write(_logger)
+
+    def run_call(self, endpoint, failed, function, *args, **kwargs):
+        """
+        Run an HTTP call, timing it and counting it against the current
+        driver operation.
+
+        :param failed: Callable telling from the result whether a call
+            that did not raise failed, or ``None``.
+        """
+        operation = self.current()
+        if operation is not None:
+            operation.add_http_call()
+        start = time.time()
+        error = True
+        try:
+            result = function(*args, **kwargs)
+            error = failed is not None and failed(result)
+            return result
+        finally:
+            self._record('http', endpoint, time.time() - start, error)
+
+    def render_prometheus(self):
+        """
+        :returns: The metrics in the Prometheus text exposition format.
+        """
+        names = {'operation': 'huawei_blockdevice_operation',
+                 'http': 'huawei_blockdevice_http'}
+        lines = []
+        with self._lock:
+            for kind, label in (('operation', 'operation'),
+                                ('http', 'endpoint')):
+                prefix = names[kind]
+                keys = sorted(key for key in self._latency
+                              if key[0] == kind)
+                lines.append('# TYPE %s_seconds histogram' % prefix)
+                for key in keys:
+                    lines.extend(_histogram_lines(
+                        prefix + '_seconds', label, key[1],
+                        self._latency[key]))
+                for suffix, values in (('calls_total', self._calls),
+                                       ('errors_total', self._errors)):
+                    lines.append('# TYPE %s_%s counter' % (prefix, suffix))
+                    for key in keys:
+                        lines.append('%s_%s{%s="%s"} %d' % (
+                            prefix, suffix, label, key[1], values[key]))
+            lines.append('# TYPE huawei_blockdevice_operation_http_calls '
+                         'histogram')
+            for name in sorted(self._http_calls):
+                lines.extend(_histogram_lines(
+                    'huawei_blockdevice_operation_http_calls', 'operation',
+                    name, self._http_calls[name]))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write the Prometheus text to ``path``."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render_prometheus())
+        os.rename(tmp_path, path)
+
+    def export_to_file(self, path,
+                       interval=constants.METRICS_EXPORT_INTERVAL):
+        """
+        Rewrite ``path`` every ``interval`` seconds from a daemon thread.
+        """
+        def export():
+            while True:
+                try:
+                    self.write_prometheus(path)
+                except (IOError, OSError) as err:
+                    Message.new(Error="Huawei can't write metrics to %s: %s"
+                                % (path, err)).write(_logger)
+                time.sleep(interval)
+        thread = threading.Thread(target=export, name='huawei-metrics')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def serve(self, port, address='127.0.0.1'):
+        """
+        Serve the Prometheus text over HTTP from a daemon thread.
+
+        :returns: The ``HTTPServer``.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=server.serve_forever,
+                                  name='huawei-metrics-http')
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def _histogram_lines(name, label, value, histogram):
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append('%s_bucket{%s="%s",le="%s"} %d'
+                     % (name, label, value, bound, count))
+    lines.append('%s_bucket{%s="%s",le="+Inf"} %d'
+                 % (name, label, value, histogram.count))
+    lines.append('%s_sum{%s="%s"} %f' % (name, label, value, histogram.sum))
+    lines.append('%s_count{%s="%s"} %d'
+                 % (name, label, value, histogram.count))
+    return lines
+
+
+METRICS = Metrics()
+
+
+def timed_operation(name):
+    """
+    Decorate a driver method as the operation ``name``.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return METRICS.run_operation(name, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_call(endpoint, failed=None):
+    """
+    Decorate an HTTP request method.
+
+    :param endpoint: Callable taking the decorated function's arguments
+        and returning the endpoint label of the call.
+    :param failed: Callable telling from the result whether a call that
+        did not raise failed, for methods that report errors in-band.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return METRICS.run_call(endpoint(*args, **kwargs), failed,
+                                    function, *args, **kwargs)
+        return wrapper
+    return decorator
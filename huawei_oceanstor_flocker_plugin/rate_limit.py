@@ -0,0 +1,95 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Client-side rate limiting and retry backoff for LunaNode API calls.
+"""
+
+from threading import Lock
+import random
+import time
+
+from huawei_oceanstor_flocker_plugin import constants
+
+
+class AdaptiveRateLimiter(object):
+    """
+    A token bucket whose refill rate adapts to how the API is coping.
+
+    Every request takes a token first. Successful, fast responses raise
+    the rate additively up to ``max_rate``; errors and responses slower
+    than ``slow_threshold`` halve it down to ``min_rate``.
+    """
+
+    def __init__(self, rate=constants.API_RATE,
+                 burst=constants.API_BURST,
+                 min_rate=constants.API_MIN_RATE,
+                 max_rate=constants.API_RATE,
+                 increase=constants.API_RATE_INCREASE,
+                 decrease=constants.API_RATE_DECREASE,
+                 slow_threshold=constants.API_SLOW_THRESHOLD,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param float rate: Initial requests per second.
+        :param int burst: Bucket size, the requests allowed back to back.
+        :param float min_rate: Lowest rate backing off goes down to.
+        :param float max_rate: Highest rate recovering goes up to.
+        :param float increase: Requests per second added per success.
+        :param float decrease: Factor applied to the rate per failure.
+        :param float slow_threshold: Seconds after which a response counts
+            as a sign of overload.
+        :param clock: Callable returning the current time in seconds.
+        :param sleep: Callable sleeping for the given number of seconds.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_threshold = slow_threshold
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def record(self, success, latency):
+        """
+        Adapt the rate to the outcome of a request.
+
+        :param bool success: Whether the API handled the request.
+        :param float latency: Seconds the request took.
+        """
+        with self._lock:
+            if success and latency <= self.slow_threshold:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+def retry_delay(attempt, base=constants.API_RETRY_BASE,
+                cap=constants.API_RETRY_CAP, random=random.random):
+    """
+    Full-jitter exponential backoff.
+
+    :param int attempt: The number of the retry, starting at 0.
+    :returns: Seconds to wait, uniformly drawn below
+        ``min(cap, base * 2 ** attempt)``.
+    """
+    return random() * min(cap, base * (2 ** attempt))
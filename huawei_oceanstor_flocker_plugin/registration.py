@@ -0,0 +1,137 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+What this node has registered on the array: its host, hostgroup and
+initiators, kept across restarts.
+"""
+
+import threading
+import time
+
+from huawei_oceanstor_flocker_plugin import huawei_utils
+
+# Sections of the state, each a ``dict``:
+# host name -> host ID
+HOSTS = 'hosts'
+# hostgroup name -> hostgroup ID
+HOSTGROUPS = 'hostgroups'
+# host ID -> ID of the hostgroup it was added to
+MEMBERS = 'members'
+# iSCSI initiator -> {'host_id': ..., 'options': digest of CHAP and ALUA}
+INITIATORS = 'initiators'
+
+SECTIONS = (HOSTS, HOSTGROUPS, MEMBERS, INITIATORS)
+
+
+class RegistrationCache(object):
+    """
+    The host registration of this node, trusted until it is verified
+    against the array again.
+
+    The state is loaded from ``path`` on first use and saved there after
+    every change, with ``huawei_utils.load_json_state`` and
+    ``save_json_state``. Without a path it only lives in memory.
+    """
+
+    def __init__(self, path=None, clock=time.time):
+        """
+        :param path: File the state is persisted to, or ``None``.
+        :param clock: Callable returning the current time in seconds.
+        """
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _load(self):
+        # Called with the lock held.
+        if self._state is None:
+            state = None
+            if self.path is not None:
+                state = huawei_utils.load_json_state(self.path)
+            if not isinstance(state, dict):
+                state = {}
+            for section in SECTIONS:
+                if not isinstance(state.get(section), dict):
+                    state[section] = {}
+            state.setdefault('verified', None)
+            self._state = state
+        return self._state
+
+    def _save(self):
+        # Called with the lock held.
+        if self.path is not None:
+            huawei_utils.save_json_state(self.path, self._state)
+
+    def get(self, section, key):
+        """
+        :returns: The cached value of ``key`` in ``section``, or ``None``.
+        """
+        with self._lock:
+            return self._load()[section].get(unicode(key))
+
+    def put(self, section, key, value):
+        """
+        Record ``value`` for ``key`` in ``section``.
+
+        What is recorded has just been checked on the array, so an empty
+        cache starts out verified now.
+        """
+        with self._lock:
+            state = self._load()
+            if state[section].get(unicode(key)) == value:
+                return
+            state[section][unicode(key)] = value
+            if state['verified'] is None:
+                state['verified'] = self._clock()
+            self._save()
+
+    def forget(self, section, key):
+        """Drop ``key`` from ``section``."""
+        with self._lock:
+            state = self._load()
+            if state[section].pop(unicode(key), None) is not None:
+                self._save()
+
+    def forget_host(self, host_id):
+        """
+        Drop everything recorded about a host, so that its registration
+        is checked on the array again on next use.
+        """
+        host_id = unicode(host_id)
+        with self._lock:
+            state = self._load()
+            for name, value in state[HOSTS].items():
+                if value == host_id:
+                    del state[HOSTS][name]
+            hostgroup_id = state[MEMBERS].pop(host_id, None)
+            for name, value in state[HOSTGROUPS].items():
+                if value == hostgroup_id:
+                    del state[HOSTGROUPS][name]
+            for name, value in state[INITIATORS].items():
+                if value.get('host_id') == host_id:
+                    del state[INITIATORS][name]
+            self._save()
+
+    def items(self, section):
+        """
+        :returns: A ``list`` of the ``(key, value)`` pairs of ``section``.
+        """
+        with self._lock:
+            return self._load()[section].items()
+
+    def stale(self, interval):
+        """
+        :returns: Whether the state was last verified more than
+            ``interval`` seconds ago.
+        """
+        with self._lock:
+            verified = self._load()['verified']
+        return verified is None or self._clock() - verified > interval
+
+    def mark_verified(self):
+        """Record that the whole state was just verified."""
+        with self._lock:
+            self._load()['verified'] = self._clock()
+            self._save()
@@ -1,13 +1,37 @@
 # Copyright (c) 2015 Huawei Technologies Co., Ltd.
 # See LICENSE file for details.
 
-import cookielib
+from Cookie import SimpleCookie, CookieError
+import hashlib
+import httplib
 import json
-import urllib2
+import threading
+import time
+import urllib
 
 from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.http_pool import ConnectionPool
 from huawei_oceanstor_flocker_plugin.log import LOG
 from huawei_oceanstor_flocker_plugin import huawei_utils
+from huawei_oceanstor_flocker_plugin.metrics import timed_call
+from huawei_oceanstor_flocker_plugin import registration as reg
+from huawei_oceanstor_flocker_plugin.registration import RegistrationCache
+from huawei_oceanstor_flocker_plugin.rest_log import PayloadLogPolicy
+
+
+def _endpoint(client, url=False, *args, **kwargs):
+    """
+    The metrics label of a REST call: its first path segment, without
+    object IDs or query, e.g. ``lun`` for ``/lun/12?range=[0-100]``.
+    """
+    path = (url or '').split('?')[0]
+    if path.endswith('/sessions'):
+        return 'sessions'
+    return path.strip('/').split('/')[0] or 'unknown'
+
+
+def _call_failed(result):
+    return result.get('error', {}).get('code', 0) != 0
 
 
 class VolumeBackendAPIException(Exception):
@@ -19,66 +43,129 @@ class VolumeBackendAPIException(Exception):
 class RestClient(object):
     """Common class for Huawei OceanStor storage system."""
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, payload_log=None, pool=None,
+                 page_size=constants.REST_PAGE_SIZE, registration=None):
+        """
+        :param dict configuration: Login information, as returned by
+            ``huawei_utils.get_login_info``.
+        :param PayloadLogPolicy payload_log: How calls are logged.
+        :param ConnectionPool pool: Keep-alive connections to the array,
+            one is made for this client by default.
+        :param int page_size: Objects asked for per call when walking a
+            listing.
+        :param RegistrationCache registration: The host registration of
+            this node, by default persisted to the ``RegistrationFile`` of
+            ``configuration`` or to ``constants.HOST_REGISTRATION_FILE``.
+        """
         self.configuration = configuration
         self.url = None
         self.device_id = None
+        if payload_log is None:
+            payload_log = PayloadLogPolicy()
+        self.payload_log = payload_log
+        self.page_size = page_size
+        if pool is None:
+            pool = ConnectionPool()
+        self.pool = pool
+        self._session_lock = threading.Lock()
+        # (kind, NAME) -> ID of the hosts, hostgroups, lungroups and
+        # mapping views looked up or created through this client.
+        self._name_index = {}
+        self._index_lock = threading.Lock()
+        # (host_id, hostgroup_id, portgroup_id) -> (lungroup_id, view_id)
+        # of mapping views verified by do_mapping.
+        self._topology = {}
+        self._topology_lock = threading.Lock()
+        self._array_version = None
+        if registration is None:
+            registration = RegistrationCache(
+                configuration.get('RegistrationFile') or
+                constants.HOST_REGISTRATION_FILE)
+        self.registration = registration
+        self._verify_thread = None
+        self._verify_lock = threading.Lock()
         self._init_http_head()
 
     def _init_http_head(self):
-        self.cookie = cookielib.CookieJar()
-        self.headers = {
-            "Connection": "keep-alive",
-            "Content-Type": "application/json",
-        }
-
+        with self._session_lock:
+            self.cookies = {}
+            self.headers = {
+                "Connection": "keep-alive",
+                "Content-Type": "application/json",
+            }
+
+    def _request_headers(self):
+        with self._session_lock:
+            headers = dict(self.headers)
+            if self.cookies:
+                headers['Cookie'] = '; '.join(
+                    '%s=%s' % item for item in sorted(self.cookies.items()))
+        return headers
+
+    def _store_cookies(self, response_headers):
+        cookies = {}
+        for header in response_headers.getheaders('set-cookie'):
+            try:
+                parsed = SimpleCookie(header)
+            except CookieError:
+                continue
+            for name, morsel in parsed.items():
+                cookies[name] = morsel.value
+        if cookies:
+            with self._session_lock:
+                self.cookies.update(cookies)
+
+    @timed_call(_endpoint, _call_failed)
     def do_call(self, url=False, data=None, method=None,
                 calltimeout=constants.SOCKET_TIMEOUT):
         """Send requests to server.
 
         Send HTTPS call, get response in JSON.
         Convert response into Python Object and return it.
+
+        Calls go over the client's keep-alive connections, with
+        ``calltimeout`` applied to this call only, so one client can be
+        shared between threads.
         """
-        if self.url:
+        path = url
+        # Login posts to an absolute URL, also when re-logging in.
+        if self.url and not url.startswith(('http://', 'https://')):
             url = self.url + url
-
-        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookie))
-        urllib2.install_opener(opener)
+        if method is None:
+            method = 'POST' if data is not None else 'GET'
         res_json = None
 
-        LOG.info(('\n\n\n\nRequest URL: %(url)s\n\n'
-                   'Call Method: %(method)s\n\n'
-                   'Request Data: %(data)s\n\n') % {'url': url,
-                                                    'method': method,
-                                                    'data': data})
-
+        start = time.time()
+        status = None
+        res = None
         try:
-            urllib2.socket.setdefaulttimeout(calltimeout)
-            req = urllib2.Request(url, data, self.headers)
-            if method:
-                req.get_method = lambda: method
-            res = urllib2.urlopen(req).read().decode("utf-8")
-
-            if "xx/sessions" not in url:
-                LOG.info(('\n\n\n\nRequest URL: %(url)s\n\n'
-                           'Call Method: %(method)s\n\n'
-                           'Request Data: %(data)s\n\n'
-                           'Response Data:%(res)s\n\n')
-                          % {'url': url, 'method': method,
-                             'data': data, 'res': res})
-
+            response = self.pool.request(method, url, data,
+                                         self._request_headers(),
+                                         timeout=calltimeout)
+            status = response.status
+            self._store_cookies(response.headers)
+            res = response.body.decode("utf-8")
+            if status >= 400:
+                raise httplib.HTTPException(
+                    'HTTP %d %s' % (status, response.reason))
         except Exception as err:
-            LOG.error('Bad response from server: %(url)s.Error: %(err)s'
-                      % {'url': url, 'err': err})
+            LOG.error('Bad response from server: %(url)s.Error: %(err)s',
+                      {'url': url, 'err': err})
             json_msg = ('{"error":{"code": %s,"description": "Connect to '
                         'server error."}}') % constants.ERROR_CONNECT_TO_SERVER
             res_json = json.loads(json_msg)
             return res_json
+        finally:
+            self.payload_log.log_call(
+                method, path,
+                _endpoint(self, path), status,
+                len(res) if res is not None else 0, time.time() - start,
+                data, res)
 
         try:
             res_json = json.loads(res)
         except Exception as err:
-            LOG.error('JSON transfer error: %s.' % err.message)
+            LOG.error('JSON transfer error: %s.', err.message)
             raise
 
         return res_json
@@ -96,13 +183,14 @@ class RestClient(object):
                               calltimeout=constants.LOGIN_SOCKET_TIMEOUT)
 
         if (result['error']['code'] != 0) or ("data" not in result):
-            LOG.error("Login error, reason is: %s." % result)
+            LOG.error("Login error, reason is: %s.", result)
             return None
 
-        LOG.info('Login success: %(url)s' % {'url': urlstr})
+        LOG.info('Login success: %(url)s', {'url': urlstr})
         self.device_id = result['data']['deviceid']
         self.url = urlstr + self.device_id
-        self.headers['iBaseToken'] = result['data']['iBaseToken']
+        with self._session_lock:
+            self.headers['iBaseToken'] = result['data']['iBaseToken']
 
         return self.device_id
 
@@ -134,19 +222,95 @@ class RestClient(object):
         result = self.do_call(url, data, method)
         return result
 
+    def _iter_range(self, url, err_msg):
+        """
+        Walk a listing page by page.
+
+        :param url: The listing, without ``range``, e.g. ``/host`` or
+            ``/fc_initiator?ISFREE=true``.
+        :param err_msg: Error logged if a page can't be read.
+        :returns: A generator of the listed objects. Pages are only asked
+            for as the caller gets to them, so stopping early saves the
+            remaining calls.
+        """
+        separator = '&' if '?' in url else '?'
+        start = 0
+        while True:
+            result = self.call("%s%srange=[%d-%d]" % (
+                url, separator, start, start + self.page_size), None, "GET")
+            self._assert_rest_result(result, err_msg)
+            items = result.get('data', [])
+            for item in items:
+                yield item
+            if len(items) < self.page_size:
+                return
+            start += self.page_size
+
     def _get_id_from_result(self, result, name, key):
         if 'data' in result:
             for item in result['data']:
                 if name == item[key]:
                     return item['ID']
 
+    def _remember_name(self, kind, name, object_id):
+        with self._index_lock:
+            self._name_index[(kind, name)] = object_id
+
+    def _forget_id(self, kind, object_id):
+        with self._index_lock:
+            for key, value in self._name_index.items():
+                if key[0] == kind and value == object_id:
+                    del self._name_index[key]
+
+    def invalidate_names(self):
+        """Drop every name to ID mapping this client has learnt."""
+        with self._index_lock:
+            self._name_index.clear()
+
+    def _find_by_name(self, kind, name, listing_url, err_msg):
+        """
+        Get the ID of the ``kind`` object called ``name``.
+
+        Known names are answered from the index. Otherwise the array is
+        asked for that name only; arrays that reject ``filter`` get
+        ``listing_url`` walked up to the name, indexing every name on the
+        way.
+
+        :returns: The ID, or ``None`` if the array has no such object.
+        :raises VolumeBackendAPIException: If the array could not be
+            asked, as the full listings this replaces did. Callers create
+            the object when ``None`` is returned, so an unreachable array
+            must not look like a missing name.
+        """
+        with self._index_lock:
+            object_id = self._name_index.get((kind, name))
+        if object_id is not None:
+            return object_id
+
+        if isinstance(name, unicode):
+            quoted = urllib.quote(name.encode('utf-8'))
+        else:
+            quoted = urllib.quote(str(name))
+        result = self.call("/%s?filter=NAME::%s" % (kind, quoted),
+                           None, "GET")
+        if result['error']['code'] == constants.ERROR_CONNECT_TO_SERVER:
+            self._assert_rest_result(result, err_msg)
+        if result['error']['code'] == 0:
+            object_id = self._get_id_from_result(result, name, 'NAME')
+            if object_id is not None:
+                self._remember_name(kind, name, object_id)
+            return object_id
+
+        for item in self._iter_range(listing_url, err_msg):
+            self._remember_name(kind, item['NAME'], item['ID'])
+            if item['NAME'] == name:
+                return item['ID']
+        return None
+
     def find_host(self, host_name):
         """Get the given host ID."""
-        url = "/host?range=[0-65535]"
-        result = self.call(url, None, "GET")
-        self._assert_rest_result(result, ('Find host in hostgroup error.'))
-
-        return self._get_id_from_result(result, host_name, 'NAME')
+        return self._find_by_name('host', host_name, "/host",
+                                  'Find host in hostgroup error.')
 
     def _add_host(self, hostname, host_name_before_hash):
         """Add a new host."""
@@ -159,6 +323,7 @@ class RestClient(object):
         self._assert_rest_result(result, 'Add new host error.')
 
         if 'data' in result:
+            self._remember_name('host', hostname, result['data']['ID'])
             return result['data']['ID']
 
     def add_host_with_check(self, host_name):
@@ -167,12 +332,18 @@ class RestClient(object):
             host_name_before_hash = host_name
             host_name = hash(host_name)
 
+        host_id = self.registration.get(reg.HOSTS, host_name)
+        if host_id:
+            self._trust_registration()
+            return host_id
+
         host_id = self.find_host(host_name)
         if host_id:
+            self.registration.put(reg.HOSTS, host_name, host_id)
             LOG.info((
                 'add_host_with_check. '
                 'host name: %(name)s, '
-                'host id: %(id)s') %
+                'host id: %(id)s'),
                 {'name': host_name,
                  'id': host_id})
             return host_id
@@ -182,7 +353,7 @@ class RestClient(object):
         except Exception:
             LOG.info((
                 'Failed to create host: %(name)s. '
-                'Check if it exists on the array.') %
+                'Check if it exists on the array.'),
                 {'name': host_name})
             host_id = self.find_host(host_name)
             if not host_id:
@@ -193,22 +364,28 @@ class RestClient(object):
                 LOG.error(err_msg)
                 raise VolumeBackendAPIException
 
+        self.registration.put(reg.HOSTS, host_name, host_id)
         LOG.info((
             'add_host_with_check. '
             'create host success. '
             'host name: %(name)s, '
-            'host id: %(id)s') %
+            'host id: %(id)s'),
             {'name': host_name,
              'id': host_id})
         return host_id
 
     def _initiator_is_added_to_array(self, ininame):
-        """Check whether the initiator is already added on the array."""
-        url = "/iscsi_initiator?range=[0-256]"
-        result = self.call(url, None, "GET")
+        """Check whether the initiator is already added on the array.
 
-        if self._get_id_from_result(result, ininame, 'ID'):
-            return True
+        An initiator that can't be listed counts as not added.
+        """
+        try:
+            for item in self._iter_range("/iscsi_initiator",
+                                         'Get iSCSI initiators error.'):
+                if item['ID'] == ininame:
+                    return True
+        except VolumeBackendAPIException:
+            pass
         return False
 
     def _add_initiator_to_array(self, initiator_name):
@@ -220,14 +397,17 @@ class RestClient(object):
         result = self.call(url, data, "POST")
 
     def is_initiator_associated_to_host(self, ininame):
-        """Check whether the initiator is associated to the host."""
-        url = "/iscsi_initiator?range=[0-256]"
-        result = self.call(url, None, "GET")
+        """Check whether the initiator is associated to the host.
 
-        if 'data' in result:
-            for item in result['data']:
-                if item['ID'] == ininame and item['ISFREE'] == "true":
-                    return False
+        An initiator that can't be listed counts as associated.
+        """
+        try:
+            for item in self._iter_range("/iscsi_initiator",
+                                         'Get iSCSI initiators error.'):
+                if item['ID'] == ininame:
+                    return item['ISFREE'] != "true"
+        except VolumeBackendAPIException:
+            pass
         return True
 
     def find_chap_info(self, iscsi_conf, initiator_name):
@@ -317,6 +497,23 @@ class RestClient(object):
             self._use_alua(initiator_name, multipath_type)
 
     def ensure_initiator_added(self, xml_file_path, initiator_name, host_id):
+        """
+        Add an initiator to the array and associate it with a host.
+
+        :param initiator_name: The initiator, ``None`` for the one of this
+            node.
+        """
+        if initiator_name is None:
+            initiator_name = huawei_utils.iscsi_get_initiator()
+            if initiator_name is None:
+                raise VolumeBackendAPIException
+        registered = {'host_id': host_id,
+                      'options': self._initiator_options(xml_file_path,
+                                                         initiator_name)}
+        if self.registration.get(reg.INITIATORS,
+                                 initiator_name) == registered:
+            self._trust_registration()
+            return
         added = self._initiator_is_added_to_array(initiator_name)
         if not added:
             self._add_initiator_to_array(initiator_name)
@@ -324,14 +521,23 @@ class RestClient(object):
             self._associate_initiator_to_host(xml_file_path,
                                               initiator_name,
                                               host_id)
+        self.registration.put(reg.INITIATORS, initiator_name, registered)
+
+    def _initiator_options(self, xml_file_path, initiator_name):
+        """
+        A digest of the CHAP and ALUA settings of an initiator, so that
+        changing them in the config file registers it again.
+        """
+        iscsi_conf = huawei_utils.get_iscsi_conf(xml_file_path) or {}
+        settings = [ini for ini in iscsi_conf.get('Initiator', [])
+                    if ini.get('Name') == initiator_name]
+        return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
 
     def find_hostgroup(self, groupname):
         """Get the given hostgroup id."""
-        url = "/hostgroup?range=[0-8191]"
-        result = self.call(url, None, "GET")
-        self._assert_rest_result(result, 'Get hostgroup information error.')
-
-        return self._get_id_from_result(result, groupname, 'NAME')
+        return self._find_by_name('hostgroup', groupname,
+                                  "/hostgroup",
+                                  'Get hostgroup information error.')
 
     def _create_hostgroup(self, hostgroup_name):
         url = "/hostgroup"
@@ -342,16 +548,25 @@ class RestClient(object):
         self._assert_rest_result(result, msg)
         self._assert_data_in_result(result, msg)
 
+        self._remember_name('hostgroup', hostgroup_name,
+                            result['data']['ID'])
         return result['data']['ID']
 
     def create_hostgroup_with_check(self, hostgroup_name):
         """Check if host exists on the array, or create it."""
+        hostgroup_id = self.registration.get(reg.HOSTGROUPS, hostgroup_name)
+        if hostgroup_id:
+            self._trust_registration()
+            return hostgroup_id
+
         hostgroup_id = self.find_hostgroup(hostgroup_name)
         if hostgroup_id:
+            self.registration.put(reg.HOSTGROUPS, hostgroup_name,
+                                  hostgroup_id)
             LOG.info((
                 'create_hostgroup_with_check. '
                 'hostgroup name: %(name)s, '
-                'hostgroup id: %(id)s') %
+                'hostgroup id: %(id)s'),
                 {'name': hostgroup_name,
                  'id': hostgroup_id})
             return hostgroup_id
@@ -361,7 +576,7 @@ class RestClient(object):
         except Exception:
             LOG.info((
                 'Failed to create hostgroup: %(name)s. '
-                'Please check if it exists on the array.') %
+                'Please check if it exists on the array.'),
                 {'name': hostgroup_name})
             hostgroup_id = self.find_hostgroup(hostgroup_name)
             if hostgroup_id is None:
@@ -372,11 +587,12 @@ class RestClient(object):
                 LOG.error(err_msg)
                 raise VolumeBackendAPIException
 
+        self.registration.put(reg.HOSTGROUPS, hostgroup_name, hostgroup_id)
         LOG.info((
             'create_hostgroup_with_check. '
             'Create hostgroup success. '
             'hostgroup name: %(name)s, '
-            'hostgroup id: %(id)s') %
+            'hostgroup id: %(id)s'),
             {'name': hostgroup_name,
              'id': hostgroup_id})
         return hostgroup_id
@@ -411,6 +627,11 @@ class RestClient(object):
 
         If hostgroup doesn't exist, create one.
         """
+        hostgroup_id = self.registration.get(reg.MEMBERS, host_id)
+        if hostgroup_id:
+            self._trust_registration()
+            return hostgroup_id
+
         hostgroup_name = constants.HOSTGROUP_PREFIX + host_id
         hostgroup_id = self.create_hostgroup_with_check(hostgroup_name)
         is_associated = self._is_host_associate_to_hostgroup(hostgroup_id,
@@ -418,25 +639,74 @@ class RestClient(object):
         if not is_associated:
             self._associate_host_to_hostgroup(hostgroup_id, host_id)
 
+        self.registration.put(reg.MEMBERS, host_id, hostgroup_id)
         return hostgroup_id
 
+    def _trust_registration(self):
+        """
+        Start verifying the cached registration in the background if it
+        was last verified more than ``REGISTRATION_VERIFY_INTERVAL`` ago.
+        """
+        if not self.registration.stale(
+                constants.REGISTRATION_VERIFY_INTERVAL):
+            return
+        with self._verify_lock:
+            if (self._verify_thread is not None and
+                    self._verify_thread.is_alive()):
+                return
+            self._verify_thread = threading.Thread(
+                target=self.verify_registration,
+                name='huawei-registration')
+            self._verify_thread.daemon = True
+            self._verify_thread.start()
+
+    def verify_registration(self):
+        """
+        Check the cached registration against the array and drop whatever
+        no longer holds, so that it is registered again on next use.
+        """
+        def holds(check, *args):
+            try:
+                return check(*args)
+            except VolumeBackendAPIException:
+                return False
+
+        registration = self.registration
+        for name, host_id in registration.items(reg.HOSTS):
+            self._forget_id('host', host_id)
+            if holds(self.find_host, name) != host_id:
+                LOG.info('Host %s is no longer registered.', name)
+                registration.forget_host(host_id)
+        for name, hostgroup_id in registration.items(reg.HOSTGROUPS):
+            self._forget_id('hostgroup', hostgroup_id)
+            if holds(self.find_hostgroup, name) != hostgroup_id:
+                LOG.info('Hostgroup %s is no longer registered.', name)
+                registration.forget(reg.HOSTGROUPS, name)
+        for host_id, hostgroup_id in registration.items(reg.MEMBERS):
+            if not holds(self._is_host_associate_to_hostgroup,
+                         hostgroup_id, host_id):
+                LOG.info('Host %s is no longer in hostgroup %s.',
+                         host_id, hostgroup_id)
+                registration.forget(reg.MEMBERS, host_id)
+        for name, registered in registration.items(reg.INITIATORS):
+            if name not in (holds(self.get_host_initiators, 'iscsi',
+                                  registered['host_id']) or []):
+                LOG.info('Initiator %s is no longer associated to host '
+                         '%s.', name, registered['host_id'])
+                registration.forget(reg.INITIATORS, name)
+        registration.mark_verified()
+
     def _find_lungroup(self, lungroup_name):
         """Get the given hostgroup id."""
-        url = "/lungroup?range=[0-8191]"
-        result = self.call(url, None, "GET")
-        self._assert_rest_result(result, ('Get lungroup information error.'))
-
-        return self._get_id_from_result(result, lungroup_name, 'NAME')
+        return self._find_by_name('lungroup', lungroup_name,
+                                  "/lungroup",
+                                  'Get lungroup information error.')
 
     def find_mapping_view(self, name):
         """Find mapping view."""
-        url = "/mappingview?range=[0-8191]"
-        result = self.call(url, None, "GET")
-
-        msg = 'Find mapping view error.'
-        self._assert_rest_result(result, msg)
-
-        return self._get_id_from_result(result, name, 'NAME')
+        return self._find_by_name('mappingview', name,
+                                  "/mappingview",
+                                  'Find mapping view error.')
 
     def _create_lungroup(self, lungroup_name):
         url = "/lungroup"
@@ -450,6 +720,7 @@ class RestClient(object):
         self._assert_rest_result(result, msg)
         self._assert_data_in_result(result, msg)
 
+        self._remember_name('lungroup', lungroup_name, result['data']['ID'])
         return result['data']['ID']
 
     def _is_lun_associated_to_lungroup(self, lungroup_id, lun_id):
@@ -481,6 +752,7 @@ class RestClient(object):
         result = self.call(url, data)
         self._assert_rest_result(result, 'Add mapping view error.')
 
+        self._remember_name('mappingview', name, result['data']['ID'])
         return result['data']['ID']
 
     def _associate_hostgroup_to_view(self, view_id, hostgroup_id):
@@ -545,11 +817,17 @@ class RestClient(object):
             return True
         return False
 
-    def find_array_version(self):
+    def find_array_version(self, refresh=False):
+        """
+        Get the product version of the array, asked once per client.
+        """
+        if self._array_version is not None and not refresh:
+            return self._array_version
         url = "/system/"
         result = self.call(url, None)
         self._assert_rest_result(result, ('Find array version error.'))
-        return result['data']['PRODUCTVERSION']
+        self._array_version = result['data']['PRODUCTVERSION']
+        return self._array_version
 
     def find_view_by_id(self, view_id):
         url = "/MAPPINGVIEW/" + view_id
@@ -569,17 +847,131 @@ class RestClient(object):
         self._assert_rest_result(
             result, 'Delete associated lun from lungroup error.')
 
+    def invalidate_topology(self, host_id=None):
+        """
+        Forget the verified mapping views of ``host_id``, or of every host.
+        """
+        with self._topology_lock:
+            for key in self._topology.keys():
+                if host_id is None or key[0] == host_id:
+                    del self._topology[key]
+
+    def _map_info(self, lun_id, view_id):
+        map_info = {}
+        version = self.find_array_version()
+        if version >= constants.ARRAY_VERSION:
+            # The free host LUN IDs change with every mapping.
+            map_info["lun_id"] = lun_id
+            map_info["view_id"] = view_id
+            map_info["aval_luns"] = self.find_view_by_id(view_id)
+        return map_info
+
     def do_mapping(self, lun_id, hostgroup_id, host_id, tgtportgroup_id=None):
-        """Add hostgroup and lungroup to mapping view."""
+        """Add hostgroup and lungroup to mapping view.
+
+        Once the lungroup and mapping view of a host have been verified,
+        mapping another LUN to it only associates the LUN to the lungroup.
+        If that fails, the whole view is verified again.
+        """
+        lungroup_id, view_id = self._map_lun(lun_id, hostgroup_id, host_id,
+                                             tgtportgroup_id)
+        return self._map_info(lun_id, view_id)
+
+    def do_batch_mapping(self, lun_ids, hostgroup_id, host_id,
+                         tgtportgroup_id=None, rescan=True):
+        """
+        Map several LUNs to one host.
+
+        The mapping view of the host is verified at most once for the
+        whole batch, a failing LUN does not stop the others and the SCSI
+        hosts are rescanned once at the end.
+
+        :param lun_ids: IDs of the LUNs to map.
+        :param bool rescan: Whether to rescan the local SCSI hosts after
+            mapping.
+        :returns: A ``dict`` mapping each LUN ID to its ``map_info``, or to
+            the ``VolumeBackendAPIException`` that kept it from being
+            mapped.
+        """
+        results = {}
+        views = {}
+        for lun_id in lun_ids:
+            try:
+                lungroup_id, views[lun_id] = self._map_lun(
+                    lun_id, hostgroup_id, host_id, tgtportgroup_id)
+            except VolumeBackendAPIException as err:
+                results[lun_id] = err
+
+        view_info = {}
+        for lun_id, view_id in views.items():
+            if view_id not in view_info:
+                view_info[view_id] = self._map_info(None, view_id)
+            map_info = dict(view_info[view_id])
+            if map_info:
+                map_info["lun_id"] = lun_id
+            results[lun_id] = map_info
+
+        if views and rescan:
+            try:
+                host_luns = self.get_host_lun_ids(host_id)
+            except VolumeBackendAPIException:
+                # The LUNs are mapped already; find them with a full scan.
+                host_luns = {}
+            luns = [host_luns[lun_id] for lun_id in views
+                    if lun_id in host_luns]
+            huawei_utils.rescan_scsi(luns if len(luns) == len(views)
+                                     else None)
+        return results
+
+    def _map_lun(self, lun_id, hostgroup_id, host_id, tgtportgroup_id):
+        """
+        Associate a LUN to the lungroup of a host, verifying the mapping
+        view of the host the first time and whenever that fails.
+
+        :returns: The lungroup and mapping view IDs.
+        """
+        key = (host_id, hostgroup_id, tgtportgroup_id)
+        with self._topology_lock:
+            topology = self._topology.get(key)
+        if topology is not None:
+            lungroup_id, view_id = topology
+            try:
+                self.associate_lun_to_lungroup(lungroup_id, lun_id)
+            except VolumeBackendAPIException:
+                LOG.info('Mapping view of host %s changed, verifying it '
+                         'again.', host_id)
+                self.invalidate_topology(host_id)
+                self.invalidate_names()
+            else:
+                return topology
+
+        try:
+            topology = self._verify_mapping(lun_id, hostgroup_id, host_id,
+                                            tgtportgroup_id)
+        except VolumeBackendAPIException:
+            # The host or hostgroup may be gone too.
+            self.registration.forget_host(host_id)
+            raise
+        with self._topology_lock:
+            self._topology[key] = topology
+        return topology
+
+    def _verify_mapping(self, lun_id, hostgroup_id, host_id,
+                        tgtportgroup_id=None):
+        """
+        Check every part of the mapping view of a host, creating and
+        associating what is missing, and add the LUN to its lungroup.
+
+        :returns: The lungroup and mapping view IDs.
+        """
         lungroup_name = constants.LUNGROUP_PREFIX + host_id
         mapping_view_name = constants.MAPPING_VIEW_PREFIX + host_id
         lungroup_id = self._find_lungroup(lungroup_name)
         view_id = self.find_mapping_view(mapping_view_name)
-        map_info = {}
 
         LOG.info((
             'do_mapping, lun_group: %(lun_group)s, '
-            'view_id: %(view_id)s, lun_id: %(lun_id)s.') %
+            'view_id: %(view_id)s, lun_id: %(lun_id)s.'),
             {'lun_group': lungroup_id,
              'view_id': view_id,
              'lun_id': lun_id})
@@ -611,46 +1003,134 @@ class RestClient(object):
                         self._associate_portgroup_to_view(view_id,
                                                           tgtportgroup_id)
 
-            version = self.find_array_version()
-            if version >= constants.ARRAY_VERSION:
-                aval_luns = self.find_view_by_id(view_id)
-                map_info["lun_id"] = lun_id
-                map_info["view_id"] = view_id
-                map_info["aval_luns"] = aval_luns
-
         except Exception:
             LOG.error('Error occurred when adding hostgroup and lungroup to '
                       'view. Remove lun from lungroup now.')
+            # An ID may have gone stale behind our back.
+            self.invalidate_names()
             self.remove_lun_from_lungroup(lungroup_id, lun_id)
             raise VolumeBackendAPIException
 
-        return map_info
+        return lungroup_id, view_id
+
+    def _lungroup_lun_ids(self, lungroup_id):
+        """Get the IDs of the LUNs in a lungroup."""
+        url = ("/lun/associate?TYPE=11&"
+               "ASSOCIATEOBJTYPE=256&ASSOCIATEOBJID=%s" % lungroup_id)
+        result = self.call(url, None, "GET")
+        self._assert_rest_result(result, 'Check lungroup associate error.')
+        return set(item['ID'] for item in result.get('data', []))
+
+    def _host_lungroup(self, host_id):
+        """
+        Get the lungroup mapped to a host, from the verified mapping views
+        if there is one, else by the name ``do_mapping`` gives it, else
+        from the mapping view of the host.
+        """
+        with self._topology_lock:
+            for key, (lungroup_id, view_id) in self._topology.items():
+                if key[0] == host_id:
+                    return lungroup_id
+        lungroup_id = self._find_lungroup(constants.LUNGROUP_PREFIX + host_id)
+        if lungroup_id:
+            return lungroup_id
+        view_id = self.find_mapping_view(
+            constants.MAPPING_VIEW_PREFIX + host_id)
+        if view_id:
+            return self.find_lungroup_from_map(view_id)
+        return None
+
+    def delete_batch_mapping(self, lun_ids, host_name):
+        """
+        Unmap several LUNs from one host.
 
-    def delete_mapping(self, lun_id, host_name):
+        The lungroup of the host and its LUNs are looked up once. LUNs
+        that are not mapped count as unmapped.
+
+        :returns: A ``dict`` mapping each LUN ID to ``None`` once it is
+            unmapped, or to the ``VolumeBackendAPIException`` that kept it
+            mapped.
+        """
         if host_name and len(host_name) > constants.MAX_HOSTNAME_LENGTH:
             host_name = hash(host_name)
+        results = dict((lun_id, None) for lun_id in lun_ids)
         host_id = self.find_host(host_name)
-        if host_id:
-            mapping_view_name = constants.MAPPING_VIEW_PREFIX + host_id
-            view_id = self.find_mapping_view(mapping_view_name)
-            if view_id:
-                lungroup_id = self.find_lungroup_from_map(view_id)
-
-        # Remove lun from lungroup.
-        if lun_id and self.check_lun_exist(lun_id):
-            if lungroup_id:
+        lungroup_id = self._host_lungroup(host_id) if host_id else None
+        if not lungroup_id or not results:
+            return results
+
+        mapped = self._lungroup_lun_ids(lungroup_id)
+        for lun_id in lun_ids:
+            if lun_id not in mapped:
+                continue
+            try:
+                self.remove_lun_from_lungroup(lungroup_id, lun_id)
+            except VolumeBackendAPIException as err:
+                results[lun_id] = err
+        return results
+
+    def delete_mapping(self, lun_id, host_name=None):
+        """Remove a LUN from the lungroup of a host.
+
+        The lungroup comes from the verified mapping views or the name
+        index, so in the steady state this is a single call. Without
+        ``host_name`` the LUN is unmapped from every host it is mapped to.
+        If the removal fails, the lungroups of the LUN are looked up: a LUN
+        in no lungroup at all is not mapped and is left alone, and a LUN
+        that is in other lungroups gets the lungroup of the host looked up
+        again, in case the cached one was stale, and removed from it.
+        Anything else raises.
+        """
+        if host_name is None:
+            host_ids = [item['ID'] for item in
+                        self.get_host_of_lun_map(lun_id).get('data', [])]
+        else:
+            if len(host_name) > constants.MAX_HOSTNAME_LENGTH:
+                host_name = hash(host_name)
+            host_ids = [self.find_host(host_name)]
+
+        for host_id in host_ids:
+            lungroup_id = self._host_lungroup(host_id) if host_id else None
+            if lungroup_id is None:
+                LOG.info('Host %s has no lungroup, lun %s is not mapped.',
+                         host_name, lun_id)
+                continue
+            try:
+                self.remove_lun_from_lungroup(lungroup_id, lun_id)
+                continue
+            except VolumeBackendAPIException:
                 lungroup_ids = self.get_lungroupids_by_lunid(lun_id)
+                if not lungroup_ids:
+                    LOG.info('Lun %s is not in any lungroup.', lun_id)
+                    continue
                 if lungroup_id in lungroup_ids:
-                    self.remove_lun_from_lungroup(lungroup_id, lun_id)
-                else:
-                    LOG.info(('Lun is not in lungroup. '
-                              'Lun id: %(lun_id)s. '
-                              'lungroup id: %(lungroup_id)s.')
-                             % {"lun_id": lun_id,
-                                "lungroup_id": lungroup_id})
-        else:
-            LOG.error("Can't find lun on the array.")
-            raise VolumeBackendAPIException
+                    self.invalidate_topology(host_id)
+                    raise
+
+            self._forget_host_lungroup(host_id, lungroup_id)
+            lungroup_id = self._host_lungroup(host_id)
+            if lungroup_id not in lungroup_ids:
+                LOG.error(('Lun is not in the lungroup of the host. '
+                           'Lun id: %(lun_id)s. host id: %(host_id)s. '
+                           'lungroup ids: %(lungroup_ids)s.'),
+                          {"lun_id": lun_id, "host_id": host_id,
+                           "lungroup_ids": lungroup_ids})
+                raise VolumeBackendAPIException
+            self.remove_lun_from_lungroup(lungroup_id, lun_id)
+
+    def _forget_host_lungroup(self, host_id, lungroup_id):
+        """
+        Drop the cached lungroup and mapping view of a host, so that
+        ``_host_lungroup`` asks the array again.
+        """
+        self.invalidate_topology(host_id)
+        self._forget_id('lungroup', lungroup_id)
+        with self._index_lock:
+            self._name_index.pop(
+                ('lungroup', constants.LUNGROUP_PREFIX + host_id), None)
+            self._name_index.pop(
+                ('mappingview', constants.MAPPING_VIEW_PREFIX + host_id),
+                None)
 
     def find_lungroup_from_map(self, view_id):
         """Get lungroup from the given map"""
@@ -734,23 +1214,16 @@ class RestClient(object):
 
         If no new ports connected, return an empty list.
         """
-        url = "/fc_initiator?ISFREE=true&range=[0-8191]"
-        result = self.call(url, None, "GET")
-
-        msg = 'Get connected free FC wwn error.'
-        self._assert_rest_result(result, msg)
-
-        wwns = []
-        if 'data' in result:
-            for item in result['data']:
-                wwns.append(item['ID'])
-
-        return wwns
+        return [item['ID'] for item in self._iter_range(
+            "/fc_initiator?ISFREE=true", 'Get connected free FC wwn error.')]
 
     def remove_host(self, host_id):
         url = "/host/%s" % host_id
         result = self.call(url, None, "DELETE")
         self._assert_rest_result(result, 'Remove host from array error.')
+        self._forget_id('host', host_id)
+        self.invalidate_topology(host_id)
+        self.registration.forget_host(host_id)
 
     def get_lungroupids_by_lunid(self, lun_id):
         """Get lungroup ids by lun id."""
@@ -805,6 +1278,25 @@ class RestClient(object):
                     break
         return pool_info
 
+    def get_host_lun_ids(self, host_id):
+        """
+        Get the host LUN IDs the LUNs mapped to a host are seen under.
+
+        :returns: A ``dict`` mapping LUN ID to host LUN ID.
+        """
+        url = ("/lun/associate?TYPE=11&ASSOCIATEOBJTYPE=21"
+               "&ASSOCIATEOBJID=%s" % host_id)
+        result = self.call(url, None, "GET")
+        self._assert_rest_result(result, 'Find host lun id error.')
+        host_luns = {}
+        for item in result.get('data', []):
+            try:
+                metadata = json.loads(item['ASSOCIATEMETADATA'])
+                host_luns[item['ID']] = metadata['HostLUNID']
+            except (KeyError, TypeError, ValueError):
+                continue
+        return host_luns
+
     def get_host_of_lun_map(self, lun_id):
         url = "/host/associate?ASSOCIATEOBJTYPE=11&ASSOCIATEOBJID="+lun_id
         result = self.call(url, None)
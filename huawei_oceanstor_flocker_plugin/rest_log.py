@@ -0,0 +1,94 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Logging policy for OceanStor REST calls.
+
+Every call is summarised by its status, size and latency. Request and
+response bodies are only logged when enabled, for a sample of the calls
+to each endpoint, cut to ``max_bytes`` and with credentials masked.
+"""
+
+import re
+import threading
+
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+SENSITIVE_WORDS = ('password', 'passwd', 'token', 'secret')
+REDACTED = '******'
+
+
+class PayloadLogPolicy(object):
+
+    def __init__(self, log_payloads=constants.REST_LOG_PAYLOADS,
+                 max_bytes=constants.REST_LOG_MAX_BYTES,
+                 sample_every=constants.REST_LOG_SAMPLE_EVERY,
+                 endpoint_sample_every=constants.REST_LOG_ENDPOINT_SAMPLE,
+                 sensitive_words=SENSITIVE_WORDS):
+        """
+        :param bool log_payloads: Whether bodies are logged at all.
+        :param int max_bytes: Length bodies are cut to.
+        :param int sample_every: Log the bodies of one call in this many
+            to each endpoint.
+        :param dict endpoint_sample_every: Per-endpoint overrides of
+            ``sample_every``, e.g. ``{'host': 100}``.
+        :param sensitive_words: JSON keys containing any of these words,
+            case-insensitively, have their values masked.
+        """
+        self.log_payloads = log_payloads
+        self.max_bytes = max_bytes
+        self.sample_every = sample_every
+        self.endpoint_sample_every = dict(endpoint_sample_every or {})
+        self._sensitive = re.compile(
+            r'("[^"]*(?:%s)[^"]*"\s*:\s*)"(?:[^"\\]|\\.)*(?:"|$)'
+            % '|'.join(re.escape(word) for word in sensitive_words),
+            re.IGNORECASE)
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def sampled(self, endpoint):
+        """
+        :returns: Whether the bodies of this call to ``endpoint`` are to
+            be logged.
+        """
+        if not self.log_payloads:
+            return False
+        every = self.endpoint_sample_every.get(endpoint, self.sample_every)
+        if every <= 0:
+            return False
+        with self._lock:
+            count = self._counts.get(endpoint, 0)
+            self._counts[endpoint] = count + 1
+        return count % every == 0
+
+    def render(self, payload):
+        """
+        :returns: ``payload`` cut to ``max_bytes`` with credentials
+            masked, or ``None``.
+        """
+        if payload is None:
+            return None
+        suffix = ''
+        if len(payload) > self.max_bytes:
+            suffix = '...[%d bytes]' % len(payload)
+            payload = payload[:self.max_bytes]
+        return self._sensitive.sub(r'\1"%s"' % REDACTED, payload) + suffix
+
+    def log_call(self, method, path, endpoint, status, size, seconds,
+                 request=None, response=None):
+        """
+        Log a finished REST call.
+
+        :param path: The URL of the call relative to the array.
+        :param status: HTTP status, ``None`` if no response came back.
+        :param int size: Bytes in the response body.
+        :param float seconds: Latency of the call.
+        :param request: Request body.
+        :param response: Response body.
+        """
+        fields = dict(status=status, size=size, seconds=seconds)
+        if self.sampled(endpoint):
+            fields['request'] = self.render(request)
+            fields['response'] = self.render(response)
+        LOG.info("REST %s %s", method or 'GET', path, **fields)
@@ -0,0 +1,166 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Targeted, coalesced SCSI rescans.
+"""
+
+from multiprocessing.pool import ThreadPool
+from threading import Event, Lock
+import os
+import re
+import time
+
+from huawei_oceanstor_flocker_plugin import constants
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+WILDCARD = '-'
+
+_TARGET = re.compile(r'^target(\d+):(\d+):(\d+)$')
+
+
+class _Batch(object):
+    def __init__(self):
+        # host number -> set of (channel, target, lun)
+        self.scans = {}
+        self.done = Event()
+
+
+class ScsiRescanner(object):
+    """
+    Rescan SCSI hosts for given LUNs rather than for everything.
+
+    Only the ``channel target lun`` triples that can hold the LUN are
+    written to each host's ``scan`` file: the targets of the iSCSI
+    sessions on iSCSI hosts, and every target on the others. Scans of
+    different hosts run in parallel. Requests arriving within ``window``
+    seconds of each other are merged into one pass.
+    """
+
+    def __init__(self, sys_root='/sys',
+                 window=constants.RESCAN_COALESCE_WINDOW, sleep=time.sleep):
+        """
+        :param str sys_root: Mount point of sysfs.
+        :param float window: Seconds to wait for more requests to merge.
+        :param sleep: Callable sleeping for the given number of seconds.
+        """
+        self._scsi_host = os.path.join(sys_root, 'class', 'scsi_host')
+        self._iscsi_session = os.path.join(sys_root, 'class',
+                                           'iscsi_session')
+        self.window = window
+        self._sleep = sleep
+        self._lock = Lock()
+        self._pending = None
+
+    def hosts(self):
+        """
+        :returns: The numbers of the SCSI hosts, as strings.
+        """
+        try:
+            names = os.listdir(self._scsi_host)
+        except OSError as err:
+            LOG.error("Can't list %s: %s", self._scsi_host, err)
+            return []
+        return [name[4:] for name in names if name.startswith('host')]
+
+    def iscsi_targets(self):
+        """
+        :returns: A ``dict`` mapping the number of each SCSI host with
+            iSCSI sessions to the set of their ``(channel, target)``.
+        """
+        targets = {}
+        try:
+            sessions = os.listdir(self._iscsi_session)
+        except OSError:
+            return targets
+        for session in sessions:
+            device = os.path.join(self._iscsi_session, session, 'device')
+            try:
+                names = os.listdir(device)
+            except OSError:
+                continue
+            for name in names:
+                match = _TARGET.match(name)
+                if match:
+                    host, channel, target = match.groups()
+                    targets.setdefault(host, set()).add((channel, target))
+        return targets
+
+    def _scans_for(self, luns):
+        """
+        :param luns: Host LUN IDs, or ``None`` for a full rescan.
+        :returns: A ``dict`` mapping host number to the set of
+            ``(channel, target, lun)`` to scan on it.
+        """
+        if luns is None:
+            luns = [WILDCARD]
+        iscsi = self.iscsi_targets()
+        scans = {}
+        for host in self.hosts():
+            if host in iscsi and luns != [WILDCARD]:
+                targets = iscsi[host]
+            else:
+                targets = [(WILDCARD, WILDCARD)]
+            scans[host] = set((channel, target, str(lun))
+                              for channel, target in targets
+                              for lun in luns)
+        return scans
+
+    def _write(self, host_scans):
+        host, scans = host_scans
+        full = (WILDCARD, WILDCARD, WILDCARD)
+        if full in scans:
+            scans = [full]
+        path = os.path.join(self._scsi_host, 'host' + host, 'scan')
+        for scan in sorted(scans):
+            try:
+                with open(path, 'w') as f:
+                    f.write(' '.join(scan))
+            except IOError as err:
+                LOG.error("File error: %s.", err)
+
+    def _run(self, batch):
+        scans = [(host, triples) for host, triples in batch.scans.items()
+                 if triples]
+        if len(scans) > 1:
+            pool = ThreadPool(len(scans))
+            try:
+                pool.map(self._write, scans)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for host_scans in scans:
+                self._write(host_scans)
+
+    def rescan(self, luns=None):
+        """
+        Rescan for LUNs, merged with other requests in the window.
+
+        Returns once a scan that includes this request is done.
+
+        :param luns: Host LUN IDs to look for, ``None`` for all.
+        """
+        scans = self._scans_for(None if luns is None else list(luns))
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            for host, triples in scans.items():
+                merged = batch.scans.setdefault(host, set())
+                merged.update(triples)
+        if not leader:
+            batch.done.wait()
+            return
+        try:
+            self._sleep(self.window)
+        finally:
+            # Close the batch even if the sleep failed, or every later
+            # request would join it and wait forever.
+            with self._lock:
+                self._pending = None
+        try:
+            self._run(batch)
+        finally:
+            batch.done.set()
@@ -0,0 +1,121 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``ConfigLoader`` and the ``huawei_utils`` getters using it.
+"""
+
+import os
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import config, huawei_utils
+from huawei_oceanstor_flocker_plugin.config import ConfigLoader, InvalidConfig
+
+CONFIG = """<?xml version='1.0' encoding='UTF-8'?>
+<config>
+    <Storage>
+        <Protocol>iSCSI</Protocol>
+        <RestURL> https://192.0.2.1:8088/deviceManager/rest/ </RestURL>
+        <UserName>admin</UserName>
+        <UserPassword>secret</UserPassword>
+    </Storage>
+    <LUN>
+        <StoragePool>%(pool)s</StoragePool>
+        <LUNType>Thin</LUNType>
+        <Prefetch Type="1" Value="4"/>
+    </LUN>
+    <iSCSI>
+        <DefaultTargetIP>192.0.2.2</DefaultTargetIP>
+        <Initiator Name="iqn.1993-08.org.debian:01:1" ALUA=" 1 "/>
+    </iSCSI>
+</config>
+"""
+
+
+class ConfigLoaderTests(SynchronousTestCase):
+    """
+    Tests for ``ConfigLoader``.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.setContent(CONFIG % {'pool': 'pool0'})
+        self.parsed = []
+        parse_config = config.parse_config
+
+        def counting_parse(path):
+            self.parsed.append(path)
+            return parse_config(path)
+        self.patch(config, 'parse_config', counting_parse)
+        self.loader = ConfigLoader()
+
+    def test_parsed(self):
+        """
+        The settings of the file are parsed and validated.
+        """
+        loaded = self.loader.load(self.path.path)
+        self.assertEqual(
+            ('iSCSI', 'https://192.0.2.1:8088/deviceManager/rest/', 'pool0',
+             1, '8', [{'Name': 'iqn.1993-08.org.debian:01:1', 'ALUA': '1'}],
+             None),
+            (loaded.protocol, loaded.login_info['RestURL'], loaded.pools,
+             loaded.lun_params['LUNType'], loaded.lun_params['PrefetchValue'],
+             loaded.iscsi['Initiator'], loaded.instance_id))
+
+    def test_cached(self):
+        """
+        An unchanged file is parsed once.
+        """
+        first = self.loader.load(self.path.path)
+        self.assertIs(first, self.loader.load(self.path.path))
+        self.assertEqual(1, len(self.parsed))
+
+    def test_reload_on_change(self):
+        """
+        The file is parsed again once its modification time changes.
+        """
+        self.loader.load(self.path.path)
+        self.path.setContent(CONFIG % {'pool': 'pool1'})
+        os.utime(self.path.path, (0, 12345))
+        self.assertEqual('pool1', self.loader.load(self.path.path).pools)
+
+    def test_malformed(self):
+        """
+        A file that is not well-formed XML raises ``InvalidConfig`` naming
+        the file.
+        """
+        self.path.setContent('<config><Storage></config>')
+        err = self.assertRaises(InvalidConfig, self.loader.load,
+                                self.path.path)
+        self.assertIn(self.path.path, str(err))
+
+
+class HuaweiUtilsGetterTests(SynchronousTestCase):
+    """
+    Tests for the ``huawei_utils`` configuration getters.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.setContent(CONFIG % {'pool': 'pool0'})
+        self.addCleanup(config.invalidate_config)
+
+    def test_copies(self):
+        """
+        Changing a returned value doesn't change the cached configuration.
+        """
+        huawei_utils.get_lun_conf_params(self.path.path)['LUNType'] = 0
+        huawei_utils.get_iscsi_conf(self.path.path)['Initiator'].pop()
+        self.assertEqual(
+            (1, 1),
+            (huawei_utils.get_lun_conf_params(self.path.path)['LUNType'],
+             len(huawei_utils.get_iscsi_conf(self.path.path)['Initiator'])))
+
+    def test_instance_id_written(self):
+        """
+        A generated instance ID is written to the file and read back.
+        """
+        instance_id = huawei_utils.get_instance_id(self.path.path)
+        self.assertEqual(instance_id,
+                         huawei_utils.get_instance_id(self.path.path))
+        self.assertIn(instance_id, self.path.getContent())
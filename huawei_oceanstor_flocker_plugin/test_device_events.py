@@ -0,0 +1,122 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for the device event monitor, driven by synthetic events.
+"""
+
+import threading
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.device_events import (
+    DeviceEvent, DeviceMonitor, parse_uevent
+)
+
+
+def uevent(action, name, subsystem='block', devtype='disk'):
+    devpath = '/devices/pci0000:00/0000:00:07.0/virtio4/block/' + name
+    return '\0'.join(['%s@%s' % (action, devpath),
+                      'ACTION=' + action,
+                      'DEVPATH=' + devpath,
+                      'SUBSYSTEM=' + subsystem,
+                      'DEVNAME=' + name,
+                      'DEVTYPE=' + devtype,
+                      'SEQNUM=1234'])
+
+
+class ParseUeventTests(SynchronousTestCase):
+    """
+    Tests for ``parse_uevent``.
+    """
+    def test_block_disk(self):
+        """
+        Block disk events are parsed into a ``DeviceEvent``.
+        """
+        self.assertEqual(DeviceEvent('add', 'vdc'),
+                         parse_uevent(uevent('add', 'vdc')))
+
+    def test_partition_ignored(self):
+        """
+        Partition events are ignored.
+        """
+        self.assertIs(None,
+                      parse_uevent(uevent('add', 'vdc1', devtype='partition')))
+
+    def test_other_subsystem_ignored(self):
+        """
+        Events of other subsystems are ignored.
+        """
+        self.assertIs(None, parse_uevent(uevent('add', 'eth1',
+                                                subsystem='net')))
+
+
+class DeviceMonitorTests(SynchronousTestCase):
+    """
+    Tests for ``DeviceMonitor``.
+    """
+    def setUp(self):
+        self.sys_block = FilePath(self.mktemp()).child('block')
+        self.sys_block.child('vda').makedirs()
+        self.monitor = DeviceMonitor(
+            sys_root=self.sys_block.parent().path, use_netlink=False)
+
+    def test_initial_scan(self):
+        """
+        The devices in ``/sys/block`` are present from the start.
+        """
+        self.assertEqual(frozenset(['vda']), self.monitor.present())
+
+    def test_inject(self):
+        """
+        Injected add and remove events update the present devices.
+        """
+        self.monitor.inject(DeviceEvent('add', 'vdc'))
+        self.assertEqual(frozenset(['vda', 'vdc']), self.monitor.present())
+        self.monitor.inject(DeviceEvent('remove', 'vdc'))
+        self.assertEqual(frozenset(['vda']), self.monitor.present())
+
+    def test_wait_wakes_on_event(self):
+        """
+        A waiter returns as soon as the awaited device is added.
+        """
+        timer = threading.Timer(
+            0.05, self.monitor.inject, [DeviceEvent('add', 'vdc')])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertTrue(
+            self.monitor.wait_for(lambda present: 'vdc' in present, 10))
+
+    def test_wait_timeout(self):
+        """
+        Waiting past the deadline returns the last result of the
+        predicate.
+        """
+        self.assertFalse(
+            self.monitor.wait_for(lambda present: 'vdc' in present, 0.01))
+
+    def test_predicate_unlocked(self):
+        """
+        The predicate runs without the lock held, so events are applied
+        while it runs.
+        """
+        blocked = []
+
+        def predicate(present):
+            thread = threading.Thread(
+                target=self.monitor.inject, args=(DeviceEvent('add', 'vdc'),))
+            thread.start()
+            thread.join(5)
+            blocked.append(thread.is_alive())
+            return True
+        self.monitor.wait_for(predicate, 10)
+        self.assertEqual([False], blocked)
+
+    def test_resync(self):
+        """
+        Devices that appeared without an event are found by a resync.
+        """
+        self.sys_block.child('vdd').makedirs()
+        self.monitor.resync()
+        self.assertEqual(frozenset(['vda', 'vdd']), self.monitor.present())
@@ -0,0 +1,165 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``DeviceResolver`` against a fake sysfs/devfs tree.
+"""
+
+import os
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.device_resolver import DeviceResolver
+
+
+class DeviceResolverTests(SynchronousTestCase):
+    """
+    Tests for ``DeviceResolver``.
+    """
+    def setUp(self):
+        root = FilePath(self.mktemp())
+        self.sys_root = root.child('sys')
+        self.dev_root = root.child('dev')
+        self.sys_root.child('block').makedirs()
+        self.dev_root.child('disk').child('by-id').makedirs()
+        self.add_device('vda', None)
+        self.resolver = DeviceResolver(sys_root=self.sys_root.path,
+                                       dev_root=self.dev_root.path)
+
+    def add_device(self, name, serial, by_id=None):
+        device = self.sys_root.child('block').child(name)
+        device.makedirs()
+        if serial is not None:
+            device.child('serial').setContent(serial)
+        self.dev_root.child(name).touch()
+        if by_id is not None:
+            os.symlink(os.path.join('..', '..', name),
+                       self.dev_root.child('disk').child('by-id')
+                       .child('virtio-' + by_id).path)
+
+    def remove_device(self, name):
+        self.sys_root.child('block').child(name).remove()
+
+    def test_lookup_by_sysfs_serial(self):
+        """
+        A volume whose ID is the device serial resolves to that device.
+        """
+        self.add_device('vdc', '2537')
+        self.assertEqual(self.dev_root.child('vdc'),
+                         self.resolver.lookup(u'2537'))
+
+    def test_lookup_by_id_symlink(self):
+        """
+        A ``/dev/disk/by-id/virtio-<serial>`` link resolves to its target.
+        """
+        self.add_device('vdd', None, by_id='2538')
+        self.assertEqual(self.dev_root.child('vdd'),
+                         self.resolver.lookup(u'2538'))
+
+    def test_lookup_truncated_serial(self):
+        """
+        Serials longer than virtio allows match on their first 20
+        characters.
+        """
+        uuid = u'0f6a1a3e-7c4b-4d2f-9b7e-5a2c1d3e4f5a'
+        self.add_device('vdc', uuid[:20])
+        self.assertEqual(self.dev_root.child('vdc'),
+                         self.resolver.lookup(u'2537', serials=(uuid,)))
+
+    def test_lookup_unknown(self):
+        """
+        ``None`` is returned for a volume with no local device.
+        """
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+
+    def test_miss_not_rebuilt(self):
+        """
+        Looking up a volume without a device does not rebuild the index
+        while the devices stay the same.
+        """
+        self.add_device('vdc', '2537')
+        builds = []
+        build_index = self.resolver._build_index
+
+        def counting_build_index(devices):
+            builds.append(devices)
+            return build_index(devices)
+        self.patch(self.resolver, '_build_index', counting_build_index)
+        self.resolver.lookup(u'2538')
+        self.resolver.lookup(u'2538')
+        self.assertEqual(1, len(builds))
+
+    def test_refresh_on_change(self):
+        """
+        The index follows devices appearing and disappearing.
+        """
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+        self.add_device('vdc', '2537')
+        self.assertEqual(self.dev_root.child('vdc'),
+                         self.resolver.lookup(u'2537'))
+        self.remove_device('vdc')
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+
+    def test_remember(self):
+        """
+        A remembered device is used until the device disappears.
+        """
+        self.add_device('vde', 'unrelated')
+        self.resolver.remember(u'2537', 'vde')
+        self.assertEqual(self.dev_root.child('vde'),
+                         self.resolver.lookup(u'2537'))
+        self.remove_device('vde')
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+
+    def test_forget(self):
+        """
+        A forgotten device is no longer returned.
+        """
+        self.add_device('vde', 'unrelated')
+        self.resolver.remember(u'2537', 'vde')
+        self.resolver.forget(u'2537')
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+
+    def test_serial_changed(self):
+        """
+        A device whose serial changed while its name stayed is found under
+        its new serial only.
+        """
+        self.add_device('vdc', 'volA')
+        self.assertEqual(self.dev_root.child('vdc'),
+                         self.resolver.lookup(u'volA'))
+        self.sys_root.descendant(['block', 'vdc', 'serial']).setContent(
+            'volB')
+        self.assertEqual((None, self.dev_root.child('vdc')),
+                         (self.resolver.lookup(u'volA'),
+                          self.resolver.lookup(u'volB')))
+
+    def test_name_reused(self):
+        """
+        A remembered device is not returned once another device took its
+        name.
+        """
+        self.add_device('vde', 'unrelated')
+        self.resolver.remember(u'2537', 'vde')
+        self.remove_device('vde')
+        self.add_device('vde', 'other')
+        self.patch(self.resolver, 'identity',
+                   lambda name: [name, 'replaced'])
+        self.assertIs(None, self.resolver.lookup(u'2537'))
+
+    def test_persisted(self):
+        """
+        Remembered devices are kept across restarts when a state file is
+        given.
+        """
+        state = self.mktemp()
+        self.add_device('vde', 'unrelated')
+        DeviceResolver(sys_root=self.sys_root.path,
+                       dev_root=self.dev_root.path,
+                       state_file=state).remember(u'2537', 'vde')
+        resolver = DeviceResolver(sys_root=self.sys_root.path,
+                                  dev_root=self.dev_root.path,
+                                  state_file=state)
+        self.assertEqual(self.dev_root.child('vde'),
+                         resolver.lookup(u'2537'))
@@ -0,0 +1,98 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``FakeLunaNode``.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.fake_lunanode import FakeLunaNode
+from huawei_oceanstor_flocker_plugin.lndynamic import (
+    LNDynamic, APIException, TransientAPIException
+)
+
+API_ID = 'a' * 16
+API_KEY = 'b' * 128
+
+
+class FakeLunaNodeTests(SynchronousTestCase):
+    """
+    Tests for ``FakeLunaNode`` driven through ``LNDynamic``.
+    """
+    def setUp(self):
+        self.fake = FakeLunaNode(API_ID, API_KEY, volumes=3)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = LNDynamic(API_ID, API_KEY, url=self.fake.api_url)
+        self.addCleanup(self.api.pool.close)
+
+    def test_list(self):
+        """
+        The initial inventory is listed.
+        """
+        result = self.api.request('volume', 'list', {'region': 'toronto'})
+        self.assertEqual(3, len(result['volumes']))
+
+    def test_bad_signature(self):
+        """
+        Requests signed with another key are rejected.
+        """
+        api = LNDynamic(API_ID, 'c' * 128, url=self.fake.api_url)
+        self.addCleanup(api.pool.close)
+        self.assertRaises(APIException, api.request, 'volume', 'list')
+
+    def test_attach_detach(self):
+        """
+        Attaching and detaching a volume is reflected by ``volume/info``.
+        """
+        volume_id = self.api.request(
+            'volume', 'create', {'label': 'x', 'size': 1})['volume_id']
+        vm_id = self.fake.vm_id(self.fake.hostname)
+        self.api.request('volume', 'attach',
+                         {'volume_id': volume_id, 'vm_id': vm_id})
+        info = self.api.request('volume', 'info', {'volume_id': volume_id})
+        self.assertEqual(('in-use', vm_id),
+                         (info['volume']['status'],
+                          info['volume']['attached']))
+        self.api.request('volume', 'detach', {'volume_id': volume_id})
+        info = self.api.request('volume', 'info', {'volume_id': volume_id})
+        self.assertEqual('available', info['volume']['status'])
+
+    def test_unknown_volume(self):
+        """
+        Unknown volumes are reported as API errors.
+        """
+        self.assertRaises(APIException, self.api.request,
+                          'volume', 'info', {'volume_id': '1'})
+
+    def test_error_rate(self):
+        """
+        With an error rate of 1 every request fails with a transient error.
+        """
+        self.fake.error_rate = 1
+        self.api.retries = 0
+        self.assertRaises(TransientAPIException,
+                          self.api.request, 'volume', 'list')
+
+    def test_calls_counted(self):
+        """
+        API requests are counted per endpoint.
+        """
+        self.api.request('volume', 'list')
+        self.api.request('volume', 'list')
+        self.assertEqual({'volume/list/': 2}, self.fake.calls)
+
+    def test_concurrent_requests(self):
+        """
+        Requests issued in parallel are signed with distinct nonces, which
+        the fake server insists on.
+        """
+        pool = ThreadPool(8)
+        self.addCleanup(pool.terminate)
+        results = pool.map(
+            lambda _: self.api.request('volume', 'list'), range(32))
+        self.assertEqual(['yes'] * 32,
+                         [result['success'] for result in results])
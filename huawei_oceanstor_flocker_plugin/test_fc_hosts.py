@@ -0,0 +1,81 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``FcHostCache`` against a fake sysfs tree.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.fc_hosts import FcHostCache
+
+
+class FcHostCacheTests(SynchronousTestCase):
+    """
+    Tests for ``FcHostCache``.
+    """
+    def setUp(self):
+        self.sys_root = FilePath(self.mktemp())
+        self.add_host('host1', '0x10000090fa0d6754', 'Online')
+        self.add_host('host2', '0x10000090fa0d6755', 'Linkdown')
+        self.cache = FcHostCache(sys_root=self.sys_root.path)
+        self.reads = []
+        read = self.cache._read
+
+        def recording_read(host, attribute):
+            self.reads.append((host, attribute))
+            return read(host, attribute)
+        self.patch(self.cache, '_read', recording_read)
+
+    def add_host(self, host, port_name, port_state):
+        fc_host = self.sys_root.descendant(['class', 'fc_host', host])
+        fc_host.makedirs()
+        fc_host.child('port_name').setContent(port_name + '\n')
+        self.set_state(host, port_state)
+
+    def set_state(self, host, port_state):
+        self.sys_root.descendant(['class', 'fc_host', host, 'port_state']) \
+            .setContent(port_state + '\n')
+
+    def test_hbas(self):
+        """
+        Each HBA is described with the keys ``systool`` used.
+        """
+        hbas = self.cache.hbas()
+        self.assertEqual(
+            [('host1', '0x10000090fa0d6754', 'Online'),
+             ('host2', '0x10000090fa0d6755', 'Linkdown')],
+            [(hba['ClassDevice'], hba['port_name'], hba['port_state'])
+             for hba in hbas])
+
+    def test_wwpns(self):
+        """
+        Only online HBAs have their WWPN reported.
+        """
+        self.assertEqual(['10000090fa0d6754'], self.cache.wwpns())
+
+    def test_cached(self):
+        """
+        While no link state changes only ``port_state`` is read.
+        """
+        self.cache.wwpns()
+        del self.reads[:]
+        self.cache.wwpns()
+        self.assertEqual(set(['port_state']),
+                         set(attribute for _, attribute in self.reads))
+
+    def test_link_state_change(self):
+        """
+        An HBA coming online is picked up on the next call.
+        """
+        self.cache.wwpns()
+        self.set_state('host2', 'Online')
+        self.assertEqual(['10000090fa0d6754', '10000090fa0d6755'],
+                         self.cache.wwpns())
+
+    def test_no_fc(self):
+        """
+        Without an FC driver there are no HBAs.
+        """
+        self.assertEqual([], FcHostCache(sys_root=self.mktemp()).hbas())
@@ -0,0 +1,99 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``ConnectionPool``.
+"""
+
+import socket
+import threading
+import time
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.fake_lunanode import FakeLunaNode
+from huawei_oceanstor_flocker_plugin.http_pool import ConnectionPool
+from huawei_oceanstor_flocker_plugin.lndynamic import (
+    LNDynamic, TransientAPIException
+)
+from huawei_oceanstor_flocker_plugin.rate_limit import AdaptiveRateLimiter
+
+API_ID = 'a' * 16
+API_KEY = 'b' * 128
+
+RESPONSE = ('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+            'Connection: keep-alive\r\n\r\nok')
+
+
+class _ClosingServer(object):
+    """
+    A keep-alive HTTP server that closes every connection after answering
+    one request, without saying so, like a server dropping idle
+    connections.
+    """
+    def __init__(self):
+        self.requests = 0
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(5)
+        self.url = 'http://127.0.0.1:%d/' % self._sock.getsockname()[1]
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error:
+                return
+            data = ''
+            while '\r\n\r\n' not in data:
+                data += conn.recv(4096)
+            self.requests += 1
+            conn.sendall(RESPONSE)
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+class ConnectionPoolTests(SynchronousTestCase):
+    """
+    Tests for ``ConnectionPool.request``.
+    """
+    def test_stale_connection(self):
+        """
+        A request on a connection the server closed while idle is sent
+        again on a fresh connection.
+        """
+        server = _ClosingServer()
+        self.addCleanup(server.close)
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        pool.request('GET', server.url)
+        response = pool.request('POST', server.url, 'x')
+        self.assertEqual((200, 'ok', 2),
+                         (response.status, response.body, server.requests))
+
+    def test_timeout_not_resent(self):
+        """
+        A request that timed out on a reused connection is not sent again,
+        the server may have acted on it.
+        """
+        fake = FakeLunaNode(API_ID, API_KEY)
+        fake.start()
+        self.addCleanup(fake.stop)
+        api = LNDynamic(API_ID, API_KEY, url=fake.api_url,
+                        pool=ConnectionPool(),
+                        limiter=AdaptiveRateLimiter(rate=1e9, burst=1e9,
+                                                    max_rate=1e9))
+        self.addCleanup(api.pool.close)
+        api.request('volume', 'list')
+        fake.latency = 0.5
+        self.assertRaises(TransientAPIException, api.request,
+                          'volume', 'create', {'label': 'x', 'size': 1},
+                          timeout=0.1)
+        time.sleep(0.6)
+        self.assertEqual((1, 1), (fake.calls['volume/create/'],
+                                  len(fake.volumes)))
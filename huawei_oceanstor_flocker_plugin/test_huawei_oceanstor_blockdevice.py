@@ -0,0 +1,319 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``HuaweiBlockDeviceAPI`` against ``FakeLunaNode``.
+"""
+
+from uuid import uuid4
+import threading
+
+from flocker.node.agents.blockdevice import UnknownVolume
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.device_events import (
+    DeviceEvent, DeviceMonitor
+)
+from huawei_oceanstor_flocker_plugin.device_resolver import DeviceResolver
+from huawei_oceanstor_flocker_plugin.fake_lunanode import FakeLunaNode
+from huawei_oceanstor_flocker_plugin.huawei_oceanstor_blockdevice import (
+    DeviceNotFound, HuaweiBlockDeviceAPI, _is_unknown_vm_error
+)
+from huawei_oceanstor_flocker_plugin.lndynamic import APIException
+from huawei_oceanstor_flocker_plugin.rate_limit import AdaptiveRateLimiter
+
+API_ID = 'a' * 16
+API_KEY = 'b' * 128
+GiB = 1024 * 1024 * 1024
+
+
+class _DriverTestMixin(object):
+    """
+    Sets up ``self.fake``, a ``FakeLunaNode``, and ``self.api``, a driver
+    talking to it with a fake sysfs/devfs tree under ``self.root``.
+    """
+    volumes = 0
+    list_includes_status = False
+
+    def setUp(self):
+        self.fake = FakeLunaNode(
+            API_ID, API_KEY, volumes=self.volumes,
+            list_includes_status=self.list_includes_status)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.root = FilePath(self.mktemp())
+        self.root.child('block').makedirs()
+        self.api = self.make_api()
+
+    def make_api(self, **kwargs):
+        kwargs.setdefault('instance_id_file', None)
+        kwargs.setdefault('device_resolver', DeviceResolver(
+            sys_root=self.root.path, dev_root=self.root.path))
+        kwargs.setdefault('device_monitor', DeviceMonitor(
+            sys_root=self.root.path, poll_interval=0.01, use_netlink=False))
+        api = HuaweiBlockDeviceAPI(
+            cluster_id=u'cluster', api_id=API_ID, api_key=API_KEY,
+            api_url=self.fake.api_url, hostname_url=self.fake.hostname_url,
+            **kwargs)
+        api.api.limiter = AdaptiveRateLimiter(rate=1e9, burst=1e9,
+                                              max_rate=1e9)
+        # Close the kept-alive connections before the server goes away.
+        self.addCleanup(api.api.pool.close)
+        self.addCleanup(api._device_monitor.stop)
+        return api
+
+    def attach_to_peer(self, volume_id):
+        peer = self.fake.vm_id(self.fake.hostname + '-peer')
+        volume = self.fake.volumes[volume_id]
+        volume['status'] = 'in-use'
+        volume['attached'] = peer
+        return peer
+
+
+class AttachmentsFromListTests(_DriverTestMixin, SynchronousTestCase):
+    """
+    Tests for how ``list_volumes`` learns attachments.
+    """
+    volumes = 4
+
+    def test_from_list(self):
+        """
+        When ``volume/list`` carries attachment data no ``volume/info``
+        lookup is made.
+        """
+        self.fake.list_includes_status = True
+        volume_id = sorted(self.fake.volumes)[0]
+        peer = self.attach_to_peer(volume_id)
+        volumes = self.api.list_volumes()
+        self.assertEqual(
+            ({volume_id: peer}, {'volume/list/': 1}),
+            (dict((volume.blockdevice_id, volume.attached_to)
+                  for volume in volumes if volume.attached_to),
+             self.fake.calls))
+
+    def test_parallel_fallback(self):
+        """
+        Otherwise every volume is looked up with ``volume/info``.
+        """
+        volume_id = sorted(self.fake.volumes)[0]
+        peer = self.attach_to_peer(volume_id)
+        volumes = self.api.list_volumes()
+        self.assertEqual(
+            ({volume_id: peer}, {'volume/list/': 1, 'volume/info/': 4}),
+            (dict((volume.blockdevice_id, volume.attached_to)
+                  for volume in volumes if volume.attached_to),
+             self.fake.calls))
+
+
+class InstanceIdTests(_DriverTestMixin, SynchronousTestCase):
+    """
+    Tests for ``compute_instance_id`` and its persisted state.
+    """
+    def setUp(self):
+        _DriverTestMixin.setUp(self)
+        self.state = FilePath(self.mktemp())
+        self.api = self.make_api(instance_id_file=self.state.path)
+        self.vm_id = self.fake.vm_id(self.fake.hostname)
+
+    def test_restart(self):
+        """
+        After a restart the persisted ID is used without listing VMs.
+        """
+        self.api.compute_instance_id()
+        api = self.make_api(instance_id_file=self.state.path)
+        self.assertEqual((self.vm_id, {'vm/list/': 1}),
+                         (api.compute_instance_id(), self.fake.calls))
+
+    def test_hostname_changed(self):
+        """
+        The persisted ID is not used once the node hostname changed.
+        """
+        self.api.compute_instance_id()
+        self.fake.hostname += '-peer'
+        api = self.make_api(instance_id_file=self.state.path)
+        self.assertEqual(
+            (self.fake.vm_id(self.fake.hostname), {'vm/list/': 2}),
+            (api.compute_instance_id(), self.fake.calls))
+
+    def test_unknown_vm(self):
+        """
+        An attach rejected because the cached VM no longer exists drops
+        the cached ID, in memory and on disk.
+        """
+        self.api.compute_instance_id()
+        volume_id = self.api.create_volume(uuid4(), GiB).blockdevice_id
+        del self.fake.vms[self.vm_id]
+        self.fake.vms[u'new-vm'] = self.fake.hostname
+        self.assertRaises(APIException, self.api.attach_volume,
+                          volume_id, self.vm_id)
+        self.assertEqual((False, u'new-vm'),
+                         (self.state.exists(),
+                          self.api.compute_instance_id()))
+
+    def test_unknown_vm_error(self):
+        """
+        Only errors about a missing VM are recognised.
+        """
+        self.assertEqual(
+            [True, True, False, False],
+            [_is_unknown_vm_error(APIException('API error: VM not found')),
+             _is_unknown_vm_error(APIException('API error: invalid vm_id')),
+             _is_unknown_vm_error(APIException('API error: volume not '
+                                               'found')),
+             _is_unknown_vm_error(APIException('API error: VM is busy'))])
+
+
+class VolumeCacheTests(_DriverTestMixin, SynchronousTestCase):
+    """
+    Tests for the ``volume/info`` cache of the driver.
+    """
+    def setUp(self):
+        _DriverTestMixin.setUp(self)
+        self.volume_id = self.api.create_volume(uuid4(), GiB).blockdevice_id
+        self.peer = self.fake.vm_id(self.fake.hostname + '-peer')
+
+    def info_calls(self):
+        return self.fake.calls.get('volume/info/', 0)
+
+    def test_cached(self):
+        """
+        ``volume/info`` is asked once while the state is fresh.
+        """
+        self.api.get_attached_to({'id': self.volume_id})
+        self.api.get_attached_to({'id': self.volume_id})
+        self.assertEqual((1, {'hits': 1, 'misses': 1, 'size': 1}),
+                         (self.info_calls(), self.api.volume_cache.stats()))
+
+    def test_disabled(self):
+        """
+        With a TTL of 0 every lookup asks the API.
+        """
+        api = self.make_api(volume_cache_ttl=0)
+        api.get_attached_to({'id': self.volume_id})
+        api.get_attached_to({'id': self.volume_id})
+        self.assertEqual(2, self.info_calls())
+
+    def test_attach_write_through(self):
+        """
+        The attached state is written through on attach, so it is known
+        without asking ``volume/info`` again.
+        """
+        self.api.attach_volume(self.volume_id, self.peer)
+        self.assertEqual((self.peer, 1),
+                         (self.api.get_attached_to({'id': self.volume_id}),
+                          self.info_calls()))
+
+    def test_detach_invalidates(self):
+        """
+        Detaching drops the cached state.
+        """
+        self.api.attach_volume(self.volume_id, self.peer)
+        self.api.detach_volume(self.volume_id)
+        self.assertEqual((None, 2),
+                         (self.api.get_attached_to({'id': self.volume_id}),
+                          self.info_calls()))
+
+    def test_destroy_invalidates(self):
+        """
+        Destroying drops the cached state.
+        """
+        self.api.get_attached_to({'id': self.volume_id})
+        self.api.destroy_volume(self.volume_id)
+        self.assertRaises(UnknownVolume, self.api.get_attached_to,
+                          {'id': self.volume_id})
+
+
+class DevicePathTests(_DriverTestMixin, SynchronousTestCase):
+    """
+    Tests for ``get_device_path``.
+    """
+    def setUp(self):
+        _DriverTestMixin.setUp(self)
+        self.volume_id = self.api.create_volume(uuid4(), GiB).blockdevice_id
+        self.attach_to_peer(self.volume_id)
+
+    def test_found(self):
+        """
+        The device carrying the volume ID as its serial is returned.
+        """
+        device = self.root.child('block').child('vdc')
+        device.makedirs()
+        device.child('serial').setContent(self.volume_id.encode('ascii'))
+        self.assertEqual(self.root.child('vdc'),
+                         self.api.get_device_path(self.volume_id))
+
+    def test_not_found(self):
+        """
+        An attached volume without a local device is an error rather than
+        a missing path.
+        """
+        self.assertRaises(DeviceNotFound, self.api.get_device_path,
+                          self.volume_id)
+
+
+class LocalAttachTests(_DriverTestMixin, SynchronousTestCase):
+    """
+    Tests for ``attach_volume`` waiting for the device of a volume attached
+    to this node.
+    """
+    def setUp(self):
+        _DriverTestMixin.setUp(self)
+        self.volume_id = self.api.create_volume(uuid4(), GiB).blockdevice_id
+        self.vm_id = self.fake.vm_id(self.fake.hostname)
+
+    def appear_later(self, name, delay, rescan=False):
+        """
+        Add a device without a serial ``delay`` seconds after the attach is
+        requested, announced by an event or, with ``rescan``, found by
+        scanning ``/sys/block``.
+        """
+        request_attach = self.api._request_attach
+
+        def add_device():
+            self.root.child('block').child(name).makedirs()
+            if rescan:
+                self.api._device_monitor.resync()
+            else:
+                self.api._device_monitor.inject(DeviceEvent('add', name))
+
+        def delayed_request_attach(blockdevice_id, attach_to):
+            request_attach(blockdevice_id, attach_to)
+            timer = threading.Timer(delay, add_device)
+            timer.start()
+            self.addCleanup(timer.cancel)
+        self.patch(self.api, '_request_attach', delayed_request_attach)
+
+    def test_waits_for_device(self):
+        """
+        The attach returns once the device appeared, and the only new
+        device is remembered for the volume.
+        """
+        self.appear_later('vdc', 0.05)
+        self.api.attach_volume(self.volume_id, self.vm_id)
+        self.assertEqual(self.root.child('vdc'),
+                         self.api.get_device_path(self.volume_id))
+
+    def test_device_present_before(self):
+        """
+        A device that appeared before the attach, while nothing was
+        listening, is not taken for the device of the volume.
+        """
+        self.patch(self.api._device_monitor, 'start', lambda: None)
+        self.root.child('block').child('vdb').makedirs()
+        self.appear_later('vdc', 0.05, rescan=True)
+        self.api.attach_volume(self.volume_id, self.vm_id)
+        self.assertEqual(self.root.child('vdc'),
+                         self.api.get_device_path(self.volume_id))
+
+    def test_timeout(self):
+        """
+        The attach fails with ``DeviceNotFound`` after waiting
+        ``device_wait_timeout`` seconds, without remembering a device.
+        """
+        self.api._device_wait_timeout = 0.01
+        self.appear_later('vdc', 0.5)
+        self.assertRaises(DeviceNotFound, self.api.attach_volume,
+                          self.volume_id, self.vm_id)
+        self.assertRaises(DeviceNotFound, self.api.get_device_path,
+                          self.volume_id)
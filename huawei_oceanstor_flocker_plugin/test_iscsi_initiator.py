@@ -0,0 +1,67 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``InitiatorNameFile``.
+"""
+
+import os
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.iscsi_initiator import (
+    InitiatorNameFile, parse_initiator_name
+)
+
+CONTENT = """## DO NOT EDIT OR REMOVE THIS FILE!
+## If you remove this file, the iSCSI daemon will not start.
+InitiatorName=%s
+"""
+
+
+class InitiatorNameFileTests(SynchronousTestCase):
+    """
+    Tests for ``InitiatorNameFile``.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.setContent(CONTENT % 'iqn.1993-08.org.debian:01:1')
+        self.initiator = InitiatorNameFile(self.path.path)
+
+    def test_parse(self):
+        """
+        The name is taken from the ``InitiatorName`` line only.
+        """
+        self.assertEqual(
+            ['iqn.1993-08.org.debian:01:1', 'iqn.x', None],
+            [parse_initiator_name(CONTENT % 'iqn.1993-08.org.debian:01:1'),
+             parse_initiator_name('#InitiatorName=iqn.y\n'
+                                  ' InitiatorName = iqn.x \n'),
+             parse_initiator_name('## empty\n')])
+
+    def test_cached(self):
+        """
+        The file is not read again while its modification time and size
+        stay the same.
+        """
+        info = os.stat(self.path.path)
+        initiator = InitiatorNameFile(self.path.path, stat=lambda path: info)
+        initiator.get()
+        self.path.setContent(CONTENT % 'iqn.1993-08.org.debian:01:2')
+        self.assertEqual('iqn.1993-08.org.debian:01:1', initiator.get())
+
+    def test_changed(self):
+        """
+        A changed file is read again.
+        """
+        self.initiator.get()
+        self.path.setContent(CONTENT % 'iqn.1993-08.org.debian:01:22')
+        self.assertEqual('iqn.1993-08.org.debian:01:22',
+                         self.initiator.get())
+
+    def test_missing(self):
+        """
+        Without the file there is no initiator.
+        """
+        self.assertIs(None, InitiatorNameFile(self.mktemp()).get())
@@ -0,0 +1,72 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for the request nonces of ``LNDynamic``.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import lndynamic
+from huawei_oceanstor_flocker_plugin.fake_lunanode import FakeLunaNode
+from huawei_oceanstor_flocker_plugin.http_pool import ConnectionPool
+from huawei_oceanstor_flocker_plugin.lndynamic import LNDynamic
+from huawei_oceanstor_flocker_plugin.rate_limit import AdaptiveRateLimiter
+
+API_ID = 'a' * 16
+API_KEY = 'b' * 128
+
+
+class NextNonceTests(SynchronousTestCase):
+    """
+    Tests for ``next_nonce``.
+    """
+    def setUp(self):
+        self.patch(lndynamic, '_last_nonce', [0])
+        self.now = 1000.0
+
+    def next_nonce(self):
+        return int(lndynamic.next_nonce(clock=lambda: self.now))
+
+    def test_follows_clock(self):
+        """
+        Nonces are the current time in milliseconds.
+        """
+        first = self.next_nonce()
+        self.now += 0.25
+        self.assertEqual([1000000, 1000250], [first, self.next_nonce()])
+
+    def test_increasing(self):
+        """
+        Requests within one millisecond still get distinct, increasing
+        nonces.
+        """
+        self.assertEqual([1000000, 1000001, 1000002],
+                         [self.next_nonce() for _ in range(3)])
+
+
+class BurstTests(SynchronousTestCase):
+    """
+    Tests for the nonces of concurrent ``LNDynamic`` requests.
+    """
+    def test_burst_in_order(self):
+        """
+        A burst of concurrent requests reaches the server with increasing
+        nonces, none of them waiting for the clock to move.
+        """
+        self.patch(lndynamic, '_last_nonce', [0])
+        fake = FakeLunaNode(API_ID, API_KEY)
+        fake.start()
+        self.addCleanup(fake.stop)
+        api = LNDynamic(API_ID, API_KEY, url=fake.api_url,
+                        pool=ConnectionPool(), max_parallel=1,
+                        limiter=AdaptiveRateLimiter(rate=1e9, burst=1e9,
+                                                    max_rate=1e9),
+                        clock=lambda: 1000.0)
+        self.addCleanup(api.pool.close)
+        pool = ThreadPool(8)
+        self.addCleanup(pool.terminate)
+        pool.map(lambda _: api.request('volume', 'list'), range(32))
+        self.assertEqual([str(1000000 + i) for i in range(32)], fake.nonces)
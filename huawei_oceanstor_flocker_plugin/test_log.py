@@ -0,0 +1,80 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``log``.
+"""
+
+from eliot import MemoryLogger
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import log as log_module
+from huawei_oceanstor_flocker_plugin.log import log, DEBUG, WARNING
+
+
+class Formatted(object):
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'formatted'
+
+
+class LogTests(SynchronousTestCase):
+    """
+    Tests for ``log``.
+    """
+    def setUp(self):
+        self.logger = MemoryLogger()
+        self.patch(log_module, '_logger', self.logger)
+
+    def test_disabled_level_not_formatted(self):
+        """
+        Arguments of messages below the level are never rendered or
+        written.
+        """
+        argument = Formatted()
+        log('info').debug("value=%s", argument)
+        self.assertEqual((0, []), (argument.count, self.logger.messages))
+
+    def test_enabled_level_formatted(self):
+        """
+        Arguments of enabled messages are interpolated.
+        """
+        log('debug').debug("value=%s", Formatted())
+        self.assertEqual("Huawei value=formatted",
+                         self.logger.messages[0]['Debug'])
+
+    def test_mapping_argument(self):
+        """
+        A single ``dict`` argument feeds named placeholders.
+        """
+        log('info').info("%(a)s-%(b)s", {'a': 1, 'b': 2})
+        self.assertEqual("Huawei 1-2", self.logger.messages[0]['Info'])
+
+    def test_literal_percent_without_arguments(self):
+        """
+        Messages without arguments are written as they are.
+        """
+        log('info').error("100% full")
+        self.assertEqual("Huawei 100% full",
+                         self.logger.messages[0]['Error'])
+
+    def test_fields(self):
+        """
+        Keyword arguments are written as eliot fields.
+        """
+        log('info').warning("Slow call", url='/lun', seconds=3)
+        message = self.logger.messages[0]
+        self.assertEqual(('/lun', 3), (message['url'], message['seconds']))
+
+    def test_set_level(self):
+        """
+        The level can be given by name or number.
+        """
+        logger = log('error')
+        logger.set_level('WARNING')
+        self.assertEqual((True, False), (logger.isEnabledFor(WARNING),
+                                         logger.isEnabledFor(DEBUG)))
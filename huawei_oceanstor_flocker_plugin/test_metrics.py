@@ -0,0 +1,106 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``Metrics``.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.metrics import Metrics
+
+
+class MetricsTests(SynchronousTestCase):
+    """
+    Tests for ``Metrics``.
+    """
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def call(self, endpoint='volume/info', result=None, failed=None):
+        return self.metrics.run_call(endpoint, failed, lambda: result)
+
+    def test_http_calls_per_operation(self):
+        """
+        HTTP calls made while an operation runs are counted against it.
+        """
+        def operation():
+            self.call()
+            self.call()
+        self.metrics.run_operation('list_volumes', operation)
+        text = self.metrics.render_prometheus()
+        self.assertIn('huawei_blockdevice_operation_http_calls_sum'
+                      '{operation="list_volumes"} 2.000000', text)
+        self.assertIn('huawei_blockdevice_http_calls_total'
+                      '{endpoint="volume/info"} 2', text)
+
+    def test_nested_operation(self):
+        """
+        A driver method called by another operation counts towards the
+        outer one only.
+        """
+        def inner():
+            self.call()
+
+        def outer():
+            self.metrics.run_operation('compute_instance_id', inner)
+            self.call()
+        self.metrics.run_operation('attach_volume', outer)
+        text = self.metrics.render_prometheus()
+        self.assertIn('huawei_blockdevice_operation_http_calls_sum'
+                      '{operation="attach_volume"} 2.000000', text)
+        self.assertNotIn('operation="compute_instance_id"', text)
+
+    def test_propagate(self):
+        """
+        Calls made from a pool thread count against the operation that
+        handed the work over.
+        """
+        pool = ThreadPool(2)
+        self.addCleanup(pool.terminate)
+
+        def operation():
+            pool.map(self.metrics.propagate(lambda _: self.call()),
+                     range(4))
+        self.metrics.run_operation('list_volumes', operation)
+        self.assertIn('huawei_blockdevice_operation_http_calls_sum'
+                      '{operation="list_volumes"} 4.000000',
+                      self.metrics.render_prometheus())
+
+    def test_operation_error(self):
+        """
+        Operations that raise are counted as errors and the exception
+        propagates.
+        """
+        def operation():
+            raise ValueError()
+        self.assertRaises(ValueError, self.metrics.run_operation,
+                          'destroy_volume', operation)
+        self.assertIn('huawei_blockdevice_operation_errors_total'
+                      '{operation="destroy_volume"} 1',
+                      self.metrics.render_prometheus())
+
+    def test_in_band_error(self):
+        """
+        ``failed`` marks calls that report errors in their result.
+        """
+        self.call('lun', {'error': {'code': -403}},
+                  lambda result: result['error']['code'] != 0)
+        self.assertIn('huawei_blockdevice_http_errors_total'
+                      '{endpoint="lun"} 1',
+                      self.metrics.render_prometheus())
+
+    def test_histogram_buckets(self):
+        """
+        Latencies land in every bucket at or above them.
+        """
+        self.metrics._record('http', 'lun', 0.3, False)
+        text = self.metrics.render_prometheus()
+        self.assertIn('huawei_blockdevice_http_seconds_bucket'
+                      '{endpoint="lun",le="0.25"} 0', text)
+        self.assertIn('huawei_blockdevice_http_seconds_bucket'
+                      '{endpoint="lun",le="0.5"} 1', text)
+        self.assertIn('huawei_blockdevice_http_seconds_bucket'
+                      '{endpoint="lun",le="+Inf"} 1', text)
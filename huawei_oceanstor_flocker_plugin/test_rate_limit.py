@@ -0,0 +1,110 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``AdaptiveRateLimiter`` and ``retry_delay``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.rate_limit import (
+    AdaptiveRateLimiter, retry_delay
+)
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class AdaptiveRateLimiterTests(SynchronousTestCase):
+    """
+    Tests for ``AdaptiveRateLimiter``.
+    """
+    def setUp(self):
+        self.time = FakeTime()
+
+    def limiter(self, **kwargs):
+        return AdaptiveRateLimiter(clock=self.time.clock,
+                                   sleep=self.time.sleep, **kwargs)
+
+    def test_burst(self):
+        """
+        Up to ``burst`` requests go through without waiting.
+        """
+        limiter = self.limiter(rate=1, burst=5)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual(0, self.time.now)
+
+    def test_rate(self):
+        """
+        Past the burst, requests are spaced by the rate.
+        """
+        limiter = self.limiter(rate=2, burst=1)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertAlmostEqual(2.0, self.time.now)
+
+    def test_backoff_on_error(self):
+        """
+        Errors halve the rate, down to ``min_rate``.
+        """
+        limiter = self.limiter(rate=8, min_rate=3, decrease=0.5)
+        limiter.record(False, 0.1)
+        self.assertEqual(4, limiter.rate)
+        limiter.record(False, 0.1)
+        self.assertEqual(3, limiter.rate)
+
+    def test_backoff_on_slow_response(self):
+        """
+        Slow successful responses also back off.
+        """
+        limiter = self.limiter(rate=8, slow_threshold=1, decrease=0.5)
+        limiter.record(True, 2)
+        self.assertEqual(4, limiter.rate)
+
+    def test_recover(self):
+        """
+        Fast successes raise the rate additively up to ``max_rate``.
+        """
+        limiter = self.limiter(rate=4, max_rate=5, increase=0.5)
+        limiter.record(True, 0.1)
+        self.assertEqual(4.5, limiter.rate)
+        limiter.record(True, 0.1)
+        limiter.record(True, 0.1)
+        self.assertEqual(5, limiter.rate)
+
+
+class RetryDelayTests(SynchronousTestCase):
+    """
+    Tests for ``retry_delay``.
+    """
+    def test_exponential(self):
+        """
+        The delay ceiling doubles per attempt.
+        """
+        self.assertEqual([0.5, 1, 2, 4],
+                         [retry_delay(attempt, base=0.5, cap=100,
+                                      random=lambda: 1)
+                          for attempt in range(4)])
+
+    def test_cap(self):
+        """
+        The delay never exceeds ``cap``.
+        """
+        self.assertEqual(8, retry_delay(10, base=0.5, cap=8,
+                                        random=lambda: 1))
+
+    def test_jitter(self):
+        """
+        The delay is scaled by the random draw.
+        """
+        self.assertEqual(0.25, retry_delay(1, base=0.5, cap=8,
+                                           random=lambda: 0.25))
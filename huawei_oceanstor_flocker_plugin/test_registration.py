@@ -0,0 +1,75 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``RegistrationCache``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import registration as reg
+from huawei_oceanstor_flocker_plugin.registration import RegistrationCache
+
+
+class RegistrationCacheTests(SynchronousTestCase):
+    """
+    Tests for ``RegistrationCache``.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.now = 1000
+        self.cache = self.make_cache()
+
+    def make_cache(self):
+        return RegistrationCache(self.path.path, clock=lambda: self.now)
+
+    def register(self, cache):
+        cache.put(reg.HOSTS, 'node', '1')
+        cache.put(reg.HOSTGROUPS, 'Flocker_HostGroup_1', '2')
+        cache.put(reg.MEMBERS, '1', '2')
+        cache.put(reg.INITIATORS, 'iqn.x', {'host_id': '1', 'options': 'o'})
+
+    def test_persisted(self):
+        """
+        The registration is loaded back by a later process.
+        """
+        self.register(self.cache)
+        cache = self.make_cache()
+        self.assertEqual(
+            ['1', '2', '2', {'host_id': '1', 'options': 'o'}],
+            [cache.get(reg.HOSTS, 'node'),
+             cache.get(reg.HOSTGROUPS, 'Flocker_HostGroup_1'),
+             cache.get(reg.MEMBERS, '1'),
+             cache.get(reg.INITIATORS, 'iqn.x')])
+
+    def test_forget_host(self):
+        """
+        Forgetting a host drops its hostgroup and initiators too.
+        """
+        self.register(self.cache)
+        self.cache.forget_host('1')
+        cache = self.make_cache()
+        self.assertEqual(
+            [[], [], [], []],
+            [cache.items(section) for section in reg.SECTIONS])
+
+    def test_stale(self):
+        """
+        The registration is stale once the interval since it was last
+        verified has passed.
+        """
+        self.assertTrue(self.cache.stale(60))
+        self.register(self.cache)
+        self.now += 61
+        stale = self.cache.stale(60)
+        self.cache.mark_verified()
+        self.assertEqual((True, False),
+                         (stale, self.make_cache().stale(60)))
+
+    def test_unusable_file(self):
+        """
+        A corrupt state file is treated as an empty registration.
+        """
+        self.path.setContent('{"hosts": [')
+        self.assertIs(None, self.make_cache().get(reg.HOSTS, 'node'))
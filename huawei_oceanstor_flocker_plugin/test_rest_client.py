@@ -0,0 +1,669 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for the ``RestClient`` transport.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from multiprocessing.pool import ThreadPool
+import json
+import socket
+import threading
+import urllib
+import urlparse
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import constants, huawei_utils
+from huawei_oceanstor_flocker_plugin.registration import RegistrationCache
+from huawei_oceanstor_flocker_plugin.rest_client import (
+    RestClient, VolumeBackendAPIException
+)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Array(BaseHTTPRequestHandler):
+    """
+    Just enough of the OceanStor REST API: a session cookie and token are
+    handed out at login and required afterwards.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, result, cookie=None):
+        body = json.dumps(result)
+        self.send_response(status)
+        if cookie:
+            self.send_header('Set-Cookie', cookie + '; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.rfile.read(length)
+        self.server.ports.add(self.client_address[1])
+        self.server.paths.append(self.path)
+        path, _, query = self.path.partition('?')
+        kind = path.rsplit('/', 1)[-1]
+        if kind in self.server.objects and self.command == 'GET':
+            objects = self.server.objects[kind]
+            query = urlparse.parse_qs(query)
+            if 'filter' in query:
+                if not self.server.filter_supported:
+                    self._reply(200, {'error': {'code': 1077949062}})
+                    return
+                name = urllib.unquote(query['filter'][0].split('::', 1)[1])
+                objects = [item for item in objects if item['NAME'] == name]
+            if 'range' in query:
+                start, end = query['range'][0].strip('[]').split('-')
+                objects = objects[int(start):int(end)]
+            self._reply(200, {'error': {'code': 0}, 'data': objects})
+        elif self.path.endswith('/xx/sessions'):
+            self._reply(200, {'error': {'code': 0},
+                              'data': {'deviceid': 'dev',
+                                       'iBaseToken': 'token'}},
+                        cookie='session=abc')
+        elif (self.headers.getheader('iBaseToken') != 'token' or
+              self.headers.getheader('Cookie') != 'session=abc'):
+            self._reply(401, {'error': {'code': 401}})
+        else:
+            self._reply(200, {'error': {'code': 0}, 'data': self.path})
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RestClientTransportTests(SynchronousTestCase):
+    """
+    Tests for ``RestClient.do_call``.
+    """
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Array)
+        self.server.ports = set()
+        self.server.paths = []
+        self.server.objects = {}
+        self.server.filter_supported = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = RestClient({
+            'RestURL': 'http://127.0.0.1:%d/deviceManager/rest/'
+                       % self.server.server_address[1],
+            'UserName': 'admin', 'UserPassword': 'password'},
+            registration=RegistrationCache())
+        self.addCleanup(self.client.pool.close)
+
+    def test_session(self):
+        """
+        The session cookie and token from login are sent with later calls.
+        """
+        self.assertEqual('dev', self.client.login())
+        result = self.client.do_call('/lun/1')
+        self.assertEqual((0, '/deviceManager/rest/dev/lun/1'),
+                         (result['error']['code'], result['data']))
+
+    def test_http_error(self):
+        """
+        HTTP errors are reported as a connection error result.
+        """
+        result = self.client.do_call(self.client.configuration['RestURL']
+                                     + 'dev/lun/1')
+        self.assertEqual(constants.ERROR_CONNECT_TO_SERVER,
+                         result['error']['code'])
+
+    def test_keep_alive(self):
+        """
+        Sequential calls reuse one connection.
+        """
+        self.client.login()
+        for _ in range(5):
+            self.client.do_call('/lun')
+        self.assertEqual(1, len(self.server.ports))
+
+    def test_no_global_timeout(self):
+        """
+        The per-call timeout does not change the process default.
+        """
+        self.patch(socket, 'setdefaulttimeout',
+                   lambda timeout: self.fail('global timeout set'))
+        self.client.login()
+        self.client.do_call('/lun', calltimeout=3)
+
+    def test_concurrent_calls(self):
+        """
+        One client can be shared between threads.
+        """
+        self.client.login()
+        pool = ThreadPool(4)
+        self.addCleanup(pool.terminate)
+        results = pool.map(
+            lambda index: self.client.do_call('/lun/%d' % index), range(16))
+        self.assertEqual(['/deviceManager/rest/dev/lun/%d' % index
+                          for index in range(16)],
+                         [result['data'] for result in results])
+
+
+class NameIndexTests(SynchronousTestCase):
+    """
+    Tests for the name to ID lookups of ``RestClient``.
+    """
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Array)
+        self.server.ports = set()
+        self.server.paths = []
+        self.server.objects = {
+            'host': [{'NAME': 'host%d' % index, 'ID': str(index)}
+                     for index in range(100)]}
+        self.server.filter_supported = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = RestClient({}, registration=RegistrationCache())
+        self.client.url = ('http://127.0.0.1:%d/deviceManager/rest/dev'
+                           % self.server.server_address[1])
+        self.client.headers['iBaseToken'] = 'token'
+        self.client.cookies['session'] = 'abc'
+        self.addCleanup(self.client.pool.close)
+
+    def test_filtered_lookup(self):
+        """
+        Hosts are looked up by name on the array, once.
+        """
+        self.assertEqual(['42', '42'], [self.client.find_host('host42'),
+                                        self.client.find_host('host42')])
+        self.assertEqual(['/deviceManager/rest/dev/host?filter=NAME::host42'],
+                         self.server.paths)
+
+    def test_unknown_name(self):
+        """
+        Missing names are not remembered, so later creations are found.
+        """
+        self.assertIs(None, self.client.find_host('new'))
+        self.server.objects['host'].append({'NAME': 'new', 'ID': '100'})
+        self.assertEqual('100', self.client.find_host('new'))
+
+    def test_listing_fallback(self):
+        """
+        Without filter support the listing is read up to the host,
+        indexing every host on the way.
+        """
+        self.server.filter_supported = False
+        self.assertEqual(['1', '0'], [self.client.find_host('host1'),
+                                      self.client.find_host('host0')])
+        self.assertEqual(2, len(self.server.paths))
+
+    def test_listing_pages(self):
+        """
+        The listing is walked page by page, past any fixed range, and
+        stops at the page holding the name.
+        """
+        self.server.filter_supported = False
+        self.client.page_size = 30
+        self.assertEqual('75', self.client.find_host('host75'))
+        self.assertEqual(
+            ['/deviceManager/rest/dev/host?filter=NAME::host75'] +
+            ['/deviceManager/rest/dev/host?range=[%d-%d]'
+             % (start, start + 30) for start in (0, 30, 60)],
+            self.server.paths)
+
+    def test_listing_end(self):
+        """
+        A short page ends the listing.
+        """
+        self.client.page_size = 40
+        hosts = list(self.client._iter_range('/host', 'error'))
+        self.assertEqual((100, 3), (len(hosts), len(self.server.paths)))
+
+    def test_remove_host(self):
+        """
+        Removing a host drops it from the index.
+        """
+        self.client.find_host('host1')
+        self.client.remove_host('1')
+        del self.server.objects['host'][1]
+        self.assertIs(None, self.client.find_host('host1'))
+
+
+class ScriptedRestClient(RestClient):
+    """
+    A ``RestClient`` answering calls from ``responses``, a list of
+    ``(method, url prefix, result)``, and recording them in ``calls``.
+    Unmatched calls succeed with no data.
+    """
+    def __init__(self, responses, registration=None):
+        if registration is None:
+            registration = RegistrationCache()
+        RestClient.__init__(self, {}, registration=registration)
+        self.responses = responses
+        self.calls = []
+
+    def call(self, url, data=None, method=None):
+        method = method or ('POST' if data else 'GET')
+        self.calls.append((method, url))
+        for expected_method, prefix, result in self.responses:
+            if method == expected_method and url.startswith(prefix):
+                return result
+        return {'error': {'code': 0}, 'data': []}
+
+
+def _ok(data):
+    return {'error': {'code': 0}, 'data': data}
+
+
+class UnreachableArrayTests(SynchronousTestCase):
+    """
+    Tests for lookups when the array can't be reached.
+    """
+    def setUp(self):
+        self.client = ScriptedRestClient([
+            ('GET', '/',
+             {'error': {'code': constants.ERROR_CONNECT_TO_SERVER}}),
+        ])
+
+    def test_find_by_name(self):
+        """
+        A name lookup raises rather than report the name as missing, and
+        does not walk the listing.
+        """
+        self.assertRaises(VolumeBackendAPIException,
+                          self.client.find_host, 'node')
+        self.assertEqual([('GET', '/host?filter=NAME::node')],
+                         self.client.calls)
+
+    def test_initiator(self):
+        """
+        An initiator that can't be listed counts as not added and as
+        associated to a host.
+        """
+        self.assertEqual(
+            (False, True),
+            (self.client._initiator_is_added_to_array('iqn.x'),
+             self.client.is_initiator_associated_to_host('iqn.x')))
+
+
+class DoMappingTests(SynchronousTestCase):
+    """
+    Tests for ``RestClient.do_mapping``.
+    """
+    def setUp(self):
+        self.client = ScriptedRestClient([
+            ('GET', '/lungroup?filter',
+             _ok([{'NAME': constants.LUNGROUP_PREFIX + 'h', 'ID': 'lg'}])),
+            ('GET', '/mappingview?filter',
+             _ok([{'NAME': constants.MAPPING_VIEW_PREFIX + 'h',
+                   'ID': 'mv'}])),
+            ('GET', '/mappingview/associate', _ok([{'ID': 'mv'}])),
+            ('GET', '/system/', _ok({'PRODUCTVERSION': 'V100R001C00'})),
+        ])
+
+    def test_first_mapping_verifies(self):
+        """
+        The first mapping to a host checks its whole mapping view.
+        """
+        self.client.do_mapping('1', 'hg', 'h')
+        self.assertIn(('GET', '/mappingview?filter=NAME::%s'
+                       % (constants.MAPPING_VIEW_PREFIX + 'h')),
+                      self.client.calls)
+        self.assertIn(('POST', '/lungroup/associate'), self.client.calls)
+
+    def test_steady_state(self):
+        """
+        Later mappings only associate the LUN to the lungroup.
+        """
+        self.client.do_mapping('1', 'hg', 'h')
+        del self.client.calls[:]
+        self.client.do_mapping('2', 'hg', 'h')
+        self.assertEqual([('POST', '/lungroup/associate')],
+                         self.client.calls)
+
+    def test_fallback_on_error(self):
+        """
+        If the association fails the mapping view is verified again.
+        """
+        self.client.do_mapping('1', 'hg', 'h')
+        self.client.responses.insert(
+            0, ('POST', '/lungroup/associate', {'error': {'code': 1}}))
+        self.client.responses.insert(
+            0, ('GET', '/lun/associate', _ok([{'ID': '2'}])))
+        del self.client.calls[:]
+        self.client.do_mapping('2', 'hg', 'h')
+        self.assertIn(('GET', '/lungroup?filter=NAME::%s'
+                       % (constants.LUNGROUP_PREFIX + 'h')),
+                      self.client.calls)
+
+    def test_array_version_cached(self):
+        """
+        The array version is asked once.
+        """
+        self.client.do_mapping('1', 'hg', 'h')
+        self.client.do_mapping('2', 'hg', 'h')
+        self.assertEqual(1, self.client.calls.count(('GET', '/system/')))
+
+
+class BatchMappingTests(SynchronousTestCase):
+    """
+    Tests for ``RestClient.do_batch_mapping`` and
+    ``RestClient.delete_batch_mapping``.
+    """
+    def setUp(self):
+        self.client = ScriptedRestClient([
+            ('GET', '/host?filter', _ok([{'NAME': 'node', 'ID': 'h'}])),
+            ('GET', '/lungroup?filter',
+             _ok([{'NAME': constants.LUNGROUP_PREFIX + 'h', 'ID': 'lg'}])),
+            ('GET', '/mappingview?filter',
+             _ok([{'NAME': constants.MAPPING_VIEW_PREFIX + 'h',
+                   'ID': 'mv'}])),
+            ('GET', '/mappingview/associate/lungroup', _ok([{'ID': 'lg'}])),
+            ('GET', '/mappingview/associate', _ok([{'ID': 'mv'}])),
+            ('GET', '/system/', _ok({'PRODUCTVERSION': 'V100R001C00'})),
+        ])
+        self.rescans = []
+        self.patch(huawei_utils, 'rescan_scsi',
+                   lambda luns=None: self.rescans.append(luns))
+
+    def test_map(self):
+        """
+        The mapping view is verified once, then each LUN is associated to
+        the lungroup, and the SCSI hosts are rescanned once.
+        """
+        results = self.client.do_batch_mapping(['1', '2', '3'], 'hg', 'h')
+        self.assertEqual(({'1': {}, '2': {}, '3': {}}, 1, 3, 1),
+                         (results,
+                          self.client.calls.count(
+                              ('GET', '/mappingview/associate?TYPE=245&'
+                               'ASSOCIATEOBJTYPE=14&ASSOCIATEOBJID=hg')),
+                          self.client.calls.count(
+                              ('POST', '/lungroup/associate')),
+                          len(self.rescans)))
+
+    def test_targeted_rescan(self):
+        """
+        When the host LUN IDs of all the new LUNs are known, only those
+        are rescanned for.
+        """
+        self.client.responses.insert(
+            0, ('GET', '/lun/associate?TYPE=11&ASSOCIATEOBJTYPE=21',
+                _ok([{'ID': '1', 'ASSOCIATEMETADATA': '{"HostLUNID":"4"}'},
+                     {'ID': '2', 'ASSOCIATEMETADATA': '{"HostLUNID":"5"}'},
+                     {'ID': '7', 'ASSOCIATEMETADATA': '{"HostLUNID":"1"}'}])))
+        self.client.do_batch_mapping(['1', '2'], 'hg', 'h')
+        self.client.do_batch_mapping(['1', '3'], 'hg', 'h')
+        self.assertEqual([['4', '5'], None], self.rescans)
+
+    def test_host_lun_ids_error(self):
+        """
+        When the host LUN IDs can't be read the mappings still succeed,
+        with a full rescan.
+        """
+        self.client.responses.insert(
+            0, ('GET', '/lun/associate?TYPE=11&ASSOCIATEOBJTYPE=21',
+                {'error': {'code': 1}}))
+        results = self.client.do_batch_mapping(['1', '2'], 'hg', 'h')
+        self.assertEqual(({'1': {}, '2': {}}, [None]),
+                         (results, self.rescans))
+
+    def test_partial_failure(self):
+        """
+        A LUN that can't be mapped is reported without failing the rest.
+        """
+        self.client.do_mapping('1', 'hg', 'h')
+
+        def call(url, data=None, method=None):
+            if url == '/lungroup/associate' and '"2"' in data:
+                return {'error': {'code': 1}}
+            return ScriptedRestClient.call(self.client, url, data, method)
+        self.patch(self.client, 'call', call)
+        results = self.client.do_batch_mapping(['2', '3'], 'hg', 'h')
+        self.assertEqual((VolumeBackendAPIException, {}),
+                         (type(results['2']), results['3']))
+
+    def test_unmap(self):
+        """
+        The lungroup and its LUNs are looked up once; LUNs not in it are
+        already unmapped.
+        """
+        self.client.responses.insert(
+            0, ('GET', '/lun/associate', _ok([{'ID': '1'}, {'ID': '2'}])))
+        results = self.client.delete_batch_mapping(['1', '2', '3'], 'node')
+        self.assertEqual(
+            ({'1': None, '2': None, '3': None},
+             [('DELETE', '/lungroup/associate?ID=lg&ASSOCIATEOBJTYPE=11'
+                         '&ASSOCIATEOBJID=%s' % lun_id)
+              for lun_id in ('1', '2')]),
+            (results, [call for call in self.client.calls
+                       if call[0] == 'DELETE']))
+        self.assertEqual(1, self.client.calls.count(
+            ('GET', '/lun/associate?TYPE=11&ASSOCIATEOBJTYPE=256&'
+                    'ASSOCIATEOBJID=lg')))
+
+
+class DeleteMappingTests(SynchronousTestCase):
+    """
+    Tests for ``RestClient.delete_mapping``.
+    """
+    def setUp(self):
+        self.client = ScriptedRestClient([
+            ('GET', '/host?filter', _ok([{'NAME': 'node', 'ID': 'h'}])),
+            ('GET', '/lungroup?filter',
+             _ok([{'NAME': constants.LUNGROUP_PREFIX + 'h', 'ID': 'lg'}])),
+            ('GET', '/mappingview?filter',
+             _ok([{'NAME': constants.MAPPING_VIEW_PREFIX + 'h',
+                   'ID': 'mv'}])),
+            ('GET', '/mappingview/associate', _ok([{'ID': 'mv'}])),
+            ('GET', '/system/', _ok({'PRODUCTVERSION': 'V100R001C00'})),
+        ])
+        self.remove = ('DELETE', '/lungroup/associate?ID=lg&'
+                       'ASSOCIATEOBJTYPE=11&ASSOCIATEOBJID=1')
+
+    def test_steady_state(self):
+        """
+        Unmapping a LUN mapped through this client is a single call.
+        """
+        self.client.find_host('node')
+        self.client.do_mapping('1', 'hg', 'h')
+        del self.client.calls[:]
+        self.client.delete_mapping('1', 'node')
+        self.assertEqual([self.remove], self.client.calls)
+
+    def test_unknown_host(self):
+        """
+        A host that doesn't exist has nothing mapped.
+        """
+        self.client.responses.insert(0, ('GET', '/host?filter', _ok([])))
+        self.client.delete_mapping('1', 'other')
+        self.assertEqual([('GET', '/host?filter=NAME::other')],
+                         self.client.calls)
+
+    def test_already_unmapped(self):
+        """
+        Failing to remove a LUN that is in no lungroup is not an error, and
+        costs one more call.
+        """
+        self.client.responses.insert(
+            0, ('DELETE', '/lungroup/associate', {'error': {'code': 1}}))
+        self.client.find_host('node')
+        self.client.do_mapping('1', 'hg', 'h')
+        del self.client.calls[:]
+        self.client.delete_mapping('1', 'node')
+        self.assertEqual(
+            [self.remove,
+             ('GET', '/lungroup/associate?TYPE=256&ASSOCIATEOBJTYPE=11&'
+                     'ASSOCIATEOBJID=1')],
+            self.client.calls)
+
+    def test_stale_lungroup(self):
+        """
+        A LUN that is not in the cached lungroup of the host is removed
+        from the lungroup the array now has for the host.
+        """
+        self.client.find_host('node')
+        self.client.do_mapping('1', 'hg', 'h')
+        self.client.responses[:0] = [
+            ('DELETE', '/lungroup/associate?ID=lg&', {'error': {'code': 1}}),
+            ('GET', '/lungroup/associate', _ok([{'ID': 'lg2'}])),
+            ('GET', '/lungroup?filter',
+             _ok([{'NAME': constants.LUNGROUP_PREFIX + 'h', 'ID': 'lg2'}])),
+        ]
+        self.client.delete_mapping('1', 'node')
+        self.assertEqual(
+            [self.remove,
+             ('DELETE', '/lungroup/associate?ID=lg2&ASSOCIATEOBJTYPE=11&'
+                        'ASSOCIATEOBJID=1')],
+            [call for call in self.client.calls if call[0] == 'DELETE'])
+
+    def test_other_lungroup(self):
+        """
+        Failing to remove a LUN that is only in lungroups of other hosts
+        raises.
+        """
+        self.client.responses[:0] = [
+            ('DELETE', '/lungroup/associate', {'error': {'code': 1}}),
+            ('GET', '/lungroup/associate', _ok([{'ID': 'other'}])),
+        ]
+        self.assertRaises(VolumeBackendAPIException,
+                          self.client.delete_mapping, '1', 'node')
+
+    def test_still_mapped(self):
+        """
+        Failing to remove a LUN that is still in the lungroup raises.
+        """
+        self.client.responses[:0] = [
+            ('DELETE', '/lungroup/associate', {'error': {'code': 1}}),
+            ('GET', '/lungroup/associate', _ok([{'ID': 'lg'}])),
+        ]
+        self.assertRaises(VolumeBackendAPIException,
+                          self.client.delete_mapping, '1', 'node')
+
+    def test_every_host(self):
+        """
+        Without a host name the LUN is unmapped from the hosts it is
+        mapped to.
+        """
+        self.client.responses.insert(
+            0, ('GET', '/host/associate', _ok([{'ID': 'h'}])))
+        self.client.delete_mapping('1')
+        self.assertIn(self.remove, self.client.calls)
+
+
+class RegistrationTests(SynchronousTestCase):
+    """
+    Tests for the host registration cache of ``RestClient``.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.now = 1000
+        self.config = FilePath(self.mktemp())
+        self.config.setContent(
+            "<config><iSCSI><DefaultTargetIP>192.0.2.2</DefaultTargetIP>"
+            "<Initiator Name='iqn.x' ALUA='1'/></iSCSI></config>")
+
+    def make_client(self):
+        return ScriptedRestClient(
+            [('GET', '/host?filter', _ok([{'NAME': 'node', 'ID': 'h'}])),
+             ('GET', '/hostgroup?filter',
+              _ok([{'NAME': constants.HOSTGROUP_PREFIX + 'h', 'ID': 'hg'}])),
+             ('GET', '/host/associate', _ok([{'ID': 'h'}])),
+             ('GET', '/iscsi_initiator?PARENTTYPE',
+              _ok([{'ID': 'iqn.x', 'PARENTID': 'h'}])),
+             ('GET', '/iscsi_initiator',
+              _ok([{'ID': 'iqn.x', 'ISFREE': 'true'}]))],
+            registration=RegistrationCache(self.path.path,
+                                           clock=lambda: self.now))
+
+    def register(self, client):
+        host_id = client.add_host_with_check('node')
+        hostgroup_id = client.add_host_into_hostgroup(host_id)
+        client.ensure_initiator_added(self.config.path, 'iqn.x', host_id)
+        return host_id, hostgroup_id
+
+    def test_trusted(self):
+        """
+        Once registered, a node registers again without asking the array,
+        also from a new process.
+        """
+        client = self.make_client()
+        self.assertEqual(('h', 'hg'), self.register(client))
+        self.assertIn(('PUT', '/iscsi_initiator'), client.calls)
+        client = self.make_client()
+        self.assertEqual((('h', 'hg'), []),
+                         (self.register(client), client.calls))
+
+    def test_options_changed(self):
+        """
+        Changing the CHAP or ALUA settings of the initiator registers it
+        again.
+        """
+        self.register(self.make_client())
+        self.config.setContent(
+            "<config><iSCSI><DefaultTargetIP>192.0.2.2</DefaultTargetIP>"
+            "<Initiator Name='iqn.x' ALUA='0'/></iSCSI></config>")
+        client = self.make_client()
+        self.register(client)
+        self.assertIn(('PUT', '/iscsi_initiator/iqn.x'), client.calls)
+
+    def test_verify(self):
+        """
+        Verifying drops what no longer holds on the array.
+        """
+        self.register(self.make_client())
+        client = self.make_client()
+        client.responses.insert(0, ('GET', '/host/associate', _ok([])))
+        client.verify_registration()
+        del client.calls[:]
+        self.register(client)
+        self.assertEqual(
+            [('GET', '/host/associate?TYPE=21&ASSOCIATEOBJTYPE=14&'
+                     'ASSOCIATEOBJID=hg'),
+             ('POST', '/hostgroup/associate')],
+            client.calls)
+
+    def test_background_verify(self):
+        """
+        Trusting a registration last verified too long ago verifies it in
+        the background.
+        """
+        self.register(self.make_client())
+        self.now += constants.REGISTRATION_VERIFY_INTERVAL + 1
+        client = self.make_client()
+        self.register(client)
+        client._verify_thread.join()
+        self.assertFalse(client.registration.stale(
+            constants.REGISTRATION_VERIFY_INTERVAL))
+
+    def test_mapping_failure(self):
+        """
+        A host whose mapping view can't be set up is registered again on
+        next use.
+        """
+        client = self.make_client()
+        self.register(client)
+        client.responses.insert(0, ('GET', '/lungroup?filter',
+                                    {'error': {'code': 1}}))
+        self.assertRaises(VolumeBackendAPIException,
+                          client.do_mapping, '1', 'hg', 'h')
+        self.assertIs(None, client.registration.get('hosts', 'node'))
+
+    def test_persisted_by_default(self):
+        """
+        Without an explicit cache the registration is persisted to the
+        configured file, or to ``HOST_REGISTRATION_FILE``.
+        """
+        configured = RestClient({'RegistrationFile': self.path.path})
+        self.addCleanup(configured.pool.close)
+        default = RestClient({})
+        self.addCleanup(default.pool.close)
+        self.assertEqual(
+            (self.path.path, constants.HOST_REGISTRATION_FILE),
+            (configured.registration.path, default.registration.path))
@@ -0,0 +1,71 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``PayloadLogPolicy``.
+"""
+
+import json
+
+from eliot import MemoryLogger
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin import log as log_module
+from huawei_oceanstor_flocker_plugin.rest_log import (
+    PayloadLogPolicy, REDACTED
+)
+
+
+class PayloadLogPolicyTests(SynchronousTestCase):
+    """
+    Tests for ``PayloadLogPolicy``.
+    """
+    def setUp(self):
+        self.logger = MemoryLogger()
+        self.patch(log_module, '_logger', self.logger)
+
+    def test_summary_only_by_default(self):
+        """
+        By default only the status, size and latency of a call are logged.
+        """
+        PayloadLogPolicy().log_call('GET', '/host', 'host', 200, 10, 0.5,
+                                    None, '{"data": []}')
+        message = self.logger.messages[0]
+        self.assertEqual((200, 10, 0.5, False),
+                         (message['status'], message['size'],
+                          message['seconds'], 'response' in message))
+
+    def test_redaction(self):
+        """
+        Values of credential keys are masked.
+        """
+        policy = PayloadLogPolicy()
+        rendered = policy.render(json.dumps({
+            "username": "admin", "password": "secret",
+            "iBaseToken": "abc", "CHAPPASSWORD": 'a\\"b'}))
+        self.assertEqual({"username": "admin", "password": REDACTED,
+                          "iBaseToken": REDACTED, "CHAPPASSWORD": REDACTED},
+                         json.loads(rendered))
+
+    def test_truncation(self):
+        """
+        Bodies are cut to ``max_bytes``, without uncovering a credential
+        whose value is cut short.
+        """
+        policy = PayloadLogPolicy(max_bytes=20)
+        self.assertEqual('{"a": "xxxxxxxxxxxxx...[40 bytes]',
+                         policy.render('{"a": "%s"}' % ('x' * 31)))
+        self.assertNotIn('sec', policy.render(
+            '{"password": "secret", "user": "admin"}'))
+
+    def test_sampling(self):
+        """
+        Bodies are logged for one call in ``sample_every`` per endpoint.
+        """
+        policy = PayloadLogPolicy(log_payloads=True, sample_every=1,
+                                  endpoint_sample_every={'host': 3})
+        self.assertEqual(
+            ([True, False, False, True], [True, True]),
+            ([policy.sampled('host') for _ in range(4)],
+             [policy.sampled('lun') for _ in range(2)]))
@@ -0,0 +1,104 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``ScsiRescanner``.
+"""
+
+from threading import Thread
+import time
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.scsi_rescan import ScsiRescanner
+
+
+class ScsiRescannerTests(SynchronousTestCase):
+    """
+    Tests for ``ScsiRescanner`` against a fake sysfs tree with an FC host
+    (0) and an iSCSI host (1) with sessions to two targets.
+    """
+    def setUp(self):
+        self.root = FilePath(self.mktemp())
+        for host in ('host0', 'host1'):
+            scan = self.root.descendant(['class', 'scsi_host', host, 'scan'])
+            scan.parent().makedirs()
+            scan.setContent('')
+        for session, target in (('session1', 'target1:0:0'),
+                                ('session2', 'target1:0:1')):
+            self.root.descendant(['class', 'iscsi_session', session,
+                                  'device', target]).makedirs()
+        self.sleeps = []
+        self.rescanner = ScsiRescanner(sys_root=self.root.path, window=0.5,
+                                       sleep=self.sleeps.append)
+        self.writes = []
+        write = self.rescanner._write
+
+        def recording_write(host_scans):
+            self.writes.append((host_scans[0], sorted(host_scans[1])))
+            write(host_scans)
+        self.rescanner._write = recording_write
+
+    def test_full(self):
+        """
+        Without LUNs every host is fully rescanned.
+        """
+        self.rescanner.rescan()
+        self.assertEqual(
+            [('0', [('-', '-', '-')]), ('1', [('-', '-', '-')])],
+            sorted(self.writes))
+        self.assertEqual('- - -', self.root.descendant(
+            ['class', 'scsi_host', 'host0', 'scan']).getContent())
+
+    def test_targeted(self):
+        """
+        A LUN is looked for on the iSCSI session targets of iSCSI hosts
+        and on any target of the others.
+        """
+        self.rescanner.rescan([3])
+        self.assertEqual(
+            [('0', [('-', '-', '3')]),
+             ('1', [('0', '0', '3'), ('0', '1', '3')])],
+            sorted(self.writes))
+
+    def test_window(self):
+        """
+        The scan waits for the coalescing window first.
+        """
+        self.rescanner.rescan([3])
+        self.assertEqual([0.5], self.sleeps)
+
+    def test_sleep_error(self):
+        """
+        A failed wait for the window does not leave later requests waiting
+        on a batch that never runs.
+        """
+        def sleep(seconds):
+            raise KeyboardInterrupt()
+        self.rescanner._sleep = sleep
+        self.assertRaises(KeyboardInterrupt, self.rescanner.rescan, [3])
+        self.rescanner._sleep = self.sleeps.append
+        self.rescanner.rescan([4])
+        self.assertEqual([0.5], self.sleeps)
+
+    def test_coalesced(self):
+        """
+        Requests made during the window are merged into the same scan.
+        """
+        threads = []
+
+        def sleep(window):
+            thread = Thread(target=self.rescanner.rescan, args=([4],))
+            thread.start()
+            threads.append(thread)
+            while ('-', '-', '4') not in self.rescanner._pending.scans['0']:
+                time.sleep(0.01)
+        self.rescanner._sleep = sleep
+        self.rescanner.rescan([3])
+        threads[0].join()
+        self.assertEqual(
+            [('0', [('-', '-', '3'), ('-', '-', '4')]),
+             ('1', [('0', '0', '3'), ('0', '0', '4'),
+                    ('0', '1', '3'), ('0', '1', '4')])],
+            sorted(self.writes))
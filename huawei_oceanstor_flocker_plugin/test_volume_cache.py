@@ -0,0 +1,70 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``VolumeStateCache``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.volume_cache import VolumeStateCache
+
+
+class VolumeStateCacheTests(SynchronousTestCase):
+    """
+    Tests for ``VolumeStateCache``.
+    """
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = VolumeStateCache(ttl=5, max_entries=2,
+                                      clock=lambda: self.now)
+
+    def test_ttl(self):
+        """
+        Entries are returned until ``ttl`` seconds after they were stored.
+        """
+        self.cache.put('a', 1)
+        self.now += 4.9
+        fresh = self.cache.get('a')
+        self.now += 0.1
+        self.assertEqual((1, None), (fresh, self.cache.get('a')))
+
+    def test_lru(self):
+        """
+        Beyond ``max_entries`` the least recently used entry is dropped.
+        """
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual([1, None, 3], [self.cache.get(key)
+                                        for key in ('a', 'b', 'c')])
+
+    def test_stats(self):
+        """
+        Hits and misses are counted.
+        """
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('b')
+        self.assertEqual({'hits': 2, 'misses': 1, 'size': 1},
+                         self.cache.stats())
+
+    def test_invalidate(self):
+        """
+        Invalidated entries are gone.
+        """
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate('a', 'missing')
+        self.assertEqual([None, 2], [self.cache.get('a'),
+                                     self.cache.get('b')])
+
+    def test_disabled(self):
+        """
+        With a TTL of 0 nothing is stored.
+        """
+        cache = VolumeStateCache(ttl=0)
+        cache.put('a', 1)
+        self.assertIs(None, cache.get('a'))
@@ -0,0 +1,157 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Tests for ``WwnIndex`` against a fake sysfs/devfs tree.
+"""
+
+import binascii
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from huawei_oceanstor_flocker_plugin.wwn_index import (
+    WwnIndex, normalize_wwid, parse_vpd_pg83
+)
+
+WWN = '6200bc71001f37200d9a4e5f00000014'
+
+
+def _vpd_pg83(*descriptors):
+    """
+    Build a device identification VPD page.
+
+    :param descriptors: ``(code set, association, type, value)`` tuples.
+    """
+    body = ''.join(
+        chr(code_set) + chr((association << 4) | designator) + '\0' +
+        chr(len(value)) + value
+        for code_set, association, designator, value in descriptors)
+    return '\0\x83' + chr(len(body) >> 8) + chr(len(body) & 0xff) + body
+
+
+class ParseTests(SynchronousTestCase):
+    """
+    Tests for ``normalize_wwid`` and ``parse_vpd_pg83``.
+    """
+    def test_wwid(self):
+        """
+        ``wwid`` contents are converted to ``scsi_id`` form.
+        """
+        self.assertEqual(
+            ['3' + WWN, '2abcdef0123456789', '1HUAWEI_XSG1_2102', None],
+            [normalize_wwid('naa.%s\n' % WWN.upper()),
+             normalize_wwid('eui.ABCDEF0123456789'),
+             normalize_wwid('t10.HUAWEI  XSG1    2102\n'),
+             normalize_wwid('')])
+
+    def test_vpd_pg83(self):
+        """
+        The NAA designator of the LUN wins over the others and over the
+        designators of the target port.
+        """
+        page = _vpd_pg83((2, 0, 1, 'HUAWEI  XSG1'),
+                         (1, 1, 3, binascii.unhexlify('5' + '0' * 15)),
+                         (1, 0, 3, binascii.unhexlify(WWN)))
+        self.assertEqual(('3' + WWN, '1HUAWEI_XSG1'),
+                         (parse_vpd_pg83(page),
+                          parse_vpd_pg83(page[:4 + 16])))
+
+
+class WwnIndexTests(SynchronousTestCase):
+    """
+    Tests for ``WwnIndex``.
+    """
+    def setUp(self):
+        root = FilePath(self.mktemp())
+        self.sys_root = root.child('sys')
+        self.dev_root = root.child('dev')
+        self.sys_root.child('block').makedirs()
+        self.dev_root.makedirs()
+        self.add_device('vda')
+        self.index = WwnIndex(sys_root=self.sys_root.path,
+                              dev_root=self.dev_root.path)
+        self.reads = []
+        read = self.index._read
+
+        def recording_read(name, attribute):
+            self.reads.append(name)
+            return read(name, attribute)
+        self.patch(self.index, '_read', recording_read)
+
+    def add_device(self, name, **attributes):
+        device = self.sys_root.child('block').child(name).child('device')
+        device.makedirs()
+        for attribute, content in attributes.items():
+            device.child(attribute).setContent(content)
+
+    def remove_device(self, name):
+        self.sys_root.child('block').child(name).remove()
+
+    def test_lookup_wwid(self):
+        """
+        A LUN is found by the WWN in its ``wwid``, with or without the NAA
+        prefix of ``scsi_id``.
+        """
+        self.add_device('sdb', wwid='naa.%s\n' % WWN)
+        self.assertEqual([self.dev_root.child('sdb')] * 2,
+                         [self.index.lookup(WWN),
+                          self.index.lookup('3' + WWN)])
+
+    def test_lookup_vpd_pg83(self):
+        """
+        Devices without ``wwid`` are identified by their VPD page.
+        """
+        self.add_device('sdc', vpd_pg83=_vpd_pg83(
+            (1, 0, 3, binascii.unhexlify(WWN))))
+        self.assertEqual(('3' + WWN, self.dev_root.child('sdc')),
+                         (self.index.wwn('sdc'), self.index.lookup(WWN)))
+
+    def test_incremental(self):
+        """
+        Only devices that appeared are read, removed devices are dropped.
+        """
+        self.add_device('sdb', wwid='naa.%s' % WWN)
+        self.index.refresh()
+        del self.reads[:]
+        self.add_device('sdc', wwid='naa.6' + '1' * 31)
+        self.remove_device('sdb')
+        self.assertIs(None, self.index.lookup(WWN))
+        self.assertEqual(['sdc'], [name for name in self.reads
+                                   if name != 'vda'])
+
+    def test_late_wwid(self):
+        """
+        A device whose WWN could not be read yet is read again on a miss.
+        """
+        self.add_device('sdb')
+        self.index.refresh()
+        self.sys_root.descendant(['block', 'sdb', 'device', 'wwid']) \
+            .setContent('naa.%s' % WWN)
+        self.assertEqual(self.dev_root.child('sdb'), self.index.lookup(WWN))
+
+
+    def test_name_reused(self):
+        """
+        A device name taken over by another LUN is indexed again, and no
+        longer returned for the old one.
+        """
+        other = '6' + '1' * 31
+        self.add_device('sdb', wwid='naa.%s' % WWN)
+        self.index.refresh()
+        self.remove_device('sdb')
+        self.add_device('sdb', wwid='naa.%s' % other)
+        self.assertEqual((None, self.dev_root.child('sdb')),
+                         (self.index.lookup(WWN), self.index.lookup(other)))
+
+    def test_changed_in_place(self):
+        """
+        A hit is checked against the device's current WWN.
+        """
+        other = '6' + '1' * 31
+        self.add_device('sdb', wwid='naa.%s' % WWN)
+        self.index.refresh()
+        self.sys_root.descendant(['block', 'sdb', 'device', 'wwid']) \
+            .setContent('naa.%s' % other)
+        self.assertEqual((None, self.dev_root.child('sdb')),
+                         (self.index.lookup(WWN), self.index.lookup(other)))
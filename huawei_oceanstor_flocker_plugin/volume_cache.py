@@ -0,0 +1,84 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+In-process cache of LunaNode volume state.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from huawei_oceanstor_flocker_plugin import constants
+
+
+class VolumeStateCache(object):
+    """
+    A TTL cache with LRU eviction for ``volume/info`` results.
+
+    Entries expire ``ttl`` seconds after they were stored. Once more than
+    ``max_entries`` are held, the least recently used entry is dropped.
+    ``hits`` and ``misses`` count lookups so the TTL can be tuned against
+    API load.
+    """
+
+    def __init__(self, ttl=constants.VOLUME_CACHE_TTL,
+                 max_entries=constants.VOLUME_CACHE_SIZE,
+                 clock=time.time):
+        """
+        :param float ttl: Seconds an entry stays valid, ``0`` disables
+            caching.
+        :param int max_entries: Maximum number of entries kept.
+        :param clock: Callable returning the current time in seconds.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        :returns: The cached value for ``key``, or ``None`` if it is missing
+            or expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > self._clock():
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store ``value`` for ``key``, evicting the oldest entries."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Drop the entries for ``keys``."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :returns: A ``dict`` with the ``hits``, ``misses`` and ``size`` of
+            the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries)}
@@ -0,0 +1,249 @@
+# Copyright (c) 2015 Huawei Technologies Co., Ltd.
+# See LICENSE file for details.
+
+"""
+Map LUN WWNs to local SCSI block devices.
+"""
+
+from threading import Lock
+import binascii
+import os
+import struct
+
+from twisted.python.filepath import FilePath
+
+from huawei_oceanstor_flocker_plugin.log import LOG
+
+# Prefixes ``scsi_id`` puts in front of each designator type.
+_T10, _EUI64, _NAA = '1', '2', '3'
+
+# Identification descriptor types of the device identification VPD page.
+_DESIGNATOR_T10, _DESIGNATOR_EUI64, _DESIGNATOR_NAA = 1, 2, 3
+_PREFERENCE = ((_DESIGNATOR_NAA, _NAA), (_DESIGNATOR_EUI64, _EUI64),
+               (_DESIGNATOR_T10, _T10))
+
+
+def normalize_wwid(wwid):
+    """
+    Convert the content of a sysfs ``wwid`` file to ``scsi_id`` form.
+
+    :param str wwid: e.g. ``naa.6200bc71001f37200d9a4e5f00000014``.
+    :returns: e.g. ``36200bc71001f37200d9a4e5f00000014``, or ``None``.
+    """
+    kind, _, value = wwid.strip().partition('.')
+    if not value:
+        return None
+    if kind == 'naa':
+        return _NAA + value.lower()
+    if kind == 'eui':
+        return _EUI64 + value.lower()
+    if kind == 't10':
+        return _T10 + '_'.join(value.split())
+    return None
+
+
+def parse_vpd_pg83(data):
+    """
+    Get the LUN designator of a device identification VPD page.
+
+    :param bytes data: The raw page, as in sysfs ``vpd_pg83``.
+    :returns: The designator in ``scsi_id`` form, preferring NAA over
+        EUI-64 over T10, or ``None``.
+    """
+    if len(data) < 4:
+        return None
+    (length,) = struct.unpack('>H', data[2:4])
+    end = min(len(data), 4 + length)
+    found = {}
+    offset = 4
+    while offset + 4 <= end:
+        code_set = ord(data[offset]) & 0x0f
+        flags = ord(data[offset + 1])
+        size = ord(data[offset + 3])
+        value = data[offset + 4:offset + 4 + size]
+        offset += 4 + size
+        association = (flags >> 4) & 0x03
+        designator = flags & 0x0f
+        if association != 0 or designator in found:
+            continue
+        if designator in (_DESIGNATOR_NAA, _DESIGNATOR_EUI64):
+            found[designator] = binascii.hexlify(value)
+        elif designator == _DESIGNATOR_T10 and code_set == 2:
+            found[designator] = '_'.join(value.split())
+    for designator, prefix in _PREFERENCE:
+        if designator in found:
+            return prefix + found[designator]
+    return None
+
+
+class WwnIndex(object):
+    """
+    Index of local SCSI block devices by WWN, read from sysfs.
+
+    WWNs are read from ``/sys/block/<dev>/device/wwid``, or from the
+    ``vpd_pg83`` page where the kernel doesn't provide ``wwid``, in the
+    form ``/lib/udev/scsi_id --whitelisted`` prints them. Refreshing only
+    reads the devices that appeared since the last refresh, or that were
+    replaced by another device under the same name, so a lookup normally
+    costs one directory listing, a ``stat`` per device and one read of the
+    device found to check it still has the WWN. Devices without a WWN are
+    only read again when a lookup misses.
+    """
+
+    def __init__(self, sys_root='/sys', dev_root='/dev'):
+        """
+        :param str sys_root: Mount point of sysfs.
+        :param str dev_root: Mount point of devfs.
+        """
+        self._sys_block = os.path.join(sys_root, 'block')
+        self._dev_root = dev_root
+        self._lock = Lock()
+        self._wwns = {}
+        self._identities = {}
+        self._by_wwn = {}
+
+    def devices(self):
+        """
+        :returns: A ``frozenset`` of the block device names present.
+        """
+        try:
+            names = os.listdir(self._sys_block)
+        except OSError as err:
+            LOG.error("Can't list %s: %s", self._sys_block, err)
+            return frozenset()
+        return frozenset(names)
+
+    def identity(self, name):
+        """
+        :returns: What tells device ``name`` apart from a later device
+            given the same name, or ``None`` if it is not present.
+        """
+        try:
+            info = os.lstat(os.path.join(self._sys_block, name))
+        except OSError:
+            return None
+        return (info.st_ino, info.st_ctime)
+
+    def _read(self, name, attribute):
+        path = os.path.join(self._sys_block, name, 'device', attribute)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def read_wwn(self, name):
+        """
+        :returns: The WWN of block device ``name``, or ``None`` if it has
+            none (yet).
+        """
+        wwid = self._read(name, 'wwid')
+        if wwid:
+            wwn = normalize_wwid(wwid)
+            if wwn:
+                return wwn
+        page = self._read(name, 'vpd_pg83')
+        if page:
+            return parse_vpd_pg83(page)
+        return None
+
+    def refresh(self, retry=False):
+        """
+        Read the WWNs of new devices and drop the removed ones.
+
+        A device replaced by another one under the same name counts as
+        both removed and new.
+
+        :param bool retry: Also read again the devices that had no WWN,
+            which a device may lack just after it appears.
+        """
+        devices = {}
+        for name in self.devices():
+            identity = self.identity(name)
+            if identity is not None:
+                devices[name] = identity
+        with self._lock:
+            removed = set(name for name in self._wwns
+                          if devices.get(name) != self._identities[name])
+            added = set(name for name in devices
+                        if self._identities.get(name) != devices[name])
+            if retry:
+                added.update(name for name, wwn in self._wwns.items()
+                             if wwn is None and name in devices)
+        wwns = dict((name, self.read_wwn(name)) for name in added)
+        with self._lock:
+            for name in removed:
+                self._drop(name)
+            for name, wwn in wwns.items():
+                self._drop(name)
+                self._wwns[name] = wwn
+                self._identities[name] = devices[name]
+                if wwn is not None:
+                    self._by_wwn[wwn] = name
+        if removed or added:
+            LOG.debug("WWN index refreshed: added=%s, removed=%s",
+                      sorted(wwns), sorted(removed))
+
+    def _drop(self, name):
+        # Called with the lock held.
+        wwn = self._wwns.pop(name, None)
+        self._identities.pop(name, None)
+        if self._by_wwn.get(wwn) == name:
+            del self._by_wwn[wwn]
+
+    def wwn(self, name):
+        """
+        :returns: The WWN of block device ``name``, or ``None``.
+        """
+        self.refresh()
+        with self._lock:
+            wwn = self._wwns.get(name)
+        if wwn is None:
+            self.refresh(retry=True)
+            with self._lock:
+                wwn = self._wwns.get(name)
+        return wwn
+
+    def _find(self, wwn):
+        """
+        :returns: The name of the device of a LUN in the index, checked
+            against sysfs, or ``None``.
+        """
+        with self._lock:
+            name = self._by_wwn.get(wwn) or self._by_wwn.get(_NAA + wwn)
+            indexed = self._wwns.get(name)
+        if name is None:
+            return None
+        current = self.read_wwn(name)
+        if current == indexed:
+            return name
+        # The device changed without the index noticing: index it again.
+        with self._lock:
+            identity = self._identities.get(name)
+            self._drop(name)
+            self._wwns[name] = current
+            self._identities[name] = identity
+            if current is not None:
+                self._by_wwn[current] = name
+        if current in (wwn, _NAA + wwn):
+            return name
+        return None
+
+    def lookup(self, wwn):
+        """
+        Find the local device of a LUN.
+
+        :param str wwn: The LUN WWN, with or without the ``scsi_id`` NAA
+            prefix ``3``.
+        :returns: A ``FilePath`` for the device, or ``None`` if it is not
+            present on this node.
+        """
+        wwn = wwn.strip().lower()
+        self.refresh()
+        name = self._find(wwn)
+        if name is None:
+            self.refresh(retry=True)
+            name = self._find(wwn)
+        if name is None:
+            return None
+        return FilePath(os.path.join(self._dev_root, name))